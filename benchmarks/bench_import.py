@@ -0,0 +1,58 @@
+"""Benchmark the cold start of Espresso
+
+Each measurement runs in a fresh interpreter, imports `espresso`, and designs
+one sequence with the given model. Reports the median import time, the
+median time to the first designed sequence, and whether torch was loaded.
+
+Usage: python benchmarks/bench_import.py [--models ec fungi-v1] [--repeats 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import espresso
+imported = time.perf_counter()
+espresso.design_coding_sequence("MENFHHRPFKGGFGVGRVPTSLYYSLSDFSLSAIS", {model!r})
+designed = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "first_design_s": designed - start,
+    "torch_loaded": "torch" in sys.modules,
+}}))
+"""
+
+
+def measure(model, repeats):
+    """Time `repeats` cold starts designing a sequence with `model`"""
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", SNIPPET.format(model=model)],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "model": model,
+        "repeats": repeats,
+        "import_s": statistics.median(run["import_s"] for run in runs),
+        "first_design_s": statistics.median(run["first_design_s"] for run in runs),
+        "torch_loaded": any(run["torch_loaded"] for run in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", default=["ec", "coli-top", "fungi-v1"])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [measure(model, args.repeats) for model in args.models]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the optimized (int8, traced) transformer against fp32
+
+For each path, designs batches of proteins of each length and reports the
+median codons designed per second. Also reports how closely the optimized
+model's next-codon distributions follow the fp32 model's, along the fp32
+greedy design of each protein, with and without the synonymous codon
+constraint: the mean and max total variation distance, and how often both
+pick the same most likely codon.
+
+Usage: python benchmarks/bench_inference.py [--lengths 50 200 500] [--batch-size 32] [--threads 1]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+import torch
+
+from espresso.data import load_transformer
+from espresso.model import create_mask
+from espresso.transformer import TransformerModel
+
+
+RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def random_protein(length, rng):
+    return "M" + "".join(rng.choice(RESIDUES) for _ in range(length - 1))
+
+
+def throughput(model, proteins, repeats):
+    """Median codons designed per second over `repeats` runs"""
+    model.generate_sequences(proteins[:2])
+    rates = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.generate_sequences(proteins, batch_size=len(proteins))
+        rates.append(sum(map(len, proteins)) / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+def agreement(reference, optimized, protein, constrained):
+    """Compare next-codon distributions along the greedy design of `reference`"""
+    src = reference.tokenize_proteins([protein])
+    src_mask, _, src_padding_mask, _ = create_mask(src, src[:1])
+    allowed = reference.constrain_tokens([protein], src.shape[0]) if constrained else None
+    tgt = reference.model.sample(src, src_mask, src.shape[0] + 1, reference.BOS_IDX, src_padding_mask=src_padding_mask,
+                                 allowed_tokens=allowed, strategy="greedy")
+    expected, actual = (m.model.score(src, src_mask, tgt, src_padding_mask, allowed).exp() for m in [reference, optimized])
+    distance = 0.5 * (expected - actual).abs().sum(dim=-1)
+    return {
+        "mean_total_variation": distance.mean().item(),
+        "max_total_variation": distance.max().item(),
+        "top_codon_agreement": (expected.argmax(dim=-1) == actual.argmax(dim=-1)).float().mean().item(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="fungi-v1")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[50, 200, 500])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    models = {
+        "fp32": TransformerModel(load_transformer(args.model), num_threads=args.threads),
+        "optimized": TransformerModel(load_transformer(args.model), optimized=True, num_threads=args.threads),
+    }
+
+    rng = random.Random(args.seed)
+    results = {"model": args.model, "threads": torch.get_num_threads(), "batch_size": args.batch_size, 
+               "codons_per_s": [], "accuracy": []}
+    for length in args.lengths:
+        proteins = [random_protein(length, rng) for _ in range(args.batch_size)]
+        results["codons_per_s"].append({"length": length, **{
+            name: throughput(model, proteins, args.repeats) for name, model in models.items()
+        }})
+        for constrained in [True, False]:
+            results["accuracy"].append({"length": length, "constrained": constrained, 
+                                        **agreement(models["fp32"], models["optimized"], proteins[0], constrained)})
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
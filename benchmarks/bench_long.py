@@ -0,0 +1,66 @@
+"""Benchmark peak memory and time against protein length for the transformer
+
+Designs one protein of each length in a fresh interpreter, both in one
+piece (up to the longest protein the model can take) and in windows (see
+`TransformerModel.generate_windowed`), and reports the seconds taken, and
+the peak resident memory of the process before and after designing, in MB.
+Designing in one piece grows with the length; in windows, it stays flat.
+
+Usage: python benchmarks/bench_long.py [--lengths 500 1000 2000 4000 8000] [--window 1000] [--context 200]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+
+DESIGN = """
+import json, random, resource, time
+import espresso
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+model = espresso.get_model({model!r}, num_threads=1)
+rng = random.Random(0)
+protein = "M" + "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range({length} - 1))
+before = peak_mb()
+start = time.perf_counter()
+if {window!r} is None:
+    model.generate_sequence(protein, strategy="greedy")
+else:
+    model.generate_windowed(protein, window={window!r}, context={context!r}, strategy="greedy")
+print(json.dumps({{"seconds": time.perf_counter() - start, "peak_mb_before": before, "peak_mb": peak_mb()}}))
+"""
+
+
+def run(model, length, window, context):
+    snippet = DESIGN.format(model=model, length=length, window=window, context=context)
+    output = subprocess.run([sys.executable, "-c", snippet], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="fungi-v1")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[500, 1000, 2000, 4000, 8000])
+    parser.add_argument("--window", type=int, default=1000)
+    parser.add_argument("--context", type=int, default=200)
+    args = parser.parse_args()
+
+    from espresso.main import get_model
+    max_length = get_model(args.model).max_length
+
+    results = {"model": args.model, "window": args.window, "context": args.context, "max_length": max_length,
+               "lengths": []}
+    for length in args.lengths:
+        result = {"length": length, "windowed": run(args.model, length, args.window, args.context)}
+        if length <= max_length:
+            result["whole"] = run(args.model, length, None, None)
+        results["lengths"].append(result)
+        print(json.dumps(result), file=sys.stderr)
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Benchmark designing, scrubbing and model loading, to catch regressions
+
+Runs each benchmark and writes the results as JSON, tagged with the current
+commit. Every result has a unique `name` and a median time in `seconds`, so
+that two runs can be compared with `--compare`.
+
+- design: one protein of each length, with each model
+- scrub: a designed sequence, against avoid lists of each size
+- load: cold (fresh interpreter), warm (data already imported, model not
+  constructed) and cached (from the model registry) loading of each model
+- retries: how many rounds of unconstrained sampling the transformer needs
+  before every design translates back to its protein, against a single
+  constrained pass
+
+Usage: python benchmarks/bench_suite.py [--quick] [-o results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from espresso.lib import ScrubError, translate
+from espresso.main import get_model, make_scrubber, model_registry
+
+
+RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+
+COLD_LOAD = """
+import json, time
+start = time.perf_counter()
+import espresso
+espresso.get_model({model!r})
+print(json.dumps(time.perf_counter() - start))
+"""
+
+COLD_IMPORT = """
+import json, time
+start = time.perf_counter()
+import espresso.data
+espresso.data.load_codon_use("sc")
+print(json.dumps(time.perf_counter() - start))
+"""
+
+
+def random_protein(length, rng):
+    return "M" + "".join(rng.choice(RESIDUES) for _ in range(length - 1))
+
+
+def timed(function, repeats):
+    """The median time of `repeats` calls of `function`, and its last result"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def run_python(snippet):
+    output = subprocess.run([sys.executable, "-c", snippet], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_design(models, lengths, repeats, rng):
+    for slug in models:
+        model = get_model(slug)
+        # the transformer is far slower than the codon models, so gets fewer repeats
+        model_repeats = 1 if slug == "fungi-v1" else repeats
+        model.generate_sequence("MENFHHRPFK")
+        for length in lengths:
+            protein = random_protein(length, rng)
+            result = {"name": f"design/{slug}/{length}", "model": slug, "length": length}
+            try:
+                seconds, _ = timed(lambda: model.generate_sequence(protein), model_repeats)
+                result.update(seconds=seconds, codons_per_s=length / seconds)
+            except Exception as error:
+                result.update(seconds=None, error=f"{type(error).__name__}: {error}")
+            yield result
+
+
+def bench_scrub(sizes, length, repeats, rng):
+    model = get_model("ec")
+    for size in sizes:
+        motifs = ["".join(rng.choice("ACGT") for _ in range(6)) for _ in range(size)]
+        scrubber = make_scrubber(motifs, "ec")
+        sequence = model.generate_sequence(random_protein(length, rng), rng=rng.randrange(2**32))
+        result = {"name": f"scrub/{size}", "motifs": size, "length": length,
+                  "flagged_codons": len(scrubber.identify_codons_to_resample(sequence))}
+        try:
+            seconds, _ = timed(lambda: scrubber.scrub(sequence, rng=0), repeats)
+            result.update(seconds=seconds)
+        except ScrubError as error:
+            result.update(seconds=None, error=f"ScrubError: {error}")
+        yield result
+
+
+def bench_load(models, repeats):
+    seconds = statistics.median(run_python(COLD_IMPORT) for _ in range(repeats))
+    yield {"name": "load/cold/espresso.data", "seconds": seconds}
+
+    for slug in models:
+        seconds = statistics.median(run_python(COLD_LOAD.format(model=slug)) for _ in range(repeats))
+        yield {"name": f"load/cold/{slug}", "model": slug, "seconds": seconds}
+
+        def construct():
+            model_registry.evict(slug)
+            return get_model(slug)
+
+        seconds, _ = timed(construct, repeats)
+        yield {"name": f"load/warm/{slug}", "model": slug, "seconds": seconds}
+
+        seconds, _ = timed(lambda: get_model(slug), repeats)
+        yield {"name": f"load/cached/{slug}", "model": slug, "seconds": seconds}
+
+
+def unconstrained_rounds(model, proteins, max_iter):
+    """Sample unconstrained designs until each translates back to its protein,
+    returning the number of rounds and the total number of designs sampled"""
+    pending, rounds, attempts = list(proteins), 0, 0
+    while pending and rounds < max_iter:
+        rounds += 1
+        attempts += len(pending)
+        designs = sample_once(model, pending)
+        pending = [protein for protein, design in zip(pending, designs) if design is None]
+    return rounds, attempts, len(pending)
+
+
+def sample_once(model, proteins):
+    """One batched pass of unconstrained sampling, with None for the designs 
+    that don't translate back to their protein"""
+    from espresso.model import create_mask
+
+    src = model.tokenize_proteins(proteins)
+    src_mask, _, src_padding_mask, _ = create_mask(src, src[:1])
+    tokens = model.model.sample(src, src_mask, src.shape[0] + 1, model.BOS_IDX, src_padding_mask=src_padding_mask)
+    designs = [model.detokenize_codons(tokens[:, i]) for i in range(len(proteins))]
+    return [design if translate(design) == protein else None for protein, design in zip(proteins, designs)]
+
+
+def bench_retries(lengths, count, max_iter, rng):
+    # only import torch when the transformer is benchmarked 
+    import torch
+
+    model = get_model("fungi-v1")
+    torch.manual_seed(0)
+    for length in lengths:
+        proteins = [random_protein(length, rng) for _ in range(count)]
+        seconds, (rounds, attempts, failed) = timed(lambda: unconstrained_rounds(model, proteins, max_iter), 1)
+        yield {"name": f"retries/unconstrained/{length}", "length": length, "proteins": count, "seconds": seconds,
+               "rounds": rounds, "attempts_per_protein": attempts / count, "failed": failed}
+
+        seconds, _ = timed(lambda: model.generate_sequences(proteins), 1)
+        yield {"name": f"retries/constrained/{length}", "length": length, "proteins": count, "seconds": seconds,
+               "rounds": 1, "attempts_per_protein": 1.0, "failed": 0}
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the ratio of the time of each result to the baseline's"""
+    before = {result["name"]: result.get("seconds") for result in baseline["results"]}
+    print(f"{'benchmark':<32} {'before':>10} {'after':>10} {'ratio':>7}", file=sys.stderr)
+    for result in results["results"]:
+        old, new = before.get(result["name"]), result.get("seconds")
+        if old and new:
+            print(f"{result['name']:<32} {old:>10.4g} {new:>10.4g} {new / old:>7.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", default="-", help="JSON file for the results, or - for stdout (default)")
+    parser.add_argument("--compare", help="JSON results of an earlier run, to compare against")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer repeats, for a smoke test")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["design", "scrub", "load", "retries"])
+    args = parser.parse_args()
+
+    if args.quick:
+        lengths, transformer_lengths, sizes, repeats = [50, 500], [50], [1, 20], 2
+        retry_lengths, retry_count = [10], 4
+    else:
+        lengths, transformer_lengths, sizes, repeats = [50, 200, 1000, 5000], [50, 200, 1000, 5000], \
+            [1, 10, 50, 100, 200], args.repeats
+        retry_lengths, retry_count = [10, 20, 40], 16
+
+    rng = random.Random(args.seed)
+    results = []
+    if "design" not in args.skip:
+        results += bench_design(["ec", "coli-top"], lengths, repeats, rng)
+        results += bench_design(["fungi-v1"], transformer_lengths, repeats, rng)
+    if "scrub" not in args.skip:
+        results += bench_scrub(sizes, 1000, repeats, rng)
+    if "load" not in args.skip:
+        results += bench_load(["ec", "fungi-v1"], repeats)
+    if "retries" not in args.skip:
+        results += bench_retries(retry_lengths, retry_count, 20, rng)
+
+    results = {
+        "commit": commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(results, indent=4) + "\n"
+    if args.output == "-":
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(results, json.load(handle))
+
+
+if __name__ == "__main__":
+    main()
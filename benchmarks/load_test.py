@@ -0,0 +1,133 @@
+"""Load test a running design server (see `espresso.serve`)
+
+Opens `--concurrency` keep-alive connections, each sending design requests
+for random proteins one after another, for `--duration` seconds, then
+reports the throughput and client-side latency percentiles, along with
+the server's own metrics (batch sizes, queue depth), as JSON.
+
+Usage: python benchmarks/load_test.py [--port 8000] [--concurrency 32] [--duration 10] [--start]
+
+With `--start`, a server is started for the test (with `--max-batch-size`
+and `--max-wait-ms`), and stopped afterwards.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import numpy
+
+
+RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+
+
+async def http_request(reader, writer, method, path, payload=None):
+    """Send one request on a keep-alive connection, and read its JSON response"""
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+
+async def client(host, port, deadline, lengths, rng, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            protein = "M" + "".join(rng.choice(RESIDUES) for _ in range(rng.randint(*lengths) - 1))
+            start = time.perf_counter()
+            status, response = await http_request(reader, writer, "POST", "/design", {"protein": protein})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(response.get("error"))
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, concurrency, duration, lengths, seed):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, deadline, lengths, random.Random(seed + i), latencies, errors)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, server_metrics = await http_request(reader, writer, "GET", "/metrics")
+    writer.close()
+
+    latencies = numpy.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_ms": dict(zip(["p50", "p90", "p99"], numpy.percentile(latencies, [50, 90, 99]).tolist())),
+        "server": server_metrics,
+    }
+
+
+def wait_for_server(host, port, server=None, timeout=120):
+    """Wait until the server answers, or exit with its return code if 
+    `server` (the `Popen` of a server started for the test) dies first"""
+    async def health():
+        reader, writer = await asyncio.open_connection(host, port)
+        await http_request(reader, writer, "GET", "/health")
+        writer.close()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return asyncio.run(health())
+        except OSError:
+            if server is not None and server.poll() is not None:
+                print(f"espresso: the server exited with code {server.returncode}", file=sys.stderr)
+                sys.exit(server.returncode or 1)
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=10., help="seconds to send requests for")
+    parser.add_argument("--lengths", type=int, nargs=2, default=[50, 300], help="range of protein lengths")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", action="store_true", help="start a server for the test")
+    parser.add_argument("-m", "--model", default="fungi-v1", help="model for the started server")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="for the started server")
+    parser.add_argument("--max-wait-ms", type=float, default=5., help="for the started server")
+    args = parser.parse_args()
+
+    server = None
+    if args.start:
+        server = subprocess.Popen([sys.executable, "-m", "espresso.cli", "serve", "-m", args.model,
+                                   "--host", args.host, "--port", str(args.port),
+                                   "--max-batch-size", str(args.max_batch_size), "--max-wait-ms", str(args.max_wait_ms)])
+    try:
+        wait_for_server(args.host, args.port, server)
+        results = asyncio.run(load_test(args.host, args.port, args.concurrency, args.duration, args.lengths, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,14 @@
 import json 
-from itertools import product 
 import argparse 
-from collections import Counter 
 
-from biotite.sequence.io.fasta import FastaFile 
-
-from espresso.lib import CodonSequence 
+from espresso.counting import count_codons, codon_use_table 
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument("fasta", help="FASTA file containing coding sequences") 
+parser.add_argument("fasta", nargs="+", help="FASTA files containing coding sequences") 
+parser.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default one per CPU)")
 args = parser.parse_args() 
-fasta = FastaFile.read(args.fasta)
-
-codons = []
-for header, record in fasta.items():
-    codon_sequence = CodonSequence(record) 
-    for codon in codon_sequence.codons:
-        codons.append(codon) 
-
 
-result = dict(Counter(codons))
+result = codon_use_table(count_codons(args.fasta, processes=args.processes))
 
 print(json.dumps(result, indent=4))
@@ -1 +1,16 @@
-from espresso.main import design_coding_sequence, scrub_sequence
+# The public API is imported on first use (PEP 562), so that `import espresso` 
+# stays cheap, and torch is only loaded when a transformer model is used 
+_MAIN_EXPORTS = ["design_coding_sequence", "design_candidates", "scrub_sequence", "get_model", "model_registry", "Stats"]
+
+__all__ = list(_MAIN_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _MAIN_EXPORTS:
+        from espresso import main
+        return getattr(main, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from espresso.main import get_model, make_scrubber, model_registry, SCRUB_MODELS
+
+
+# per-process state of a worker: the model or scrubber it loaded at start up
+_worker = {}
+
+
+def _init_design_worker(model, params):
+    _worker["model"] = get_model(model, **params)
+
+
+def _init_scrub_worker(avoid, model):
+    _worker["scrubber"] = make_scrubber(avoid, model)
+
+
+def _describe(error):
+    return f"{type(error).__name__}: {error}"
+
+
+def _design_chunk(chunk):
+    """Design a chunk of (name, protein) records in a worker"""
+    model = _worker["model"]
+
+    # the transformer models design a whole chunk in one batch
+    if hasattr(model, "generate_sequences"):
+        try:
+            sequences = model.generate_sequences([protein for _, protein in chunk])
+            return [(name, sequence, None) for (name, _), sequence in zip(chunk, sequences)]
+        except Exception:
+            pass  # fall back to one record at a time, to find the ones that failed
+
+    results = []
+    for name, protein in chunk:
+        try:
+            results.append((name, model.generate_sequence(protein), None))
+        except Exception as error:
+            results.append((name, None, _describe(error)))
+    return results
+
+
+def _scrub_chunk(chunk):
+    """Scrub a chunk of (name, CDS) records in a worker"""
+    scrubber = _worker["scrubber"]
+    results = []
+    for name, sequence in chunk:
+        try:
+            results.append((name, scrubber.scrub(sequence), None))
+        except Exception as error:
+            results.append((name, None, _describe(error)))
+    return results
+
+
+def _chunked(records, chunk_size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _imap_ordered(function, records, initializer, initargs, processes, chunk_size, max_pending):
+    """Apply `function` to chunks of `records` over a process pool, yielding
+    the results in input order, with at most `max_pending` chunks in flight"""
+    chunks = _chunked(records, chunk_size)
+
+    if processes == 1:
+        initializer(*initargs)
+        for chunk in chunks:
+            yield from function(chunk)
+        return
+
+    # forked workers inherit whatever this process has loaded, so load it here 
+    # first: the workers then share the model's pages, rather than each 
+    # loading a copy of its own 
+    if multiprocessing.get_start_method() == "fork":
+        initializer(*initargs)
+
+    pending = deque()
+    with ProcessPoolExecutor(processes, initializer=initializer, initargs=initargs) as pool:
+        try:
+            for chunk in chunks:
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+                pending.append(pool.submit(function, chunk))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def design_many(records, model="sc", processes=None, chunk_size=16, max_pending=None, **params):
+    """Design coding sequences for many proteins, across a pool of processes
+
+    Each worker process loads the model once (or, where processes are
+    forked, shares the one loaded by this process). Records are read lazily and at
+    most `max_pending` chunks of `chunk_size` records are in flight at once,
+    so memory stays bounded for inputs of any size.
+
+    Parameters
+    ----------
+    records: iterable
+        Pairs of (name, protein sequence), for example from `read_fasta`
+    model: str
+        The name of a model
+    processes: int
+        The number of worker processes, by default one per CPU. With 1, the
+        records are designed in this process
+    params:
+        Keyword arguments for the model class, for example `threshold`
+
+    Yields
+    ------
+    tuple
+        A (name, sequence, error) triple for each record, in input order.
+        If designing a record failed, the sequence is None and the error
+        describes why; the other records are not affected
+
+    Examples
+    --------
+    >>> from espresso.fasta import read_fasta
+    >>> for name, cds, error in design_many(read_fasta("proteome.fa.gz"), "ec"):
+    ...     print(name, cds or error)
+    """
+    if model not in model_registry:
+        raise ValueError(f'Model "{model}" not found')
+    processes = processes or os.cpu_count()
+    max_pending = max_pending or 2 * processes
+    return _imap_ordered(_design_chunk, records, _init_design_worker, (model, params),
+                         processes, chunk_size, max_pending)
+
+
+def scrub_many(records, avoid, model="sc", processes=None, chunk_size=16, max_pending=None):
+    """Scrub many coding sequences of undesired features, across a pool of processes
+
+    Works like `design_many`, with `records` of (name, nucleotide sequence)
+    and the `avoid` options of `scrub_sequence`
+    """
+    if model not in SCRUB_MODELS:
+        raise ValueError(f'Model "{model}" not found')
+    processes = processes or os.cpu_count()
+    max_pending = max_pending or 2 * processes
+    return _imap_ordered(_scrub_chunk, records, _init_scrub_worker, (list(avoid), model),
+                         processes, chunk_size, max_pending)
@@ -0,0 +1,132 @@
+"""A content-addressed cache of deterministic design and scrub results
+
+Results are keyed by a digest of everything that determines them: the kind
+of job, the model slug and a digest of its data, the input sequence, the
+constraints, the seed and the decoding parameters. Only deterministic jobs
+are cached (see `design_coding_sequence` and `scrub_sequence`), so a cached
+result is always the result the job would have produced.
+
+Examples
+--------
+Keep up to 10,000 results in memory, and share results between processes
+(and runs) in an SQLite file
+
+>>> espresso.main.result_cache = ResultCache(max_entries=10_000, path="espresso-cache.sqlite")
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """Digest JSON-serializable `parts` into a cache key"""
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def data_digest(data):
+    """A digest of model data (a codon use dict, or a model's weights, as a
+    path or bytes), or None if the data can't be digested"""
+    if isinstance(data, (str, os.PathLike)) and os.path.isfile(data):
+        with open(data, "rb") as handle:
+            payload = handle.read()
+    elif isinstance(data, io.BytesIO):
+        payload = data.getvalue()
+    elif isinstance(data, (bytes, bytearray)):
+        payload = bytes(data)
+    elif isinstance(data, dict):
+        payload = json.dumps(data, sort_keys=True).encode()
+    else:
+        return None
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ResultCache:
+    """A two-tier cache of string results: an in-memory LRU, and optionally
+    an SQLite file on disk
+
+    The in-memory tier holds at most `max_entries` results, and at most
+    `max_bytes` bytes of results, evicting the least recently used ones.
+    With a `path`, results are also stored in an SQLite database there,
+    which any number of threads and processes can use at once; results
+    found on disk are promoted to memory.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 << 20, path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _db(self):
+        # sqlite connections can't be shared with forked processes, so each
+        # process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.commit()
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def _remember(self, key, value):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._size += len(value)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, key):
+        """Get the result stored under `key`, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            elif self.path is not None:
+                row = self._db().execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._remember(key, value)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store the result `value` (a string) under `key`"""
+        with self._lock:
+            self._remember(key, value)
+            if self.path is not None:
+                with self._db() as connection:
+                    connection.execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, value))
+
+    def clear(self):
+        """Drop every result, from memory and from disk"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            if self.path is not None:
+                with self._db() as connection:
+                    connection.execute("DELETE FROM results")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"ResultCache(entries={len(self)}, hits={self.hits}, misses={self.misses}, path={self.path!r})"
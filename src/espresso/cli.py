@@ -0,0 +1,129 @@
+"""Command line interface to Espresso
+
+Examples
+--------
+Design coding sequences for a proteome, using 8 processes
+
+    espresso design proteome.fa.gz -m ec -p 8 -o designed.fa
+
+Scrub the designed sequences of EcoRI and BamHI sites
+
+    espresso scrub designed.fa -a GAATTC GGATCC -m ec -o scrubbed.fa
+
+Count the codons in a genome's coding sequences, for a new codon model
+
+    espresso count Saccharomyces_cerevisiae.R64-1-1.cds.all.fa.gz -o sc.json
+
+Serve the transformer model over HTTP, designing requests in micro-batches
+
+    espresso serve -m fungi-v1 --port 8000 --max-batch-size 32 --max-wait-ms 5
+"""
+import argparse
+import json
+import sys
+
+from espresso.fasta import open_text, read_fasta, write_fasta
+
+
+def run(results, output):
+    """Write successful results to `output`, report failures on stderr, and
+    return the number of failures"""
+    failures = 0
+
+    def successes():
+        nonlocal failures
+        for name, sequence, error in results:
+            if error is None:
+                yield name, sequence
+            else:
+                failures += 1
+                print(f"espresso: {name}: {error}", file=sys.stderr)
+
+    handle = open_text(output, "wt")
+    try:
+        write_fasta(successes(), handle)
+    finally:
+        if handle is not sys.stdout:
+            handle.close()
+    return failures
+
+
+def design(args):
+    from espresso.bulk import design_many
+    results = design_many(read_fasta(args.input), args.model, processes=args.processes, chunk_size=args.chunk_size)
+    return run(results, args.output)
+
+
+def scrub(args):
+    from espresso.bulk import scrub_many
+    results = scrub_many(read_fasta(args.input), args.avoid, args.model, processes=args.processes,
+                         chunk_size=args.chunk_size)
+    return run(results, args.output)
+
+
+def count(args):
+    from espresso.counting import count_codons, codon_use_table
+    table = codon_use_table(count_codons(args.inputs, processes=args.processes))
+    handle = open_text(args.output, "wt")
+    try:
+        handle.write(json.dumps(table, indent=4) + "\n")
+    finally:
+        if handle is not sys.stdout:
+            handle.close()
+    return 0
+
+
+def serve(args):
+    from espresso.serve import serve
+    serve(args.model, args.host, args.port, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="espresso", description="Design coding sequences for synthetic genes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_bulk_arguments(command, default_model):
+        command.add_argument("input", help="FASTA file (optionally gzipped), or - for stdin")
+        command.add_argument("-o", "--output", default="-", help="output FASTA file, or - for stdout (default)")
+        command.add_argument("-m", "--model", default=default_model, help=f"model slug (default {default_model})")
+        command.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default one per CPU)")
+        command.add_argument("--chunk-size", type=int, default=16, help="records sent to a worker at a time")
+
+    command = commands.add_parser("design", help="design coding sequences for protein sequences")
+    add_bulk_arguments(command, "sc")
+    command.set_defaults(function=design)
+
+    command = commands.add_parser("scrub", help="scrub coding sequences of undesired motifs")
+    add_bulk_arguments(command, "sc")
+    command.add_argument("-a", "--avoid", nargs="+", required=True, help="motifs to avoid (IUPAC bases allowed)")
+    command.set_defaults(function=scrub)
+
+    command = commands.add_parser("count", help="count codon use in coding sequences, as JSON for IndependentModel")
+    command.add_argument("inputs", nargs="+", help="FASTA files of coding sequences (optionally gzipped)")
+    command.add_argument("-o", "--output", default="-", help="output JSON file, or - for stdout (default)")
+    command.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default one per CPU)")
+    command.set_defaults(function=count)
+
+    command = commands.add_parser("serve", help="serve a model over HTTP, designing requests in micro-batches")
+    command.add_argument("-m", "--model", default="fungi-v1", help="model slug (default fungi-v1)")
+    command.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    command.add_argument("--port", type=int, default=8000, help="port to listen on (default 8000)")
+    command.add_argument("--max-batch-size", type=int, default=32, help="most requests designed in one batch")
+    command.add_argument("--max-wait-ms", type=float, default=5., help="longest a request waits for a batch to fill")
+    command.set_defaults(function=serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    failures = args.function(args)
+    if failures:
+        print(f"espresso: {failures} records failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
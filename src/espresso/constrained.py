@@ -0,0 +1,133 @@
+"""Design coding sequences that avoid motifs, by dynamic programming
+
+Rather than designing a sequence and then scrubbing it of motifs, a
+`ConstrainedDesigner` only ever considers the coding sequences that avoid
+them. The motifs are compiled into an automaton (see `AvoidMotifSet`),
+and a sequence avoids them if and only if the automaton never reaches a
+state where a motif ends. A Viterbi pass over the codons, tracking the
+automaton's state, finds the most likely motif-free coding sequence under
+a codon model; the forward algorithm, followed by sampling backwards, draws
+coding sequences from the model's distribution conditioned on avoiding the
+motifs. Either way it takes one pass, linear in the length of the protein.
+
+Examples
+--------
+>>> designer = ConstrainedDesigner(IndependentModel(ec_codon_use), ["GAATTC", "GGATCC"])
+>>> designer.generate_sequence("MENFHHRPFK")
+>>> designer.generate_sequence("MENFHHRPFK", strategy="sample", rng=0)
+"""
+import numpy
+
+from espresso.lib import AvoidMotifSet, CodonSequence
+from espresso.stats import NULL_STATS
+from espresso.translation import INDEX_TO_RESIDUE, residue_indices
+
+
+class ConstrainedDesigner:
+    """Designs coding sequences that contain none of the `avoid` motifs
+
+    `model` is a codon model with a `table` of codon probabilities for each
+    residue, such as `IndependentModel` or `TopCodonModel`, and `avoid` is an
+    `AvoidMotifSet`, or motifs (which may use IUPAC degenerate bases) to
+    build one from, with `reverse_complement`. If any coding sequence
+    avoids the motifs, every design does.
+    """
+
+    def __init__(self, model, avoid, reverse_complement=False):
+        self.model = model
+        self.motifs = avoid if isinstance(avoid, AvoidMotifSet) else AvoidMotifSet(list(avoid), reverse_complement)
+
+        # the codons each residue can use, and their log probabilities
+        with numpy.errstate(divide="ignore"):
+            self.log_weights = numpy.log(model.table)
+        self.residue_codons = [numpy.flatnonzero(row > 0) for row in model.table]
+
+        # the automaton's state after reading each codon from each state, or -1
+        # if a motif ends at any of the codon's bases
+        states, matches = self.motifs.codon_transitions()
+        self.transitions = numpy.where(matches > 0, -1, states)
+
+    def generate_sequence(self, protein_sequence, strategy="best", rng=None, stats=None):
+        """Design a coding sequence for the protein that avoids the motifs
+
+        With `strategy` "best" (the default), the most likely such sequence
+        under the model; with "sample", a sample from the model's
+        distribution over such sequences, reproducibly with a seed or a
+        `numpy.random.Generator` as `rng`. `stats` (see `espresso.stats`)
+        times the forward and backward passes, and counts the codons.
+
+        Raises
+        ------
+        ValueError
+            If no coding sequence for the protein avoids the motifs, or the
+            model has no codons for a residue
+        """
+        sequence = self.generate_codons(protein_sequence, strategy=strategy, rng=rng, stats=stats).sequence
+        (stats or NULL_STATS).count("codons", len(protein_sequence))
+        return sequence
+
+    def generate_codons(self, protein_sequence, strategy="best", rng=None, stats=None):
+        """Like `generate_sequence`, but returns a `CodonSequence`"""
+        if strategy not in ("best", "sample"):
+            raise ValueError(f'Unknown strategy "{strategy}", expected "best" or "sample"')
+        stats = stats or NULL_STATS
+        residues = residue_indices(protein_sequence)
+        for residue in residues.tolist():
+            if not len(self.residue_codons[residue]):
+                raise ValueError(f"No codons for residue {INDEX_TO_RESIDUE[residue]} in the codon use data")
+
+        with stats.span("forward"):
+            lattice = self.forward(residues, numpy.maximum if strategy == "best" else numpy.logaddexp)
+        with stats.span("backward"):
+            rng = numpy.random.default_rng(rng)
+            codons = numpy.empty(len(residues), dtype=numpy.uint8)
+            states, state_scores = lattice[-1]
+            state = states[self._choose(state_scores, strategy, rng)]
+            for idx in range(len(residues) - 1, -1, -1):
+                # the (state, codon) pairs that lead to the chosen state 
+                states, state_scores = lattice[idx]
+                choices = self.residue_codons[residues[idx]]
+                sources, columns = numpy.nonzero(self.transitions[states[:, None], choices] == state)
+                weights = state_scores[sources] + self.log_weights[residues[idx], choices[columns]]
+                pick = self._choose(weights, strategy, rng)
+                codons[idx], state = choices[columns[pick]], states[sources[pick]]
+
+        return CodonSequence.view(codons)
+
+    def forward(self, residues, reduce=numpy.maximum):
+        """Score the automaton states after each residue: with 
+        `numpy.maximum`, the log probability of the best motif-free prefix 
+        ending in each state (Viterbi), and with `numpy.logaddexp`, of all of 
+        them (the forward algorithm) 
+
+        Returns a list of len(residues) + 1 (states, scores) pairs, of the 
+        states that some motif-free prefix ends in, and their scores 
+        """
+        scores = numpy.full(len(self.transitions), -numpy.inf)
+        active, active_scores = numpy.zeros(1, dtype=numpy.int64), numpy.zeros(1)
+        columns = [(active, active_scores)]
+        for idx, residue in enumerate(residues.tolist()):
+            choices = self.residue_codons[residue]
+            targets = self.transitions[active[:, None], choices]
+            candidates = active_scores[:, None] + self.log_weights[residue, choices]
+            valid = targets >= 0
+            if not valid.any():
+                raise ValueError(f"No coding sequence avoids the motifs {self.motifs.motifs[:3]}"
+                                 f"{'...' if len(self.motifs.motifs) > 3 else ''} at residue {idx} "
+                                 f"({INDEX_TO_RESIDUE[residue]})")
+            scores[:] = -numpy.inf
+            reduce.at(scores, targets[valid], candidates[valid])
+            active = numpy.flatnonzero(scores > -numpy.inf)
+            active_scores = scores[active]
+            columns.append((active, active_scores))
+        return columns 
+
+    @staticmethod
+    def _choose(log_weights, strategy, rng):
+        if strategy == "best":
+            return int(numpy.argmax(log_weights))
+        p = numpy.exp(log_weights - log_weights.max())
+        return int(rng.choice(len(p), p=p / p.sum()))
+
+    def __repr__(self):
+        return f"ConstrainedDesigner({type(self.model).__name__}, {self.motifs!r})"
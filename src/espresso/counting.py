@@ -0,0 +1,89 @@
+"""Count codon usage in coding sequences, for training codon models
+
+Examples
+--------
+Count the codons in a genome's coding sequences, and use the result to
+create a codon model
+
+>>> counts = count_codons(["Saccharomyces_cerevisiae.R64-1-1.cds.all.fa.gz"])
+>>> model = IndependentModel(codon_use_table(counts))
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from espresso.fasta import read_fasta
+from espresso.translation import BASE_BYTE_TO_INDEX, CODONS
+
+
+def count_codons_in_sequences(sequences):
+    """Count the codons of in-frame coding sequences into a 64-slot array
+
+    Codons that contain anything other than A, T, C and G are not counted.
+    """
+    bases = BASE_BYTE_TO_INDEX[numpy.frombuffer("".join(sequences).encode(), dtype=numpy.uint8)].reshape(-1, 3)
+    bases = bases[(bases < 4).all(axis=1)].astype(numpy.int64)
+    return numpy.bincount(bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2], minlength=64)
+
+
+def sequence_chunks(paths, chunk_bases=1 << 22):
+    """Stream the in-frame records of (possibly gzipped) FASTA files, as
+    lists of sequences of about `chunk_bases` bases each
+
+    Records whose length isn't a multiple of 3 are skipped.
+    """
+    chunk, size = [], 0
+    for path in paths:
+        for _, sequence in read_fasta(path):
+            if len(sequence) % 3:
+                continue
+            chunk.append(sequence)
+            size += len(sequence)
+            if size >= chunk_bases:
+                yield chunk
+                chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def count_codons_in_file(path, chunk_bases=1 << 22):
+    """Count the codons in a (possibly gzipped) FASTA file of coding sequences
+
+    Records are streamed, and counted in chunks of about `chunk_bases` bases,
+    so memory stays flat regardless of the size of the file. Records whose
+    length isn't a multiple of 3 are skipped.
+    """
+    return sum(map(count_codons_in_sequences, sequence_chunks([path], chunk_bases)), numpy.zeros(64, dtype=numpy.int64))
+
+
+def count_codons(paths, processes=None, chunk_bases=1 << 22):
+    """Count the codons in FASTA files, and merge the counts into a single
+    64-slot array
+
+    The records are read in this process, and chunks of about `chunk_bases`
+    bases are counted by a pool of `processes` workers, so even a single
+    large file is counted on every core. Only a few chunks per worker are
+    held in memory at a time.
+    """
+    paths = list(paths)
+    counts = numpy.zeros(64, dtype=numpy.int64)
+    processes = processes or os.cpu_count()
+    if processes <= 1:
+        return sum(map(count_codons_in_sequences, sequence_chunks(paths, chunk_bases)), counts)
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for chunk in sequence_chunks(paths, chunk_bases):
+            pending.append(pool.submit(count_codons_in_sequences, chunk))
+            if len(pending) >= 2 * processes:
+                counts += pending.popleft().result()
+        for future in pending:
+            counts += future.result()
+    return counts
+
+
+def codon_use_table(counts):
+    """Convert a 64-slot array of counts into a dict of codon -> count, in the
+    form used by `IndependentModel`, leaving out codons that were never seen"""
+    return {codon: int(count) for codon, count in zip(CODONS, counts) if count}
@@ -1,9 +1,43 @@
-import io 
-import json 
+import functools
+import json
 import pkgutil
+from importlib import resources
 
 
-sc_codon_use = json.loads(pkgutil.get_data("espresso", "data/independent/sc.json"))
-ec_codon_use = json.loads(pkgutil.get_data("espresso", "data/independent/ec.json"))
-yl_codon_use = json.loads(pkgutil.get_data("espresso", "data/independent/yl.json"))
-fungi_v1 = io.BytesIO(pkgutil.get_data("espresso", "data/transformer/fungi-v1.pt"))
\ No newline at end of file
+# built-in codon use tables, by organism abbreviation, and transformer weights, by model slug
+CODON_USE_TABLES = ["sc", "ec", "yl"]
+TRANSFORMER_MODELS = ["fungi-v1"]
+
+
+@functools.lru_cache(maxsize=None)
+def load_codon_use(name):
+    """Load a built-in codon use table, reading it from disk on first use"""
+    if name not in CODON_USE_TABLES:
+        raise ValueError(f'Codon use table "{name}" not found')
+    return json.loads(pkgutil.get_data("espresso", f"data/independent/{name}.json"))
+
+
+def load_transformer(name):
+    """Get the path of the weights of a built-in transformer model
+
+    The weights are not read here: `TransformerModel` memory-maps them, so 
+    that every model (and every process) loaded from the same file shares 
+    them. 
+    """
+    if name not in TRANSFORMER_MODELS:
+        raise ValueError(f'Transformer model "{name}" not found')
+    return str(resources.files("espresso") / "data" / "transformer" / f"{name}.pt")
+
+
+def __getattr__(name):
+    # module-level tables (`sc_codon_use`, ...) are loaded on first access, so 
+    # that importing this module doesn't read any data; `fungi_v1` (and the 
+    # other transformer models) are the paths of their weights
+    if name.endswith("_codon_use") and name[:-len("_codon_use")] in CODON_USE_TABLES:
+        value = load_codon_use(name[:-len("_codon_use")])
+    elif name.replace("_", "-") in TRANSFORMER_MODELS:
+        value = load_transformer(name.replace("_", "-"))
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
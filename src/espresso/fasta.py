@@ -0,0 +1,45 @@
+import gzip
+import sys
+
+
+def open_text(path, mode="rt"):
+    """Open a (possibly gzipped) text file, where `-` is stdin or stdout"""
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def read_fasta(path):
+    """Stream (header, sequence) records from a FASTA file, one at a time
+
+    The file may be gzipped (if its name ends in `.gz`), or `-` for stdin.
+    Only one record is held in memory at a time.
+    """
+    handle = open_text(path)
+    try:
+        header, lines = None, []
+        for line in handle:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(lines)
+                header, lines = line[1:], []
+            elif line:
+                if header is None:
+                    raise ValueError(f"Expected a FASTA header, found {line[:24]}")
+                lines.append(line)
+        if header is not None:
+            yield header, "".join(lines)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def write_fasta(records, handle, width=60):
+    """Write (header, sequence) records to an open file, wrapping sequences at `width`"""
+    for header, sequence in records:
+        handle.write(f">{header}\n")
+        for start in range(0, len(sequence), width):
+            handle.write(sequence[start:start + width] + "\n")
@@ -1,42 +1,130 @@
 import re 
+import threading
+try:
+    from re import _parser as sre_parse
+except ImportError:  # before Python 3.11
+    import sre_parse
+from collections import Counter, deque
 from itertools import product
 
-import torch 
 import numpy
-from biotite.sequence import NucleotideSequence 
-import torchtext; torchtext.disable_torchtext_deprecation_warning()
-from torchtext.vocab import build_vocab_from_iterator
 
-from espresso.model import Seq2SeqTransformer
+# the codon tables and translation helpers live in `espresso.translation`, and are 
+# also available from here 
+from espresso.translation import (STOP_CODONS, RESIDUE_TO_INDEX, INDEX_TO_RESIDUE, CODON_TO_INDEX, INDEX_TO_CODON, 
+                                  CODONS, CODON_TO_RESIDUE, CODON_BYTES, RESIDUE_BYTE_TO_INDEX, SYNONYMOUS_CODONS, 
+                                  residue_indices, join_codons, codon_indices, translate, translate_codons)
+from espresso.stats import NULL_STATS
 
 
-STOP_CODONS = ["TAA", "TAG", "TAA", "TGA"]
-RESIDUE_TO_INDEX = dict(zip("ACDEFGHIKLMNPQRSTVWY", range(20)))
-INDEX_TO_RESIDUE = {v: k for k, v in RESIDUE_TO_INDEX.items()}
-CODON_TO_INDEX = dict(zip(list("".join(x) for x in product("ATCG", repeat=3)), range(64)))
-INDEX_TO_CODON = {v: k for k, v in CODON_TO_INDEX.items()}
-CODONS = list(CODON_TO_INDEX.keys())
+# IUPAC nucleotide codes, and their complements 
+IUPAC_BASES = {
+    "A": "A", "C": "C", "G": "G", "T": "T", 
+    "R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT", "M": "AC", 
+    "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT", 
+}
+IUPAC_COMPLEMENTS = dict(zip("ACGTRYSWKMBDHVN", "TGCAYRSWMKVHDBN"))
 
+# sequence byte -> symbol for motif matching, where anything that isn't a base is symbol 4 
+BASE_SYMBOLS = numpy.full(256, 4, dtype=numpy.uint8)
+BASE_SYMBOLS[numpy.frombuffer(b"ACGTacgt", dtype=numpy.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
 
-def translate(nucleotide_sequence):
-    """Helper function to translate codons into residues"""
-    dna = NucleotideSequence(nucleotide_sequence)
-    return str(dna.translate(complete=True))
+# sequence byte -> 1 for G or C, else 0 
+GC_BASES = numpy.zeros(256, dtype=numpy.int64)
+GC_BASES[numpy.frombuffer(b"GCgc", dtype=numpy.uint8)] = 1
 
 
 class CodonSequence:
-    """A nucleotide sequence consisting of one or more codons"""
+    """A nucleotide sequence consisting of one or more codons
+
+    The codons are stored compactly, as a uint8 array of codon indices (one 
+    byte per codon). Slices are views that share that array, and codons can 
+    be substituted in place, so long sequences are cheap to hold and edit. 
+
+    Examples
+    --------
+    >>> sequence = CodonSequence("ATGAAAGGG")
+    >>> sequence[1] = "AAG"
+    >>> str(sequence), sequence[1:].sequence 
+    # ('ATGAAGGGG', 'AAGGGG')
+    """
+    __slots__ = ("indices",)
 
     def __init__(self, sequence):
         """Create a new CodonSequence after verifying data"""
-        if not len(sequence) % 3 == 0:
-            raise ValueError(f"Sequence length must be a multiple of 3, not {len(sequence)}")
-
-        self.codons = list(sequence[x:x + 3] for x in range(0, len(sequence), 3))
-        if len(self.codons) < 1:
+        if isinstance(sequence, CodonSequence):
+            self.indices = sequence.indices.copy()
+        elif isinstance(sequence, numpy.ndarray):
+            self.indices = sequence.astype(numpy.uint8)
+        else:
+            if not len(sequence) % 3 == 0:
+                raise ValueError(f"Sequence length must be a multiple of 3, not {len(sequence)}")
+            self.indices = codon_indices(sequence)
+
+        if len(self.indices) < 1:
             raise ValueError("A sequence must have at least 3 bp") 
 
-        self.sequence = "".join(self.codons) 
+    @classmethod
+    def view(cls, indices):
+        """Wrap an array of codon indices without copying or checking it"""
+        sequence = object.__new__(cls)
+        sequence.indices = indices 
+        return sequence 
+
+    @property
+    def codons(self):
+        """The codons, as a list of strings"""
+        return [CODONS[idx] for idx in self.indices.tolist()]
+
+    @property
+    def sequence(self):
+        """The nucleotide sequence, as a string"""
+        return join_codons(self.indices)
+
+    def tobytes(self):
+        """The nucleotide sequence, as ASCII bytes"""
+        return CODON_BYTES[self.indices].tobytes()
+
+    def translate(self):
+        """Translate the codons into residues, with `*` for stop"""
+        return translate_codons(self.indices)
+
+    def copy(self):
+        return CodonSequence.view(self.indices.copy())
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self.codons)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return CodonSequence.view(self.indices[key])
+        return CODONS[self.indices[key]]
+
+    def __setitem__(self, key, value):
+        if isinstance(value, str):
+            value = CODON_TO_INDEX[value] if len(value) == 3 else codon_indices(value)
+        elif isinstance(value, CodonSequence):
+            value = value.indices 
+        self.indices[key] = value 
+
+    def __eq__(self, other):
+        if isinstance(other, CodonSequence):
+            return numpy.array_equal(self.indices, other.indices)
+        if isinstance(other, str):
+            return self.sequence == other 
+        return NotImplemented
+
+    def __str__(self):
+        return self.sequence 
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def __repr__(self):
+        return f"CodonSequence({self.sequence[:24] + ('...' if len(self) > 8 else '')!r})"
 
 
 class CodonTable:
@@ -63,7 +151,7 @@ class IndependentModel:
         self.table = numpy.zeros((20, 64))
         for codon, count in self.codon_use_data.items():
             my_codon_index = CODON_TO_INDEX[codon]
-            my_residue_index = RESIDUE_TO_INDEX[translate(codon)]
+            my_residue_index = RESIDUE_TO_INDEX[CODON_TO_RESIDUE[codon]]
             self.table[my_residue_index, my_codon_index] = count 
 
         # normalize the mapping table by the row 
@@ -75,23 +163,58 @@ class IndependentModel:
         # re-normalize the mapping table by the row 
         self.table = self.table / self.table.sum(axis=1, keepdims=True)
 
-    def generate_sequence(self, protein_sequence):
-        """Generate a nucletide coding sequence for a provided protein sequence"""
+        # compact per-residue sampling tables: the codons with non-zero 
+        # probability for each residue, and their cumulative probabilities 
+        # (residues missing from the codon use data have no codons) 
+        self.encodable = (self.table > 0).any(axis=1)
+        width = int((self.table > 0).sum(axis=1).max())
+        self.choices = numpy.zeros((20, width), dtype=numpy.uint8)
+        self.cumulative = numpy.full((20, width), numpy.inf)
+        for idx in numpy.flatnonzero(self.encodable):
+            codons = numpy.flatnonzero(self.table[idx] > 0)
+            self.choices[idx, :len(codons)] = codons 
+            self.cumulative[idx, :len(codons)] = numpy.cumsum(self.table[idx, codons])
+            self.cumulative[idx, len(codons) - 1] = 1.
+
+    def generate_sequence(self, protein_sequence, rng=None, stats=None):
+        """Generate a nucletide coding sequence for a provided protein sequence
+
+        All codons are drawn at once by inverse-CDF sampling. Pass a seed or a 
+        `numpy.random.Generator` as `rng` for reproducible sequences; by 
+        default the global `numpy.random` state is used. The number of codons 
+        designed is counted in `stats`, if given (see `espresso.stats`).
+        """
+        sequence = self.generate_codons(protein_sequence, rng=rng).sequence 
+        (stats or NULL_STATS).count("codons", len(protein_sequence))
+        return sequence 
 
-        sequence = ""
-        for residue in protein_sequence:
-            idx = RESIDUE_TO_INDEX[residue]
-            p = self.table[idx]
-            codon = numpy.random.choice(CODONS, p=p)
-            sequence += codon 
+    def generate_codons(self, protein_sequence, rng=None):
+        """Like `generate_sequence`, but returns a `CodonSequence`"""
+        return CodonSequence.view(self.sample_codons(protein_sequence, 1, rng=rng)[0])
 
-        return sequence 
+    def sample_codons(self, protein_sequence, n, rng=None):
+        """Draw `n` coding sequences at once, as an (n, L) array of codon indices"""
+        residues = residue_indices(protein_sequence)
+        if not self.encodable[residues].all():
+            missing = INDEX_TO_RESIDUE[int(residues[~self.encodable[residues]][0])]
+            raise ValueError(f"No codons for residue {missing} in the codon use data")
+        if rng is None:
+            uniform = numpy.random.random((n, len(residues)))
+        else:
+            uniform = numpy.random.default_rng(rng).random((n, len(residues)))
+
+        slots = (self.cumulative[residues] <= uniform[..., None]).sum(axis=2)
+
+        return self.choices[residues, slots]
     
 
 class TopCodonModel:
     """Uses codon usage data to create encodings 
     with the single most common codon for each position"""
 
+    # designs depend only on the protein, so they can be cached 
+    deterministic = True 
+
     def __init__(self, codon_use_data):
         # remove stop codons
         self.codon_use_data = {k: v for k, v in codon_use_data.items() if k not in STOP_CODONS}
@@ -100,156 +223,273 @@ class TopCodonModel:
         self.table = numpy.zeros((20, 64))
         for codon, count in self.codon_use_data.items():
             my_codon_index = CODON_TO_INDEX[codon]
-            my_residue_index = RESIDUE_TO_INDEX[translate(codon)]
+            my_residue_index = RESIDUE_TO_INDEX[CODON_TO_RESIDUE[codon]]
             self.table[my_residue_index, my_codon_index] = count 
 
         # normalize the mapping table by the row 
         self.table = self.table / self.table.sum(axis=1, keepdims=True)
 
-    def generate_sequence(self, protein_sequence):
-        """Generate a nucletide coding sequence for a provided protein sequence"""
+        # the top codon for each residue 
+        self.top_codons = numpy.argmax(self.table, axis=1).astype(numpy.uint8)
 
-        sequence = ""
-        for residue in protein_sequence:
-            idx = RESIDUE_TO_INDEX[residue]
-            p = self.table[idx]
-            codon = CODONS[numpy.argmax(p)]
-            sequence += codon 
+    def generate_sequence(self, protein_sequence, rng=None, stats=None):
+        """Generate a nucletide coding sequence for a provided protein sequence
 
+        The output is deterministic, `rng` is accepted for compatibility with 
+        the other models and ignored.
+        """
+        sequence = self.generate_codons(protein_sequence).sequence 
+        (stats or NULL_STATS).count("codons", len(protein_sequence))
         return sequence 
 
+    def generate_codons(self, protein_sequence, rng=None):
+        """Like `generate_sequence`, but returns a `CodonSequence`"""
+        return CodonSequence.view(self.top_codons[residue_indices(protein_sequence)])
 
-class TransformerModel:
-    """Uses a pre-trained transformer model to design coding sequences"""
-    def __init__(self, model_path):
-
-        protein_vocab = list("ACDEFGHIKLMNPQRSTVWY*")
-        codon_vocab = list("".join(x) for x in product("ATCG", repeat=3))
-
-        SRC_LANGUAGE = "protein"
-        TGT_LANGUAGE = "codons"
-
-        # Place-holders
-        token_transform = {}
-        vocab_transform = {}
-
-        UNK_IDX, PAD_IDX, BOS_IDX, EOS_IDX = 0, 1, 2, 3
-        special_symbols = ['<unk>', '<pad>', '<bos>', '<eos>']
-        self.BOS_IDX = BOS_IDX
-        self.EOS_IDX = EOS_IDX
+    def sample_codons(self, protein_sequence, n, rng=None):
+        """Like `IndependentModel.sample_codons`, with `n` copies of the one design"""
+        return numpy.tile(self.top_codons[residue_indices(protein_sequence)], (n, 1))
 
-        # first the protein vocab!
-        vocab_transform[SRC_LANGUAGE] = build_vocab_from_iterator([protein_vocab], min_freq=1, specials=special_symbols, special_first=True)
 
-        # now the codon vocab!
-        vocab_transform[TGT_LANGUAGE] = build_vocab_from_iterator([codon_vocab], min_freq=1, specials=special_symbols, special_first=True)
+def _edited_regions(codon_indices, gap):
+    """Merge sorted codon indices into (start, end) base ranges, joining 
+    ranges that are no more than `gap` bases apart"""
+    regions = []
+    for idx in codon_indices:
+        start, end = 3 * idx, 3 * idx + 3
+        if regions and start - regions[-1][1] <= gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    return regions
 
-        for lang in [SRC_LANGUAGE, TGT_LANGUAGE]:
-            vocab_transform[lang].set_default_index(UNK_IDX)
 
-        # now the token transforms
-        token_transform[SRC_LANGUAGE] = lambda x: x.split(" ")
-        token_transform[TGT_LANGUAGE] = lambda x: x.split(" ")
+def _covered(starts, ends, length):
+    """Get a boolean array of `length` bases, true for each base inside any 
+    of the [start, end) ranges"""
+    coverage = numpy.zeros(length + 1, dtype=numpy.int64)
+    numpy.add.at(coverage, starts, 1)
+    numpy.add.at(coverage, ends, -1)
+    return numpy.cumsum(coverage[:-1]) > 0
 
-        self.vocab_transform = vocab_transform
-        self.token_transform = token_transform
 
-        # Create a new empty instance of the model 
-        # 
-        # In our training, detailed in `espresso/learn`, we chose 
-        # the following model params:
-        #
-        # encoder layers == decoder layers, 3
-        # model dim, 64 
-        self.model = Seq2SeqTransformer(3, 3, 64, 8, len(vocab_transform[SRC_LANGUAGE]), len(vocab_transform[TGT_LANGUAGE]), 256) 
+def _unique(things):
+    """Drop repeated objects (by identity), keeping the first of each"""
+    return list({id(x): x for x in things}.values())
 
-        # load the specified trained model 
-        state_dict = torch.load(model_path, map_location=torch.device('cpu'))
-        self.model.load_state_dict(state_dict)
 
-        # set in eval mode 
-        self.model.eval() 
+class ScrubError(RuntimeError):
+    """Raised when a sequence can't be scrubbed of its undesired features
 
-    def sequential_transforms(self, *transforms):
-        def func(txt_input):
-            for transform in transforms:
-                txt_input = transform(txt_input)
-            return txt_input
-        return func
-
-    # function to add BOS/EOS and create tensor for input sequence indices
-    def tensor_transform(self, token_ids):
-        return torch.cat((torch.tensor([self.BOS_IDX]),
-                        torch.tensor(token_ids),
-                        torch.tensor([self.EOS_IDX])))
+    Attributes
+    ----------
+    unsatisfiable: list
+        For each codon that couldn't be fixed, a tuple of the codon index 
+        and the constraints that ruled out every synonymous codon 
+    """
 
-    def generate_sequence(self, protein_sequence, verbose=False):
-        """Generate a CDS for provided protein sequence using a generative model
-        
-        Raises
-        ------
-        AssertionError
-            If, after 5 samples, none of the generated sequences translate to 
-            the provided protein sequence
-        """
+    def __init__(self, message, unsatisfiable=()):
+        super().__init__(message)
+        self.unsatisfiable = list(unsatisfiable)
 
-        text_transform = {}
-        for ln in ["protein", "codons"]:
-            text_transform[ln] = self.sequential_transforms(self.token_transform[ln], 
-                                                    self.vocab_transform[ln], 
-                                                    self.tensor_transform) 
-        src_sentence = " ".join(protein_sequence) 
-        src = text_transform["protein"](src_sentence).view(-1, 1)
-        num_tokens = src.shape[0]
-        src_mask = (torch.zeros(num_tokens, num_tokens)).type(torch.bool)
-
-        n_iter = 0
-        max_iter = 20
-        while n_iter < max_iter:
-            n_iter += 1
-            tgt_tokens = self.model.sample(src, src_mask, max_len=num_tokens + 1, start_symbol=self.BOS_IDX).flatten() 
-            result = " ".join(self.vocab_transform["codons"].lookup_tokens(list(tgt_tokens.cpu().numpy()))).replace("<bos>", "").replace("<eos>", "")
-            sequence = NucleotideSequence(result.replace(" ", ""))
-            trimmed_sequence = sequence[:num_tokens * 3]
-            translation = trimmed_sequence.translate(complete=True)
-            if str(translation) == str(protein_sequence):
-                break  # break out of the `while` loop 
-
-        if verbose:
-            print("espresso: input sequence length including <bos> and <eos>:", len(src))
-            print("espresso: raw codons looked up from tokens", result)
-            print("espresso: joined sequence", sequence) 
-            print("espresso: joined sequence trimmed to length", trimmed_sequence) 
-            print("espresso: translation of trimmed sequence", translation) 
-
-        if not str(translation) == str(protein_sequence):
-            raise RuntimeError(f"espresso: The model produced a nucleotide sequence that doesn't translate back to the original nucleotide sequence after {max_iter} iterations")
-
-        return str(trimmed_sequence) 
-        
 
 class Scrubber:
     """Uses a codon model to scrub a sequence of undesired characteristics
-    like specific motifs, GC content, etc"""
+    like specific motifs, GC content, etc
+
+    Each constraint in `avoid` is called with a nucleotide sequence, and
+    returns the positions of the bases it flags. A constraint may also have
+    a `context`, how many bases on either side of an edit can have their
+    verdict changed by it (None if any base can), so that only the regions
+    around resampled codons are checked again, and a `cache_key`, a JSON-ready
+    list that identifies the constraint in result cache keys (see
+    `espresso.cache`).
+    """
 
     def __init__(self, avoid, model):
         self.avoid = avoid 
         self.model = model 
 
-    def scrub(self, nucleotide_sequence, max_iterations=50):
+        # for each constraint, how many codons on either side of a codon can 
+        # take part in a violation involving it, or None if any codon can 
+        contexts = [getattr(thing, "context", None) for thing in avoid]
+        self.codon_contexts = [None if context is None else -(-context // 3) for context in contexts]
+        self._unsatisfiable = {}
+
+    def scrub(self, nucleotide_sequence, max_iterations=50, rng=None, patience=5, stats=None):
         """For `max_iterations`, attempt to generate a new sequence
-        without any of the undesired features"""
-       
+        without any of the undesired features
+
+        Each flagged codon is resampled with `resample_codons`, which only 
+        picks synonymous codons that don't recreate a violation, so most 
+        sequences are clean after one round. The whole sequence is only 
+        checked once. After each round of resampling, only the regions 
+        around the resampled codons are checked again (see 
+        `update_flagged_bases`).
+
+        If given, `stats` (see `espresso.stats`) collects the time spent 
+        scanning for violations and resampling, and counts the rounds and 
+        the codons resampled.
+
+        Raises
+        ------
+        ScrubError
+            If a flagged codon encodes a residue for which every synonymous 
+            codon violates a constraint on its own, if for `patience` rounds 
+            in a row none of the codons left flagged had a valid choice, or 
+            if the sequence is still not clean after `max_iterations` rounds 
+        """
+        stats = stats or NULL_STATS
+        rng = None if rng is None else numpy.random.default_rng(rng)
+        codons = CodonSequence(nucleotide_sequence)
+        sequence = codons.sequence 
+        with stats.span("scan"):
+            flagged_bases = self.flag_bases(sequence)
+            codons_to_resample = self.codons_from_bases(flagged_bases)
+        stats.count("codons_flagged", len(codons_to_resample))
+
+        # fail fast on residues that no synonymous codon can encode 
+        unsatisfiable = [(idx, self.unsatisfiable_constraints(CODON_TO_RESIDUE[codons[idx]])) for idx in codons_to_resample]
+        unsatisfiable = [(idx, constraints) for idx, constraints in unsatisfiable if constraints]
+        if unsatisfiable:
+            idx, constraints = unsatisfiable[0]
+            raise ScrubError((f"Cannot scrub codon {idx} ({codons[idx]}) of a sequence starting with "
+                              f"{sequence[:24]}: every synonymous codon violates {constraints}"), unsatisfiable)
+
         iterations = 0 
-        for n in range(max_iterations):
-            nucleotide_sequence = self.resample_sequence(nucleotide_sequence)
-            if not self.identify_codons_to_resample(nucleotide_sequence):
-                return nucleotide_sequence 
+        stalled = 0
+        while codons_to_resample:
+            if iterations == max_iterations or stalled == patience:
+                reason = "no codon left flagged had a valid choice" if stalled == patience else "reached maximum allowed iterations"
+                raise ScrubError((f"Stopped after {iterations} iterations ({reason}) when "
+                                  f"encoding a sequence starting with {sequence[:24]} "
+                                  f"with {len(self.avoid)} constraints"), 
+                                 [(idx, self.violations(codons, idx)) for idx in codons_to_resample])
             iterations += 1 
-            if iterations == 50:
-                raise RuntimeError((f"Reached maximum allowed iterations {max_iterations} when"
-                                     "encoding a sequence starting with {nucleotide_sequence[:24]}"
-                                     "with {len(self.avoid)} constraints"))
+            stats.count("scrub_iterations")
+            stats.count("codons_resampled", len(codons_to_resample))
+
+            with stats.span("resample"):
+                stuck = self.resample_codons(codons, codons_to_resample, rng=rng)
+
+            with stats.span("scan"):
+                sequence = codons.sequence 
+                self.update_flagged_bases(sequence, flagged_bases, codons_to_resample)
+                codons_to_resample = self.codons_from_bases(flagged_bases)
+
+            # count the rounds in a row where resampling made no headway 
+            if set(codons_to_resample) <= set(idx for idx, _ in stuck):
+                stalled += 1
+            else:
+                stalled = 0
+
+        return sequence 
+
+    def violations(self, codons, codon_index, codon=None):
+        """Get the constraints that flag any base of the codon at `codon_index` 
+        of a `CodonSequence`, optionally with `codon` substituted for it
+
+        Only the neighbouring codons within reach of each constraint are 
+        checked, and constraints with a `check` method only check the codon. 
+        """
+        codon = codons[codon_index] if codon is None else codon 
+        windows = {}
+        found = []
+        for thing, codon_context in zip(self.avoid, self.codon_contexts):
+            if codon_context not in windows:
+                if codon_context is None:
+                    start, end = 0, len(codons)
+                else:
+                    start, end = max(0, codon_index - codon_context), codon_index + codon_context + 1
+                left = codons[start:codon_index].sequence 
+                windows[codon_context] = len(left), left + codon + codons[codon_index + 1:end].sequence
+            offset, window = windows[codon_context]
+            check = getattr(thing, "check", None)
+            if check is not None:
+                flagged = check(window, offset, offset + 3)
+            else:
+                flagged = [x for x in thing(window) if offset <= x < offset + 3]
+            if len(flagged):
+                found.append(thing)
+        return found 
+
+    def allowed_codons(self, residue):
+        """Get the synonymous codons for `residue` that the model can produce, 
+        and the model's probabilities for them"""
+        candidates = [CODONS[idx] for idx in SYNONYMOUS_CODONS[residue]]
+        table = getattr(self.model, "table", None)
+        if table is None or residue not in RESIDUE_TO_INDEX:
+            return candidates, numpy.ones(len(candidates))
+        p = table[RESIDUE_TO_INDEX[residue], [CODON_TO_INDEX[codon] for codon in candidates]]
+        return [codon for codon, weight in zip(candidates, p) if weight > 0], p[p > 0]
+
+    def unsatisfiable_constraints(self, residue):
+        """Get the constraints that rule out every allowed codon for `residue` 
+        regardless of its neighbours, which is empty if the residue can be encoded"""
+        if residue not in self._unsatisfiable:
+            blocking = [self.violations(CodonSequence(codon), 0) for codon in self.allowed_codons(residue)[0]]
+            self._unsatisfiable[residue] = _unique(x for constraints in blocking for x in constraints) if all(blocking) else []
+        return self._unsatisfiable[residue]
+
+    def resample_codons(self, codons, codon_indices, rng=None):
+        """Resample the codons of a `CodonSequence` at `codon_indices` in place, 
+        left to right 
+
+        Each codon is drawn from the model's distribution, renormalized over 
+        the synonymous codons that don't create a violation with the current 
+        neighbouring codons. If there are none, the codon is drawn from all 
+        synonymous codons the model allows. 
+
+        Returns a list of (codon index, constraints) for the codons that had 
+        no valid choice, with the constraints that ruled out their choices
+        """
+        rng = numpy.random if rng is None else numpy.random.default_rng(rng)
+        stuck = []
+        for idx in codon_indices:
+            candidates, p = self.allowed_codons(CODON_TO_RESIDUE[codons[idx]])
+            blocking = [self.violations(codons, idx, codon) for codon in candidates]
+            valid = numpy.array([not constraints for constraints in blocking])
+            if valid.any():
+                p = p * valid
+            else:
+                stuck.append((idx, _unique(x for constraints in blocking for x in constraints)))
+            codons[idx] = candidates[rng.choice(len(candidates), p=p / p.sum())]
+
+        return stuck 
+
+    def flag_bases(self, nucleotide_sequence):
+        """Check the whole sequence, returning the set of flagged bases for 
+        each of the `avoid` constraints"""
+        return [set(thing(nucleotide_sequence)) for thing in self.avoid]
+
+    def codons_from_bases(self, flagged_bases):
+        """Get the sorted indices of the codons that contain any flagged base"""
+        return sorted(set(int(x) // 3 for bases in flagged_bases for x in bases))
+
+    def update_flagged_bases(self, nucleotide_sequence, flagged_bases, changed_codons):
+        """Update the flagged bases in place after `changed_codons` were edited
+
+        A constraint with a `context` of `c` bases (for a motif, its widest match
+        minus one) can only change its verdict on the bases within `c` of an 
+        edit, and those verdicts only depend on the bases within `2c` of the 
+        edit. So only that window is checked again, and only the verdicts 
+        near the edit are replaced. Constraints without a `context` are 
+        checked over the whole sequence.
+        """
+        for thing, bases in zip(self.avoid, flagged_bases):
+            context = getattr(thing, "context", None)
+            if context is None:
+                bases.clear()
+                bases.update(thing(nucleotide_sequence))
+                continue
+
+            for start, end in _edited_regions(changed_codons, 2 * context):
+                region_start, region_end = max(0, start - context), min(len(nucleotide_sequence), end + context)
+                window_start, window_end = max(0, start - 2 * context), end + 2 * context
+                bases.difference_update(range(region_start, region_end))
+                for x in thing(nucleotide_sequence[window_start:window_end]):
+                    if region_start <= x + window_start < region_end:
+                        bases.add(x + window_start)
 
     def identify_codons_to_resample(self, nucleotide_sequence):
         bases = []
@@ -257,7 +497,7 @@ class Scrubber:
             my_bases = thing(nucleotide_sequence) 
             bases.extend(my_bases) 
         bases = list(set(bases)) 
-        codons_to_resample = list(set(x // 3 for x in bases))
+        codons_to_resample = list(set(int(x) // 3 for x in bases))
         return codons_to_resample
 
     def resample_sequence(self, nucleotide_sequence):
@@ -269,16 +509,11 @@ class Scrubber:
        
         # resample the specified codons (or generate a new sequence from the model!) 
         # probably could rethink this as a "mask" for the model 
-        new_sequence = ""
-        for idx in range(len(sequence.codons)):
-            if idx in codons_to_resample:
-                residue = translate(sequence.codons[idx])
-                new_codon = self.model.generate_sequence(residue)
-                new_sequence += new_codon
-            else:
-                new_sequence += sequence.codons[idx] 
+        for idx in codons_to_resample:
+            residue = CODON_TO_RESIDUE[sequence[idx]]
+            sequence[idx] = self.model.generate_sequence(residue)
 
-        return new_sequence 
+        return sequence.sequence 
 
 
 class AvoidMotif:
@@ -295,12 +530,396 @@ class AvoidMotif:
     """
     def __init__(self, motif):
         self.motif = motif 
+
+        # match with a lookahead, so that overlapping matches are all found,
+        # capturing each match to know how many bases it covers
+        self.pattern = re.compile(f"(?=({motif}))")
+
+        # an edit can only create or remove a match within this many bases,
+        # one less than the widest match, or anywhere if matches are unbounded
+        width = sre_parse.parse(motif).getwidth()[1]
+        self.context = None if width >= sre_parse.MAXREPEAT else max(0, width - 1)
     
     def __call__(self, sequence):
         # get a list of the positions involved 
-        positions = []
-        for m in re.finditer(self.motif, sequence):
-            my_range = list(range(m.start(), m.start() + len(self.motif)))
-            positions.extend(my_range)
+        positions = set()
+        for m in self.pattern.finditer(sequence):
+            positions.update(range(m.start(), m.end(1)))
+
+        return sorted(positions)
+
+    @property
+    def cache_key(self):
+        return ["AvoidMotif", self.motif]
+
+    def __repr__(self):
+        return f"AvoidMotif({self.motif!r})"
+
+
+class AvoidMotifSet:
+    """Avoid any of a set of motifs, all found in a single pass 
+
+    The motifs are compiled into an Aho-Corasick automaton over the 
+    ACGT alphabet, so the cost of a scan doesn't grow with the number 
+    of motifs. Motifs may contain IUPAC degenerate bases (N, R, Y, ...), 
+    and with `reverse_complement` their reverse complements are avoided 
+    too. Overlapping matches are all found.
+
+    Examples
+    --------
+    >>> motifs = AvoidMotifSet(["GAATTC", "GGTCTCN"], reverse_complement=True)
+    >>> motifs("ATGGAATTCAAA")
+    # array([3, 4, 5, 6, 7, 8])
+    >>> motifs.find("ATGGAATTCAAA")
+    # (array([3]), array([0]))
+    """
+
+    def __init__(self, motifs, reverse_complement=False, max_expansions=4096):
+        self.motifs = [motif.upper() for motif in motifs]
+        self.reverse_complement = reverse_complement 
+
+        # expand each motif (and its reverse complement) into concrete sequences 
+        patterns = set()
+        for motif_index, motif in enumerate(self.motifs):
+            variants = [motif]
+            if reverse_complement:
+                variants.append("".join(IUPAC_COMPLEMENTS[base] for base in reversed(motif)))
+            for variant in variants:
+                if not variant or any(base not in IUPAC_BASES for base in variant):
+                    raise ValueError(f'Motif "{motif}" must be a non-empty sequence of IUPAC bases')
+                expansions = 1
+                for base in variant:
+                    expansions *= len(IUPAC_BASES[base])
+                if expansions > max_expansions:
+                    raise ValueError(f'Motif "{motif}" expands to {expansions} sequences, more than {max_expansions}')
+                for pattern in product(*(IUPAC_BASES[base] for base in variant)):
+                    patterns.add(("".join(pattern), motif_index))
+
+        self.length = max(len(pattern) for pattern, _ in patterns)
+
+        # an edit can only create or remove a match within this many bases 
+        self.context = self.length - 1
+
+        self._build(sorted(patterns))
+
+    def _build(self, patterns):
+        # the trie, with one column per base and a fifth for anything else 
+        delta = [[-1, -1, -1, -1, 0]]
+        outputs = [[]]
+        for pattern, motif_index in patterns:
+            state = 0
+            for symbol in BASE_SYMBOLS[numpy.frombuffer(pattern.encode(), dtype=numpy.uint8)].tolist():
+                if delta[state][symbol] == -1:
+                    delta[state][symbol] = len(delta)
+                    delta.append([-1, -1, -1, -1, 0])
+                    outputs.append([])
+                state = delta[state][symbol]
+            outputs[state].append((len(pattern), motif_index))
+
+        # breadth-first, add failure links and fold them into a full transition 
+        # table, so that each base costs exactly one lookup 
+        fail = [0] * len(delta)
+        queue = deque()
+        for symbol in range(4):
+            if delta[0][symbol] == -1:
+                delta[0][symbol] = 0
+            else:
+                queue.append(delta[0][symbol])
+        while queue:
+            state = queue.popleft()
+            for symbol in range(4):
+                target = delta[state][symbol]
+                if target == -1:
+                    delta[state][symbol] = delta[fail[state]][symbol]
+                else:
+                    fail[target] = delta[fail[state]][symbol]
+                    outputs[target] = outputs[target] + outputs[fail[target]]
+                    queue.append(target)
+
+        self.delta = delta 
+        self.outputs = outputs 
+
+        # the longest match ending in each state, which is all that's needed to 
+        # find the covered bases, as shorter matches ending there are inside it 
+        self.longest = numpy.array([max((n for n, _ in out), default=0) for out in outputs], dtype=numpy.int64)
+
+    @property
+    def num_states(self):
+        return len(self.delta)
+
+    def codon_transitions(self):
+        """Get two (states, 64) arrays: the state after reading each codon from 
+        each state, and the number of the codon's bases where a match ends"""
+        delta = numpy.array(self.delta)
+        bases = BASE_SYMBOLS[CODON_BYTES]
+        states = numpy.arange(len(delta))[:, None]
+        matches = numpy.zeros((len(delta), len(CODONS)), dtype=numpy.int64)
+        for position in range(3):
+            states = delta[states, bases[:, position]]
+            matches += self.longest[states] > 0
+        return states, matches 
+
+    def scan(self, sequence):
+        """Run the automaton over the sequence, returning the state after each base"""
+        delta = self.delta 
+        states = numpy.empty(len(sequence), dtype=numpy.int64)
+        state = 0
+        for i, symbol in enumerate(BASE_SYMBOLS[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)].tolist()):
+            state = delta[state][symbol]
+            states[i] = state 
+        return states 
+
+    def find(self, sequence):
+        """Find every match, returning arrays of start positions and the 
+        index (into `motifs`) of the matching motif"""
+        states = self.scan(sequence)
+        starts, motif_indices = [], []
+        for end in numpy.flatnonzero(self.longest[states]).tolist():
+            for length, motif_index in self.outputs[states[end]]:
+                starts.append(end - length + 1)
+                motif_indices.append(motif_index)
+        order = numpy.lexsort((motif_indices, starts))
+        return numpy.array(starts, dtype=numpy.int64)[order], numpy.array(motif_indices, dtype=numpy.int64)[order]
+
+    def mask(self, sequence):
+        """Get a boolean array, true for each base covered by a match"""
+        lengths = self.longest[self.scan(sequence)]
+        ends = numpy.flatnonzero(lengths)
+        return _covered(ends - lengths[ends] + 1, ends + 1, len(sequence))
+
+    def intervals(self, sequence):
+        """Get the covered bases as an (n, 2) array of [start, end) intervals"""
+        mask = numpy.concatenate([[False], self.mask(sequence), [False]])
+        edges = numpy.flatnonzero(mask[1:] != mask[:-1])
+        return edges.reshape(-1, 2)
+
+    def __call__(self, sequence):
+        # the positions involved, like `AvoidMotif` 
+        return numpy.flatnonzero(self.mask(sequence))
+
+    @property
+    def cache_key(self):
+        return ["AvoidMotifSet", self.motifs, self.reverse_complement]
+
+    def __repr__(self):
+        motifs = ", ".join(repr(motif) for motif in self.motifs[:3]) + (", ..." if len(self.motifs) > 3 else "")
+        return f"AvoidMotifSet([{motifs}] ({len(self.motifs)} motifs), reverse_complement={self.reverse_complement})"
+
+
+class AvoidGCContent:
+    """Keep the GC content of every window of `window` bases between
+    `low` and `high`
+
+    Every base of a window that's out of bounds is flagged. The GC content
+    of all the windows is found in one pass, with a rolling sum. Sequences
+    shorter than `window` aren't checked.
+
+    Examples
+    --------
+    >>> gc = AvoidGCContent(low=0.3, high=0.7, window=4)
+    >>> gc("ATATGCGC")
+    # array([0, 1, 2, 3, 4, 5, 6, 7])
+    """
+
+    def __init__(self, low=0.3, high=0.7, window=50):
+        if not 0 <= low <= high <= 1:
+            raise ValueError(f"GC content bounds must satisfy 0 <= low <= high <= 1, not {low} and {high}")
+        if window < 1:
+            raise ValueError(f"GC content window must be at least 1 base, not {window}")
+        self.low = low
+        self.high = high
+        self.window = window
 
-        return list(set(positions))
+        # an edit can only change the windows of the bases within this many bases
+        self.context = window - 1
+
+    def gc_content(self, sequence):
+        """Get the GC content of each window, by its start position"""
+        counts = numpy.cumsum(GC_BASES[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)])
+        counts = numpy.concatenate([[0], counts])
+        return (counts[self.window:] - counts[:-self.window]) / self.window
+
+    def __call__(self, sequence):
+        if len(sequence) < self.window:
+            return numpy.empty(0, dtype=numpy.int64)
+        gc = self.gc_content(sequence)
+        starts = numpy.flatnonzero((gc < self.low) | (gc > self.high))
+        return numpy.flatnonzero(_covered(starts, starts + self.window, len(sequence)))
+
+    @property
+    def cache_key(self):
+        return ["AvoidGCContent", self.low, self.high, self.window]
+
+    def __repr__(self):
+        return f"AvoidGCContent(low={self.low}, high={self.high}, window={self.window})"
+
+
+class AvoidHomopolymers:
+    """Avoid runs of more than `max_length` of the same base
+
+    Every base of a run that's too long is flagged.
+
+    Examples
+    --------
+    >>> AvoidHomopolymers(max_length=4)("ATGAAAAACG")
+    # array([3, 4, 5, 6, 7])
+    """
+
+    def __init__(self, max_length=6):
+        if max_length < 1:
+            raise ValueError(f"Maximum homopolymer length must be at least 1, not {max_length}")
+        self.max_length = max_length
+
+        # a base is in a run that's too long if and only if it's in a window of
+        # `max_length + 1` identical bases, so an edit can only change the
+        # verdict on bases within this many bases
+        self.context = max_length
+
+    def __call__(self, sequence):
+        bases = numpy.frombuffer(sequence.upper().encode(), dtype=numpy.uint8)
+        starts = numpy.flatnonzero(numpy.concatenate([[True], bases[1:] != bases[:-1]]))
+        ends = numpy.append(starts[1:], len(bases))
+        long = ends - starts > self.max_length
+        return numpy.flatnonzero(_covered(starts[long], ends[long], len(bases)))
+
+    @property
+    def cache_key(self):
+        return ["AvoidHomopolymers", self.max_length]
+
+    def __repr__(self):
+        return f"AvoidHomopolymers(max_length={self.max_length})"
+
+
+class AvoidRepeats:
+    """Avoid repeats: every `length`-base sequence may occur only once
+
+    Every base of a `length`-mer that occurs more than once is flagged,
+    along with its other copies, and with `reverse_complement`, also
+    `length`-mers whose reverse complement occurs elsewhere. The
+    `length`-mers are indexed by rolling 2-bit hashes, sorted together,
+    so a check takes O(n log n) however long the repeats are. Bases other
+    than ACGT never match.
+
+    Because the copies of a repeat can be any distance apart, the whole
+    sequence is checked again after each round of edits, but trying out
+    a codon with `check` is incremental.
+
+    Examples
+    --------
+    >>> AvoidRepeats(length=4)("ACGTTTACGT")
+    # array([0, 1, 2, 3, 6, 7, 8, 9])
+    """
+
+    # the copies of a repeat can be anywhere in the sequence
+    context = None
+
+    def __init__(self, length=20, reverse_complement=False):
+        if not 1 <= length <= 32:
+            raise ValueError(f"Repeat length must be between 1 and 32, not {length}")
+        self.length = length
+        self.reverse_complement = reverse_complement
+
+        # the `length`-mers of the last sequence checked, for `check`
+        self._index = None
+        self._lock = threading.Lock()
+
+    def hashes(self, sequence):
+        """Get the 2-bit hash of each `length`-mer, by start position, its
+        reverse complement's, and whether it's made of ACGT only"""
+        return self._hashes(BASE_SYMBOLS[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)])
+
+    def _hashes(self, symbols):
+        n = len(symbols) - self.length + 1
+        bits = (symbols & 3).astype(numpy.uint64)
+        forward = numpy.zeros(n, dtype=numpy.uint64)
+        reverse = numpy.zeros(n, dtype=numpy.uint64)
+        for offset in range(self.length):
+            forward = (forward << numpy.uint64(2)) | bits[offset:offset + n]
+            reverse |= (numpy.uint64(3) - bits[offset:offset + n]) << numpy.uint64(2 * offset)
+        invalid = numpy.concatenate([[0], numpy.cumsum(symbols == 4)])
+        valid = invalid[self.length:] == invalid[:-self.length]
+        return forward, reverse, valid
+
+    def __call__(self, sequence):
+        if len(sequence) < self.length:
+            return numpy.empty(0, dtype=numpy.int64)
+        forward, reverse, valid = self.hashes(sequence)
+        forward, reverse = forward[valid], reverse[valid]
+        starts = numpy.flatnonzero(valid)
+
+        # count each forward hash among all the hashes, less itself (and its
+        # own reverse complement, for a palindrome)
+        everything = numpy.concatenate([forward, reverse]) if self.reverse_complement else forward
+        _, inverse, counts = numpy.unique(everything, return_inverse=True, return_counts=True)
+        copies = counts[inverse[:len(forward)]] - 1
+        if self.reverse_complement:
+            copies -= forward == reverse
+        starts = starts[copies > 0]
+        return numpy.flatnonzero(_covered(starts, starts + self.length, len(sequence)))
+
+    def check(self, sequence, start, end):
+        """Get the flagged bases in [start, end) of the sequence only
+
+        The `length`-mers of the last sequence checked are kept, with the
+        count of each, so when the sequence differs from it in just a few
+        bases (for example, the same sequence with another codon tried out),
+        only the `length`-mers around those bases are updated, and a check
+        costs O(`length`) rather than O(n).
+        """
+        if len(sequence) < self.length:
+            return numpy.empty(0, dtype=numpy.int64)
+        with self._lock:
+            forward, reverse, valid, counts = self._update_index(sequence)
+            first, last = max(0, start - self.length + 1), min(end, len(forward))
+            positions = set()
+            for i, (f, r, ok) in enumerate(zip(forward[first:last].tolist(), reverse[first:last].tolist(),
+                                               valid[first:last].tolist()), first):
+                if ok and counts[f] - 1 - (self.reverse_complement and f == r) > 0:
+                    positions.update(range(max(i, start), min(i + self.length, end)))
+        return numpy.array(sorted(positions), dtype=numpy.int64)
+
+    def _count(self, counts, forward, reverse, valid, sign):
+        for hashes in [forward, reverse] if self.reverse_complement else [forward]:
+            for h in hashes[valid].tolist():
+                counts[h] += sign
+
+    def _update_index(self, sequence):
+        symbols = BASE_SYMBOLS[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)]
+        if self._index is not None and len(self._index[0]) == len(symbols):
+            changed = numpy.flatnonzero(self._index[0] != symbols)
+            _, forward, reverse, valid, counts = self._index
+            if not len(changed):
+                return forward, reverse, valid, counts
+
+            # re-hash the `length`-mers overlapping a few nearby changes
+            if changed[-1] - changed[0] < self.length:
+                first, last = max(0, changed[0] - self.length + 1), min(changed[-1] + 1, len(forward))
+                self._count(counts, forward[first:last], reverse[first:last], valid[first:last], -1)
+                forward[first:last], reverse[first:last], valid[first:last] = \
+                    self._hashes(symbols[first:last + self.length - 1])
+                self._count(counts, forward[first:last], reverse[first:last], valid[first:last], 1)
+                self._index = (symbols, forward, reverse, valid, counts)
+                return forward, reverse, valid, counts
+
+        forward, reverse, valid = self._hashes(symbols)
+        counts = Counter(forward[valid].tolist())
+        if self.reverse_complement:
+            counts.update(reverse[valid].tolist())
+        self._index = (symbols, forward, reverse, valid, counts)
+        return forward, reverse, valid, counts
+
+    @property
+    def cache_key(self):
+        return ["AvoidRepeats", self.length, self.reverse_complement]
+
+    def __repr__(self):
+        return f"AvoidRepeats(length={self.length}, reverse_complement={self.reverse_complement})"
+
+
+def __getattr__(name):
+    # the transformer model lives in its own module and is only imported on 
+    # first use, so that torch is never loaded for the codon models 
+    if name == "TransformerModel":
+        from espresso.transformer import TransformerModel
+        return TransformerModel
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,31 +1,117 @@
-import io 
+from functools import lru_cache, partial 
 
-from espresso.lib import TopCodonModel, IndependentModel, TransformerModel, Scrubber, AvoidMotif
-from espresso.data import sc_codon_use, ec_codon_use, yl_codon_use, fungi_v1
+import numpy
+
+from espresso.lib import TopCodonModel, IndependentModel, Scrubber, AvoidMotifSet
+from espresso.data import load_codon_use, load_transformer
+from espresso.registry import ModelRegistry 
+from espresso.stats import NULL_STATS, Stats
+from espresso.cache import ResultCache, make_key
+from espresso.translation import codon_indices
+
+
+def transformer_model(model_data, **params):
+    """Create a `TransformerModel`, importing torch on first use"""
+    from espresso.transformer import TransformerModel
+    return TransformerModel(model_data, **params)
 
 
 def get_choices():
-    """Get a dict of all available models """
-    # choices = {
-    #     "yeast-top": TopCodonModel(sc_codon_use), 
-    #     "coli-top": TopCodonModel(ec_codon_use), 
-    #     "sc": IndependentModel(sc_codon_use), 
-    #     "ec": IndependentModel(ec_codon_use),
-    #     "yl": IndependentModel(yl_codon_use),
-    #     "fungi-v1": TransformerModel(fungi_v1), 
-    # }
+    """Get a dict of all available models 
+
+    Each model is a pair of a model class (or factory) and a function that 
+    loads its data, so that nothing is read from disk until it's needed 
+    """
     choices = {
-        "yeast-top": (TopCodonModel, sc_codon_use), 
-        "coli-top": (TopCodonModel, ec_codon_use), 
-        "sc": (IndependentModel, sc_codon_use), 
-        "ec": (IndependentModel, ec_codon_use),
-        "yl": (IndependentModel, yl_codon_use),
-        "fungi-v1": (TransformerModel, fungi_v1), 
+        "yeast-top": (TopCodonModel, partial(load_codon_use, "sc")), 
+        "coli-top": (TopCodonModel, partial(load_codon_use, "ec")), 
+        "sc": (IndependentModel, partial(load_codon_use, "sc")), 
+        "ec": (IndependentModel, partial(load_codon_use, "ec")),
+        "yl": (IndependentModel, partial(load_codon_use, "yl")),
+        "fungi-v1": (transformer_model, partial(load_transformer, "fungi-v1")), 
     }
     return choices
 
 
-def design_coding_sequence(protein_sequence, model="sc"):
+# models usable by the scrubber, which resamples one codon at a time 
+SCRUB_MODELS = ["sc", "ec", "yl"]
+
+# a process-wide cache of constructed models, shared by all callers 
+model_registry = ModelRegistry(get_choices())
+
+# a process-wide cache of deterministic results (see `espresso.cache`), 
+# which may be replaced, or set to None to turn caching off 
+result_cache = ResultCache()
+
+
+def get_model(model, **params):
+    """Get the shared instance of a model by slug, constructing it on first use
+
+    Parameters
+    ----------
+    model: str
+        The name of a model 
+    params: 
+        Keyword arguments for the model class, for example `threshold`
+
+    Examples
+    --------
+    Load the transformer model ahead of time, so that the first design 
+    doesn't pay for it 
+
+    >>> transformer = get_model("fungi-v1")
+    """
+    return model_registry.get(model, **params)
+
+
+def _cached(kind, model, parts):
+    """Get the result cache, and the key of a job in it, or (None, None) if 
+    there's no cache or the job's inputs can't be made into a key"""
+    cache = result_cache
+    if cache is None:
+        return None, None
+    digest = model_registry.digest(model)
+    if digest is None:
+        return None, None
+    try:
+        return cache, make_key(kind, model, digest, *parts)
+    except TypeError:
+        return None, None
+
+
+@lru_cache(maxsize=64)
+def _constrained_designer(instance, motifs):
+    # building the automaton and its codon transitions costs far more than a 
+    # design, so designers are kept for repeated designs with the same motifs 
+    from espresso.constrained import ConstrainedDesigner
+    return ConstrainedDesigner(instance, list(motifs))
+
+
+def _reproducible(instance, seed, options):
+    """Whether a design is the same every time: with a seed, a deterministic 
+    model, or a deterministic decoding strategy. Only these are cached, so 
+    that a sampled design without a seed is a new sample every time"""
+    return seed is not None or getattr(instance, "deterministic", False) or options.get("strategy", "sample") != "sample"
+
+
+def make_designer(avoid, model="sc"):
+    """Create a `ConstrainedDesigner` for a codon model slug, that avoids a 
+    list of motifs (which may use IUPAC degenerate bases) or an `AvoidMotifSet`
+
+    Designers for a list of motifs are cached, and shared by every design 
+    with the same model and motifs 
+    """
+    from espresso.constrained import ConstrainedDesigner
+
+    instance = get_model(model)
+    if not hasattr(instance, "table"):
+        raise ValueError(f'Model "{model}" can\'t design around motifs, only codon models can')
+    if isinstance(avoid, AvoidMotifSet):
+        return ConstrainedDesigner(instance, avoid)
+    return _constrained_designer(instance, tuple(avoid))
+
+
+def design_coding_sequence(protein_sequence, model="sc", stats=None, seed=None, avoid=None, **options):
     """Create a gene sequence from a protein sequence
 
     Parameters
@@ -34,54 +120,207 @@ def design_coding_sequence(protein_sequence, model="sc"):
         Protein sequence as a string 
     codon_table: str
         The name of a codon model
+    stats: espresso.stats.Stats
+        Optionally, collects where the time went: loading the model, and 
+        designing (and for the transformer models, decoding in detail)
+    seed: int
+        Optionally, a seed for reproducible designs 
+    avoid: list
+        Optionally, motifs that the design must not contain (see 
+        `make_designer`). Rather than scrubbing the motifs afterwards, the 
+        most likely coding sequence that avoids them is found directly (see 
+        `espresso.constrained`), or with the option `strategy="sample"`, a 
+        sample of the ones that do. Only for the codon models 
+    options: 
+        Keyword arguments for the model's `generate_sequence`, for example 
+        the decoding `strategy` of a transformer model 
+
+    Designs that are reproducible (with a `seed`, a deterministic model such 
+    as `coli-top`, or a deterministic decoding strategy, such as designing 
+    around motifs with the default `strategy="best"`) are kept in 
+    `result_cache`, and returned from there when asked for again. Sampled 
+    designs without a `seed` are never cached: each call draws a new 
+    sample. Set `result_cache` to None to turn caching off. 
 
     Examples
     --------
     An example of encoding a protein 
 
     >>> encoded = design_coding_sequence("MMM")
+
+    Design a gene without EcoRI or BamHI sites 
+
+    >>> encoded = design_coding_sequence("MENFHHRPFK", "ec", avoid=["GAATTC", "GGATCC"])
+
+    Find out where the time went 
+
+    >>> stats = Stats()
+    >>> encoded = design_coding_sequence("MMM", "fungi-v1", stats=stats)
+    >>> stats.as_dict()
     """
+    stats = stats or NULL_STATS
 
-    choices = get_choices() 
-
-    if model in choices.keys():
-        model_cls, model_data = choices[model] 
-        model = model_cls(model_data)
-        
-        # For the transformer models, the data is stored on disk as 
-        # a Torch tensor, and read into a `BytesIO` wrapper to be used.
-        # Because of this, we need to seek the `BytesIO` object to the
-        # beginning each time 
-        if isinstance(model_data, io.BytesIO):
-            model_data.seek(0)
-    else:
-        raise ValueError(f'Model "{model}" not found')
+    with stats.span("load_model"):
+        instance = get_model(model)
+        if avoid is not None:
+            instance = make_designer(avoid, model)
+            options.setdefault("strategy", "best")
+
+    cache, key = None, None
+    parts = [protein_sequence, seed, options]
+    if avoid is not None:
+        parts.append(getattr(avoid, "cache_key", None) or list(avoid))
+    if _reproducible(instance, seed, options):
+        cache, key = _cached("design", model, parts)
+    if cache is not None:
+        sequence = cache.get(key)
+        if sequence is not None:
+            stats.count("cache_hits")
+            return sequence 
 
-    sequence = model.generate_sequence(protein_sequence) 
+    with stats.span("design"):
+        sequence = instance.generate_sequence(protein_sequence, stats=stats, rng=seed, **options) 
 
+    if cache is not None:
+        cache.put(key, sequence)
     return sequence 
     
 
-def scrub_sequence(nucleotide_sequence, avoid, model="sc"):
-    """Scrub a nucleotide sequence of specific motifs or regions of GC content"""
+def design_candidates(protein_sequence, model="sc", n=100, seed=None, avoid=None, gc_content=None, reference=None, 
+                      scorer=None, rank_by=None, unique=True, stats=None, **options):
+    """Design many candidate coding sequences at once, and rank them
+
+    Parameters
+    ----------
+    protein_sequence: str
+        Protein sequence as a string 
+    model: str
+        The name of a model. The codon models draw all `n` candidates in one 
+        go, and the transformer models design them in batches, with their 
+        log-likelihoods 
+    n: int
+        The number of candidates to design 
+    seed: int
+        Optionally, a seed for reproducible candidates 
+    avoid: list
+        Optionally, motifs (or an `AvoidMotifSet`) to count in each candidate 
+    gc_content: espresso.lib.AvoidGCContent
+        The GC content window and bounds to check each candidate against, by 
+        default 50 bases between 30% and 70% 
+    reference: str
+        The name of a codon model to compute the codon adaptation index (CAI) 
+        against, by default the model itself, if it's a codon model 
+    scorer: str
+        Optionally, the name of a transformer model to score the 
+        log-likelihood of each candidate with 
+    rank_by: str
+        The score to rank candidates by, after motif and GC content window 
+        violations (see `espresso.scoring.rank`) 
+    unique: bool
+        Whether to drop repeated candidates, so there may be fewer than `n` 
+    stats: espresso.stats.Stats
+        Optionally, collects the time spent loading the models, generating, 
+        scoring and ranking 
+    options: 
+        Keyword arguments for a transformer model's `generate_sequences`, 
+        for example `temperature` 
+
+    Returns an `espresso.scoring.Candidates`, best first, with the (N, L) 
+    array of the candidates' codon indices and a dict of their scores (see 
+    `espresso.scoring.score_candidates`). 
+
+    Examples
+    --------
+    The 100 most adapted of 10,000 candidates, without EcoRI sites 
+
+    >>> candidates = design_candidates("MENFHHRPFK", "ec", n=10_000, avoid=["GAATTC"])
+    >>> candidates.best, candidates.row(0)
+    >>> top = list(candidates)[:100]
+    """
+    from espresso.scoring import Candidates, score_candidates
+
+    stats = stats or NULL_STATS
+
+    with stats.span("load_model"):
+        instance = get_model(model)
+        table = getattr(get_model(reference) if reference is not None else instance, "table", None)
+        if reference is not None and table is None:
+            raise ValueError(f'Model "{reference}" has no codon table to compute the CAI against')
+        scorer = get_model(scorer) if scorer is not None else None
+
+    log_likelihood = None
+    with stats.span("generate"):
+        if hasattr(instance, "sample_codons"):
+            codons = instance.sample_codons(protein_sequence, n, rng=seed, **options)
+        else:
+            designs = instance.generate_sequences([protein_sequence] * n, return_log_likelihood=True, stats=stats, 
+                                                  rng=seed, **options)
+            codons = numpy.array([codon_indices(sequence) for sequence, _ in designs], dtype=numpy.uint8)
+            log_likelihood = numpy.array([value for _, value in designs])
+        if unique:
+            keep = numpy.sort(numpy.unique(codons, axis=0, return_index=True)[1])
+            codons = codons[keep]
+            log_likelihood = log_likelihood[keep] if log_likelihood is not None else None
+        stats.count("candidates", len(codons))
+
+    with stats.span("score"):
+        if scorer is not None:
+            log_likelihood = scorer.score_codons(protein_sequence, codons)
+        scores = score_candidates(codons, table=table, avoid=avoid, gc_content=gc_content, log_likelihood=log_likelihood)
+
+    with stats.span("rank"):
+        return Candidates(codons, scores, rank_by=rank_by)
+
+
+def make_scrubber(avoid, model="sc"):
+    """Create a `Scrubber` for a list of motifs or constraints, and a model slug
+
+    Motifs given as strings (which may use IUPAC degenerate bases) are all 
+    matched together in a single pass, other constraints are used as is 
+    """
 
     # process avoid options 
-    avoid = [AvoidMotif(x) for x in avoid]
+    motifs = [x for x in avoid if isinstance(x, str)]
+    avoid = [x for x in avoid if not isinstance(x, str)]
+    if motifs:
+        avoid.append(AvoidMotifSet(motifs))
 
     # process model options 
-    choices = {
-        "sc": IndependentModel(sc_codon_use), 
-        "ec": IndependentModel(ec_codon_use),
-        "yl": IndependentModel(yl_codon_use),
-    }
-
-    if model in choices:
-        model = choices[model] 
+    if model in SCRUB_MODELS:
+        model = get_model(model) 
     else:
         raise ValueError(f'Model "{model}" not found')
 
-    # scrub 
-    scrubber = Scrubber(avoid=avoid, model=model)
+    return Scrubber(avoid=avoid, model=model)
 
-    return scrubber.scrub(nucleotide_sequence) 
+
+def scrub_sequence(nucleotide_sequence, avoid, model="sc", stats=None, seed=None):
+    """Scrub a nucleotide sequence of specific motifs or regions of GC content
+
+    See `make_scrubber` for the supported `avoid` options, and 
+    `design_coding_sequence` for `stats`. With a `seed`, scrubbing is 
+    reproducible, and the result is cached (if every constraint in `avoid` 
+    is a motif, or has a `cache_key`). 
+    """
+    stats = stats or NULL_STATS
+
+    with stats.span("load_model"):
+        scrubber = make_scrubber(avoid, model)
+
+    cache, key = None, None
+    constraints = [x if isinstance(x, str) else getattr(x, "cache_key", None) for x in avoid]
+    if seed is not None and None not in constraints:
+        cache, key = _cached("scrub", model, [nucleotide_sequence, constraints, seed])
+    if cache is not None:
+        sequence = cache.get(key)
+        if sequence is not None:
+            stats.count("cache_hits")
+            return sequence 
+
+    with stats.span("scrub"):
+        sequence = scrubber.scrub(nucleotide_sequence, rng=seed, stats=stats) 
+
+    if cache is not None:
+        cache.put(key, sequence)
+    return sequence 
 
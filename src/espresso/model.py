@@ -1,13 +1,21 @@
 import math
+import warnings
+from collections import namedtuple
+
 from torch import Tensor
 import torch
 import torch.nn as nn
 from torch.nn import Transformer
 import torch.nn.functional as F
 
+from espresso.stats import NULL_STATS
+
 DEVICE = torch.device("cpu")
 UNK_IDX, PAD_IDX, BOS_IDX, EOS_IDX = 0, 1, 2, 3
 
+# the traced and frozen `encode` and `step` of a Seq2SeqTransformer, see `compile_for_inference` 
+CompiledModel = namedtuple("CompiledModel", ["encode", "step"])
+
 
 # functions for generating the autoregressive mask
 def generate_square_subsequent_mask(sz):
@@ -45,8 +53,8 @@ class PositionalEncoding(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.register_buffer('pos_embedding', pos_embedding)
 
-    def forward(self, token_embedding: Tensor):
-        return self.dropout(token_embedding + self.pos_embedding[:token_embedding.size(0), :])
+    def forward(self, token_embedding: Tensor, offset: int = 0):
+        return self.dropout(token_embedding + self.pos_embedding[offset:offset + token_embedding.size(0), :])
 
 
 # helper Module to convert tensor of input indices into corresponding tensor of token embeddings
@@ -60,6 +68,76 @@ class TokenEmbedding(nn.Module):
         return self.embedding(tokens.long()) * math.sqrt(self.emb_size)
 
 
+def _split_heads(x, nhead):
+    # (L, N, E) -> (N, H, L, E // H)
+    L, N, E = x.shape
+    return x.reshape(L, N, nhead, E // nhead).permute(1, 2, 0, 3)
+
+
+def _merge_heads(x):
+    # (N, H, L, D) -> (L, N, H * D)
+    N, H, L, D = x.shape
+    return x.permute(2, 0, 1, 3).reshape(L, N, H * D)
+
+
+class DecoderCache:
+    """Attention keys and values for incremental decoding
+
+    Holds, for every decoder layer, the cross-attention projections of the 
+    encoder `memory` (computed once) and the self-attention keys and values 
+    of every target position decoded so far, so that each new position only 
+    costs one position of compute.
+    """
+
+    def __init__(self, model, memory, memory_key_padding_mask=None):
+        self.nhead = model.transformer.nhead
+        self.position = 0
+        memory_kv = []
+        for layer in model.transformer.decoder.layers:
+            attn = layer.multihead_attn
+            w_q, w_k, w_v = attn.in_proj_weight.chunk(3)
+            b_q, b_k, b_v = attn.in_proj_bias.chunk(3)
+            k = _split_heads(F.linear(memory, w_k, b_k), self.nhead)
+            v = _split_heads(F.linear(memory, w_v, b_v), self.nhead)
+            memory_kv.append((k, v))
+        self.memory_kv = tuple(memory_kv)
+
+        # no target positions yet: empty (N, H, 0, E // H) keys and values per layer 
+        empty = k[:, :, :0]
+        self.self_kv = tuple((empty, empty) for _ in memory_kv)
+
+        # additive mask over the memory positions, shaped to broadcast over heads and queries
+        if memory_key_padding_mask is None:
+            memory_key_padding_mask = torch.zeros(memory.shape[1], memory.shape[0], dtype=torch.bool, device=memory.device)
+        self.memory_mask = torch.zeros(memory_key_padding_mask.shape, device=memory.device)
+        self.memory_mask = self.memory_mask.masked_fill(memory_key_padding_mask, float("-inf"))[:, None, None, :]
+
+    def reorder(self, rows):
+        """Keep the self-attention keys and values of batch `rows` (in that 
+        order), for example to follow the surviving beams of a beam search
+
+        The memory projections are left alone, so rows may only move between 
+        beams of the same source sequence.
+        """
+        self.self_kv = tuple((k[rows], v[rows]) for k, v in self.self_kv)
+
+
+def filter_logits(logits, top_k=None, top_p=None):
+    """Mask (N, V) `logits` to the `top_k` most likely tokens, and/or to the 
+    smallest set of tokens whose probabilities add up to at least `top_p` 
+    (nucleus sampling)"""
+    if top_k is not None and top_k < logits.shape[-1]:
+        kth = logits.topk(top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if top_p is not None and top_p < 1.:
+        sorted_logits, order = logits.sort(dim=-1, descending=True)
+        probs = F.softmax(sorted_logits, dim=-1)
+        # drop a token once the more likely tokens already cover `top_p`
+        remove = probs.cumsum(dim=-1) - probs >= top_p
+        logits = logits.masked_fill(torch.zeros_like(remove).scatter(-1, order, remove), float("-inf"))
+    return logits
+
+
 # Seq2Seq Network
 class Seq2SeqTransformer(nn.Module):
     def __init__(self,
@@ -83,6 +161,7 @@ class Seq2SeqTransformer(nn.Module):
         self.tgt_tok_emb = TokenEmbedding(tgt_vocab_size, emb_size)
         self.positional_encoding = PositionalEncoding(
             emb_size, dropout=dropout)
+        self.compiled = None
 
     def forward(self, src, tgt, src_mask, tgt_mask, src_padding_mask, tgt_padding_mask, memory_key_padding_mask):
         src_emb = self.positional_encoding(self.src_tok_emb(src))
@@ -90,29 +169,273 @@ class Seq2SeqTransformer(nn.Module):
         outs = self.transformer(src_emb, tgt_emb, src_mask, tgt_mask, None, src_padding_mask, tgt_padding_mask, memory_key_padding_mask)
         return self.generator(outs)
 
-    def encode(self, src, src_mask):
-        return self.transformer.encoder(self.positional_encoding(self.src_tok_emb(src)), src_mask)
+    def encode(self, src, src_mask, src_padding_mask=None):
+        if self.compiled is not None:
+            if src_padding_mask is None:
+                src_padding_mask = torch.zeros(src.shape[1], src.shape[0], dtype=torch.bool, device=src.device)
+            return self.compiled.encode(src, src_mask, src_padding_mask)
+        return self.transformer.encoder(self.positional_encoding(self.src_tok_emb(src)), src_mask, src_padding_mask)
+
+    def decode(self, tgt, memory, tgt_mask, memory_key_padding_mask=None):
+        return self.transformer.decoder(self.positional_encoding(self.tgt_tok_emb(tgt)), memory, tgt_mask,
+                                        memory_key_padding_mask=memory_key_padding_mask)
+
+    def compile_for_inference(self, quantize=True):
+        """Optimize the model for inference on CPU, in place
+
+        With `quantize`, the weights of the Linear layers are dynamically 
+        quantized to int8, per output channel. Then `encode` and the 
+        incremental decoding `step` are traced, and the traces frozen 
+        (weights folded in as constants), so that decoding no longer 
+        dispatches through Python modules. The model must be in eval mode, 
+        and can't be trained or reloaded after.
+        """
+        if self.training:
+            raise RuntimeError("espresso: call eval() before compiling a model for inference")
+        if quantize:
+            torch.ao.quantization.quantize_dynamic(self, {nn.Linear: torch.ao.quantization.per_channel_dynamic_qconfig},
+                                                 dtype=torch.qint8, inplace=True)
+
+        with torch.no_grad():
+            # example inputs, with some padding and a few positions already decoded 
+            src = torch.full((7, 2), BOS_IDX, dtype=torch.long, device=DEVICE)
+            src_mask = torch.zeros(7, 7, dtype=torch.bool, device=DEVICE)
+            src_padding_mask = torch.zeros(2, 7, dtype=torch.bool, device=DEVICE)
+            src_padding_mask[1, 5:] = True
+            cache = DecoderCache(self, self.encode(src, src_mask, src_padding_mask), src_padding_mask)
+            tgt = torch.full((1, 2), BOS_IDX, dtype=torch.long, device=DEVICE)
+            for _ in range(3):
+                self.decode_step(tgt, cache)
+            positions = torch.arange(cache.position, cache.position + 1, device=DEVICE)
+
+            # the tracer warns about the shape checks of the attention layers, 
+            # which hold for any batch or sequence length 
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                traced = torch.jit.trace_module(self, {
+                    "encode": (src, src_mask, src_padding_mask), 
+                    "step": (tgt, positions, cache.self_kv, cache.memory_kv, cache.memory_mask),
+                }, check_trace=False)
+            frozen = torch.jit.freeze(traced, preserved_attrs=["encode", "step"])
+        self.compiled = CompiledModel(frozen.encode, frozen.step)
+        return self
+
+    def decode_step(self, tgt, cache):
+        """Decode the next (1, N) target tokens against a `DecoderCache`
+
+        Equivalent to the last position of `decode` over the whole prefix, 
+        but only computes the new position. The cache is updated in place.
+        """
+        step = self.step if self.compiled is None else self.compiled.step
+        positions = torch.arange(cache.position, cache.position + tgt.shape[0], device=tgt.device)
+        x, cache.self_kv = step(tgt, positions, cache.self_kv, cache.memory_kv, cache.memory_mask)
+        cache.position += tgt.shape[0]
+        return x
+
+    def step(self, tgt, positions, self_kv, memory_kv, memory_mask):
+        """The computation of `decode_step`, over plain tensors (so that it can 
+        be traced): returns the decoded positions, and the self-attention keys 
+        and values of each layer with the new positions appended"""
+        x = self.positional_encoding.dropout(self.tgt_tok_emb(tgt) + self.positional_encoding.pos_embedding[positions])
+        nhead = self.transformer.nhead
+        new_kv = []
+        for layer, (k_prefix, v_prefix), (memory_k, memory_v) in zip(self.transformer.decoder.layers, self_kv, memory_kv):
+            # self attention over the cached prefix plus the new position
+            attn = layer.self_attn
+            q, k, v = (_split_heads(y, nhead) for y in F.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1))
+            k = torch.cat([k_prefix, k], dim=2)
+            v = torch.cat([v_prefix, v], dim=2)
+            new_kv.append((k, v))
+            sa = attn.out_proj(_merge_heads(F.scaled_dot_product_attention(q, k, v)))
+            x = layer.norm1(x + sa)
+
+            # cross attention over the pre-projected memory
+            attn = layer.multihead_attn
+            w_q, _, _ = attn.in_proj_weight.chunk(3)
+            b_q, _, _ = attn.in_proj_bias.chunk(3)
+            q = _split_heads(F.linear(x, w_q, b_q), nhead)
+            mha = attn.out_proj(_merge_heads(F.scaled_dot_product_attention(q, memory_k, memory_v, attn_mask=memory_mask)))
+            x = layer.norm2(x + mha)
+
+            x = layer.norm3(x + layer.linear2(layer.activation(layer.linear1(x))))
 
-    def decode(self, tgt, memory, tgt_mask):
-        return self.transformer.decoder(self.positional_encoding(self.tgt_tok_emb(tgt)), memory, tgt_mask)
+        if self.transformer.decoder.norm is not None:
+            x = self.transformer.decoder.norm(x)
+        return x, tuple(new_kv)
 
-    def sample(self, src, src_mask, max_len, start_symbol, temperature=1.0):
+    @torch.inference_mode()
+    def sample(self, src, src_mask, max_len, start_symbol, temperature=1.0, src_padding_mask=None, use_cache=True,
+               allowed_tokens=None, strategy="sample", top_k=None, top_p=None, beam_width=4, 
+               return_log_likelihood=False, stats=None, generator=None):
+        """Sample target tokens for a (S, N) batch of source sequences
+
+        All sequences in the batch are decoded in lockstep. Once a sequence
+        has produced <eos>, the remaining positions are filled with <pad>,
+        and decoding stops as soon as every sequence is finished.
+
+        With `use_cache`, attention keys and values are cached between steps 
+        (see `DecoderCache`) so each step only computes the newest position, 
+        instead of re-running the decoder over the whole prefix.
+
+        `allowed_tokens` optionally constrains decoding: a boolean tensor of 
+        shape (max_len - 1, N, V), where step `i` may only sample the tokens 
+        that are true in `allowed_tokens[i]`.
+
+        `strategy` picks how each token is chosen:
+
+        - "sample" draws from the softmax at `temperature`, optionally 
+          restricted to the `top_k` tokens and/or the `top_p` nucleus
+        - "greedy" takes the most likely token
+        - "beam" runs a beam search with `beam_width` beams per sequence 
+          (see `beam_search`)
+
+        With `return_log_likelihood`, also returns an (N,) tensor with the 
+        log-likelihood of each sequence: the sum over its tokens (up to and 
+        including <eos>) of their log-probabilities under the model at 
+        temperature 1, over the allowed tokens. 
+
+        If given, `stats` (see `espresso.stats`) collects the time spent 
+        encoding and decoding, and counts the decoding steps and the tokens 
+        decoded. Sampling draws from `generator` (a `torch.Generator`) if 
+        given, for reproducible sequences.
+        """
+        if strategy == "beam":
+            ys, log_likelihood = self.beam_search(src, src_mask, max_len, start_symbol, beam_width=beam_width, 
+                                                  src_padding_mask=src_padding_mask, allowed_tokens=allowed_tokens, 
+                                                  stats=stats)
+            return (ys, log_likelihood) if return_log_likelihood else ys
+        if strategy not in ("sample", "greedy"):
+            raise ValueError(f'Unknown decoding strategy "{strategy}"')
+
+        stats = stats or NULL_STATS
+        src = src.to(DEVICE)
+        src_mask = src_mask.to(DEVICE)
+        if src_padding_mask is not None:
+            src_padding_mask = src_padding_mask.to(DEVICE)
+        batch_size = src.shape[1]
+
+        with stats.span("encode"):
+            memory = self.encode(src, src_mask, src_padding_mask)
+        with stats.span("decode"):
+            ys = torch.ones(1, batch_size).fill_(start_symbol).type(torch.long).to(DEVICE)
+            finished = torch.zeros(batch_size, dtype=torch.bool, device=DEVICE)
+            log_likelihood = torch.zeros(batch_size, device=DEVICE)
+            cache = DecoderCache(self, memory, src_padding_mask) if use_cache else None
+            for i in range(max_len-1):
+                if use_cache:
+                    out = self.decode_step(ys[-1:], cache)[-1]
+                else:
+                    tgt_mask = (generate_square_subsequent_mask(ys.size(0))
+                                .type(torch.bool)).to(DEVICE)
+                    out = self.decode(ys, memory, tgt_mask, src_padding_mask)[-1]
+                logits = self.generator(out)
+                if allowed_tokens is not None:
+                    logits = logits.masked_fill(~allowed_tokens[i], float("-inf"))
+                if strategy == "greedy":
+                    next_word = logits.argmax(dim=-1)
+                else:
+                    probs = F.softmax(filter_logits(logits / temperature, top_k, top_p), dim=-1)
+                    next_word = torch.multinomial(probs, 1, generator=generator).flatten()
+                log_probs = F.log_softmax(logits, dim=-1).gather(1, next_word[:, None]).flatten()
+                log_likelihood += log_probs.masked_fill(finished, 0.)
+                next_word = next_word.masked_fill(finished, PAD_IDX)
+                ys = torch.cat([ys, next_word.view(1, -1)], dim=0)
+                finished |= next_word == EOS_IDX
+                if finished.all():
+                    break
+        if stats.enabled:
+            stats.count("decode_steps", ys.shape[0] - 1)
+            stats.count("tokens", int((ys[1:] != PAD_IDX).sum()))
+        return (ys, log_likelihood) if return_log_likelihood else ys
+
+    @torch.inference_mode()
+    def score(self, src, src_mask, tgt, src_padding_mask=None, allowed_tokens=None):
+        """Get the (T - 1, N, V) log-probabilities of the next token at each 
+        position of a (T, N) batch of target sequences, given the source
+
+        The target is fed in one position at a time (teacher forcing), just as 
+        in `sample`, and `allowed_tokens` is applied in the same way. 
+        """
         src = src.to(DEVICE)
         src_mask = src_mask.to(DEVICE)
+        tgt = tgt.to(DEVICE)
+        if src_padding_mask is not None:
+            src_padding_mask = src_padding_mask.to(DEVICE)
+
+        cache = DecoderCache(self, self.encode(src, src_mask, src_padding_mask), src_padding_mask)
+        log_probs = []
+        for i in range(tgt.shape[0] - 1):
+            logits = self.generator(self.decode_step(tgt[i:i + 1], cache)[-1])
+            if allowed_tokens is not None:
+                logits = logits.masked_fill(~allowed_tokens[i], float("-inf"))
+            log_probs.append(F.log_softmax(logits, dim=-1))
+        return torch.stack(log_probs)
+
+    @torch.inference_mode()
+    def beam_search(self, src, src_mask, max_len, start_symbol, beam_width=4, src_padding_mask=None, 
+                    allowed_tokens=None, stats=None):
+        """Find the most likely target tokens for a (S, N) batch of source 
+        sequences, keeping the `beam_width` best prefixes of each sequence
+
+        The beams of every sequence are decoded together as a single batch of 
+        N * beam_width rows, against a shared `DecoderCache` that is reordered 
+        as beams are kept or dropped. Returns the (T, N) tokens of the best 
+        beam of each sequence, padded with <pad> after <eos>, and their (N,) 
+        log-likelihoods (see `sample`). 
+        """
+        stats = stats or NULL_STATS
+        src = src.to(DEVICE)
+        src_mask = src_mask.to(DEVICE)
+        if src_padding_mask is not None:
+            src_padding_mask = src_padding_mask.to(DEVICE)
+        batch_size = src.shape[1]
+        rows = batch_size * beam_width
+
+        # each sequence is repeated once per beam, in consecutive rows 
+        with stats.span("encode"):
+            memory = self.encode(src, src_mask, src_padding_mask).repeat_interleave(beam_width, dim=1)
+        if src_padding_mask is not None:
+            src_padding_mask = src_padding_mask.repeat_interleave(beam_width, dim=0)
+        if allowed_tokens is not None:
+            allowed_tokens = allowed_tokens.to(DEVICE).repeat_interleave(beam_width, dim=1)
+        cache = DecoderCache(self, memory, src_padding_mask)
+
+        with stats.span("decode"):
+            ys = torch.ones(1, rows).fill_(start_symbol).type(torch.long).to(DEVICE)
+            finished = torch.zeros(rows, dtype=torch.bool, device=DEVICE)
+
+            # the beams start out identical, so only the first one is expanded at first 
+            scores = torch.full((batch_size, beam_width), float("-inf"), device=DEVICE)
+            scores[:, 0] = 0.
+
+            # finished beams can only be extended by <pad>, at no cost 
+            padding = torch.full((1, self.generator.out_features), float("-inf"), device=DEVICE)
+            padding[0, PAD_IDX] = 0.
+
+            offsets = torch.arange(batch_size, device=DEVICE)[:, None] * beam_width
+            for i in range(max_len-1):
+                logits = self.generator(self.decode_step(ys[-1:], cache)[-1])
+                if allowed_tokens is not None:
+                    logits = logits.masked_fill(~allowed_tokens[i], float("-inf"))
+                log_probs = torch.where(finished[:, None], padding, F.log_softmax(logits, dim=-1))
+
+                # the best `beam_width` extensions of all of the beams of each sequence
+                candidates = (scores.view(rows, 1) + log_probs).view(batch_size, -1)
+                scores, best = candidates.topk(beam_width, dim=-1)
+                source = (offsets + best // log_probs.shape[-1]).flatten()
+                next_word = (best % log_probs.shape[-1]).flatten()
+
+                ys = torch.cat([ys[:, source], next_word.view(1, -1)], dim=0)
+                cache.reorder(source)
+                finished = finished[source] | (next_word == EOS_IDX)
+
+                # beams that scored -inf are dead ends, and never win 
+                if (finished | scores.flatten().isinf()).all():
+                    break
 
-        memory = self.encode(src, src_mask)
-        ys = torch.ones(1, 1).fill_(start_symbol).type(torch.long).to(DEVICE)
-        for i in range(max_len-1):
-            memory = memory.to(DEVICE)
-            tgt_mask = (generate_square_subsequent_mask(ys.size(0))
-                        .type(torch.bool)).to(DEVICE)
-            out = self.decode(ys, memory, tgt_mask)
-            out = out.transpose(0, 1)
-            logits = self.generator(out[:, -1]) / temperature
-            #_, next_word = torch.max(prob, dim=1)  # for greedy sampling
-            next_word = torch.multinomial(F.softmax(logits, dim=-1), 1).item()
-            ys = torch.cat([ys,
-                            torch.ones(1, 1).type_as(src.data).fill_(next_word)], dim=0)
-            if next_word == EOS_IDX:
-                break
-        return ys
\ No newline at end of file
+        log_likelihood, best = scores.max(dim=-1)
+        ys = ys[:, offsets.flatten() + best]
+        if stats.enabled:
+            stats.count("decode_steps", ys.shape[0] - 1)
+            stats.count("tokens", int((ys[1:] != PAD_IDX).sum()))
+        return ys, log_likelihood
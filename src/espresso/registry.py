@@ -0,0 +1,132 @@
+import io
+import threading
+
+from espresso.cache import data_digest
+
+
+class ModelRegistry:
+    """A thread-safe cache of constructed design models
+
+    Models are registered by slug along with their class and data, and are
+    only constructed on first use. The data may also be a function that
+    loads it, which is then only called when the model is constructed.
+
+    Each combination of slug and parameters (for example, the `threshold` of
+    an `IndependentModel`) is constructed once, and the same instance is
+    shared by every caller after that.
+
+    Examples
+    --------
+    >>> registry = ModelRegistry({"ec": (IndependentModel, ec_codon_use)})
+    >>> registry.warm_up("ec")
+    >>> registry.get("ec") is registry.get("ec")
+    True
+    """
+
+    def __init__(self, choices=None):
+        self._choices = {}
+        self._models = {}
+        self._data = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+        self._slug_locks = {}
+        for slug, (model_cls, model_data) in (choices or {}).items():
+            self.register(slug, model_cls, model_data)
+
+    def __contains__(self, slug):
+        return slug in self._choices
+
+    def slugs(self):
+        """List the slugs of all registered models"""
+        return list(self._choices)
+
+    def cached(self):
+        """List the (slug, params) keys of all constructed models"""
+        with self._lock:
+            return list(self._models)
+
+    def register(self, slug, model_cls, model_data):
+        """Register a model class and its data under `slug`, replacing (and
+        evicting) any model previously registered with the same slug"""
+        with self._lock:
+            self._choices[slug] = (model_cls, model_data)
+            self._slug_locks.setdefault(slug, threading.Lock())
+        self.evict(slug)
+
+    def get(self, slug, **params):
+        """Get the model for `slug`, constructing it with `params` on first use
+
+        Raises
+        ------
+        ValueError
+            If no model is registered under `slug`
+        """
+        key = (slug, tuple(sorted(params.items())))
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        if slug not in self._choices:
+            raise ValueError(f'Model "{slug}" not found')
+
+        # construct each slug at most once at a time, so that concurrent callers
+        # wait for the first one instead of loading the same model twice
+        with self._slug_locks[slug]:
+            model = self._models.get(key)
+            if model is None:
+                model_cls, model_data = self._choices[slug]
+                if callable(model_data):
+                    model_data = model_data()
+
+                # data registered as an in-memory file may have been read
+                # before, so start again from the beginning
+                if isinstance(model_data, io.BytesIO):
+                    model_data.seek(0)
+
+                model = model_cls(model_data, **params)
+                with self._lock:
+                    self._models[key] = model
+                    self._data[key] = model_data
+
+        return model
+
+    def digest(self, slug, **params):
+        """Get a digest of the data of the model for `slug` (constructing it
+        if needed), or None if its data can't be digested
+
+        The data is only digested on first use, and the digest is kept along
+        with the model.
+        """
+        self.get(slug, **params)
+        key = (slug, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+            model_data = self._data.get(key)
+        digest = data_digest(model_data)
+        with self._lock:
+            if key in self._models:
+                self._digests[key] = digest
+                self._data.pop(key, None)
+        return digest
+
+    def warm_up(self, *slugs, **params):
+        """Construct the models for `slugs` (or all registered models) ahead of time"""
+        for slug in slugs or self.slugs():
+            self.get(slug, **params)
+
+    def evict(self, slug=None, **params):
+        """Drop constructed models from the cache
+
+        With no arguments, every model is evicted. With only a `slug`, every
+        model constructed for that slug is evicted, regardless of parameters.
+        """
+        with self._lock:
+            for key in list(self._models):
+                if slug is not None and key[0] != slug:
+                    continue
+                if params and key[1] != tuple(sorted(params.items())):
+                    continue
+                del self._models[key]
+                self._data.pop(key, None)
+                self._digests.pop(key, None)
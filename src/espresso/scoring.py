@@ -0,0 +1,172 @@
+"""Score and rank many candidate coding sequences at once
+
+Candidates for one protein are held as an (N, L) array of codon indices,
+one row per candidate, and every metric is computed for all of the rows
+together, with lookup tables over the codon indices rather than with
+strings: the codon adaptation index against a codon table, GC content and
+the GC content of sliding windows, motif matches (by running the
+`AvoidMotifSet` automaton a codon at a time, over all the rows at once) and,
+from a transformer model, the log-likelihood.
+
+Examples
+--------
+>>> model = IndependentModel(ec_codon_use)
+>>> codons = model.sample_codons("MENFHHRPFK", 1000, rng=0)
+>>> scores = score_candidates(codons, table=model.table, avoid=["GAATTC"])
+>>> ranked = Candidates(codons, scores)
+>>> ranked.best
+"""
+import numpy
+
+from espresso.lib import AvoidGCContent, AvoidMotifSet, GC_BASES
+from espresso.translation import CODON_BYTES, CODON_RESIDUES, RESIDUE_BYTE_TO_INDEX, join_codons
+
+
+# codon index -> number of G and C bases
+CODON_GC = GC_BASES[CODON_BYTES].sum(axis=1)
+
+# the number of bases to compute the GC windows of at a time, which bounds
+# the memory used for many long candidates
+GC_CHUNK_BASES = 1 << 22
+
+
+def relative_adaptiveness(table):
+    """Get the log of each codon's probability relative to the most likely
+    codon for its residue, and a mask of the codons that count towards the
+    codon adaptation index (those of residues with more than one codon)
+
+    `table` is a (20, 64) array of codon probabilities for each residue,
+    such as `IndependentModel.table`. Codons the table never uses have a log
+    weight of -inf.
+    """
+    residues = RESIDUE_BYTE_TO_INDEX[CODON_RESIDUES]
+    coding = residues >= 0
+    weights = numpy.zeros(len(CODON_RESIDUES))
+    best = numpy.where(table.max(axis=1) > 0, table.max(axis=1), 1.)
+    weights[coding] = table[residues[coding], numpy.flatnonzero(coding)] / best[residues[coding]]
+    counted = coding & ((table > 0).sum(axis=1) > 1)[numpy.where(coding, residues, 0)]
+    with numpy.errstate(divide="ignore"):
+        return numpy.log(weights), counted
+
+
+def codon_adaptation_index(codons, table):
+    """Get the codon adaptation index (CAI) of each row of an (N, L) array of
+    codon indices: the geometric mean of the relative adaptiveness of its
+    codons (see `relative_adaptiveness`), between 0 and 1"""
+    log_weights, counted = relative_adaptiveness(table)
+    counted = counted[codons]
+    total = numpy.where(counted, log_weights[codons], 0.).sum(axis=1)
+    return numpy.exp(total / numpy.maximum(counted.sum(axis=1), 1))
+
+
+def gc_windows(codons, gc_content=None):
+    """Get the lowest and highest GC content of the windows of each row of an
+    (N, L) array of codon indices, and how many of its windows are out of
+    bounds, with the window and bounds of an `AvoidGCContent`
+
+    As with `AvoidGCContent`, no window of a sequence shorter than the
+    window is out of bounds; its lowest and highest GC content are its own.
+    """
+    gc_content = gc_content or AvoidGCContent()
+    n, length = codons.shape
+    window = max(1, min(gc_content.window, 3 * length))
+    lowest, highest = numpy.zeros(n), numpy.zeros(n)
+    violations = numpy.zeros(n, dtype=numpy.int64)
+    step = max(1, GC_CHUNK_BASES // max(1, 3 * length))
+    for start in range(0, n, step):
+        rows = slice(start, start + step)
+        counts = numpy.zeros((len(codons[rows]), 3 * length + 1), dtype=numpy.int32)
+        numpy.cumsum(GC_BASES[CODON_BYTES[codons[rows]]].reshape(len(counts), -1), axis=1, out=counts[:, 1:])
+        gc = (counts[:, window:] - counts[:, :-window]) / window
+        lowest[rows], highest[rows] = gc.min(axis=1, initial=1.), gc.max(axis=1, initial=0.)
+        if 3 * length >= gc_content.window:
+            violations[rows] = ((gc < gc_content.low) | (gc > gc_content.high)).sum(axis=1)
+    return lowest, highest, violations
+
+
+def motif_matches(codons, avoid):
+    """Count the motif matches in each row of an (N, L) array of codon
+    indices, by the bases they end at, for an `AvoidMotifSet` (or motifs to
+    build one from)
+
+    The automaton reads a codon at a time, for all of the rows at once.
+    """
+    motifs = avoid if isinstance(avoid, AvoidMotifSet) else AvoidMotifSet(list(avoid))
+    transitions, matches = motifs.codon_transitions()
+    states = numpy.zeros(len(codons), dtype=numpy.int64)
+    counts = numpy.zeros(len(codons), dtype=numpy.int64)
+    for column in codons.T:
+        counts += matches[states, column]
+        states = transitions[states, column]
+    return counts
+
+
+def score_candidates(codons, table=None, avoid=None, gc_content=None, log_likelihood=None):
+    """Score each row of an (N, L) array of codon indices
+
+    Returns a dict of (N,) arrays: "gc" (the GC content), "gc_min" and
+    "gc_max" (of the windows of `gc_content`, an `AvoidGCContent`, by default
+    50 bases between 30% and 70%) and "gc_violations" (the windows out of
+    bounds), and with a (20, 64) codon `table`, "cai" (see
+    `codon_adaptation_index`), with motifs to `avoid`, "motif_violations"
+    (see `motif_matches`), and with a given (N,) `log_likelihood`,
+    "log_likelihood".
+    """
+    codons = numpy.asarray(codons)
+    scores = {}
+    if table is not None:
+        scores["cai"] = codon_adaptation_index(codons, table)
+    scores["gc"] = CODON_GC[codons].sum(axis=1) / max(1, 3 * codons.shape[1])
+    scores["gc_min"], scores["gc_max"], scores["gc_violations"] = gc_windows(codons, gc_content)
+    if avoid is not None:
+        scores["motif_violations"] = motif_matches(codons, avoid)
+    if log_likelihood is not None:
+        scores["log_likelihood"] = numpy.asarray(log_likelihood, dtype=float)
+    return scores
+
+
+def rank(scores, by=None):
+    """Order candidates from best to worst: fewest motif violations, then
+    fewest GC window violations, then highest score `by` (by default the
+    log-likelihood if there is one, else the CAI)"""
+    if by is None:
+        by = "log_likelihood" if "log_likelihood" in scores else "cai"
+    keys = [-scores[by]] if by in scores else []
+    keys += [scores[name] for name in ("gc_violations", "motif_violations") if name in scores]
+    return numpy.lexsort(keys)
+
+
+class Candidates:
+    """Candidate coding sequences and their scores, ranked best first
+
+    `codons` is an (N, L) array of codon indices and `scores` a dict of (N,)
+    arrays, such as from `score_candidates`; they're reordered by `rank`, by
+    the score `rank_by`. Indexing gives the nucleotide sequence of a
+    candidate, and `row` its scores.
+    """
+
+    def __init__(self, codons, scores, rank_by=None):
+        order = rank(scores, rank_by)
+        self.codons = numpy.asarray(codons)[order]
+        self.scores = {name: values[order] for name, values in scores.items()}
+
+    @property
+    def best(self):
+        """The nucleotide sequence of the best candidate"""
+        return self[0]
+
+    def row(self, index):
+        """Get the scores of a candidate, as a dict"""
+        return {name: values[index].item() for name, values in self.scores.items()}
+
+    def __len__(self):
+        return len(self.codons)
+
+    def __getitem__(self, index):
+        return join_codons(self.codons[index])
+
+    def __iter__(self):
+        return (join_codons(row) for row in self.codons)
+
+    def __repr__(self):
+        return f"Candidates({len(self)} of length {self.codons.shape[1]}, scores={sorted(self.scores)})"
@@ -0,0 +1,331 @@
+"""Serve a model over HTTP, designing concurrent requests in micro-batches
+
+The transformer models design a batch of proteins in about the time they
+design one, so the server holds each request for at most `max_wait_ms`
+to group it with the others that arrive meanwhile, up to `max_batch_size`
+proteins at a time. Batches run one after another on a dedicated inference
+thread, so the event loop keeps accepting requests while the model works,
+and those requests make up the next batch.
+
+Endpoints
+---------
+POST /design
+    A JSON object with the `protein` sequence and, optionally, sampling
+    `options` (see `sampling_options`), answered with `{"sequence": ...}` or,
+    if the design failed, `{"error": ...}`
+GET /metrics
+    The queue depth, a histogram of batch sizes and the p50/p99 latency
+    (see `ServerMetrics`)
+GET /health
+    `{"status": "ok"}` once the model is loaded
+
+Examples
+--------
+From the command line
+
+    espresso serve -m fungi-v1 --port 8000 --max-batch-size 32 --max-wait-ms 5
+
+From Python, inside a running event loop
+
+>>> server = DesignServer("fungi-v1", max_batch_size=32, max_wait_ms=5)
+>>> cds = await server.design("MENFHHRPFK")
+"""
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from espresso.main import get_model, model_registry
+
+
+class ServerMetrics:
+    """Counts the requests, batches and errors of a `DesignServer`, and keeps
+    the latency of the last `window` requests, for percentiles"""
+
+    def __init__(self, window=10_000):
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=window)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batch_sizes[size] += 1
+
+    def record_request(self, seconds, failed=False):
+        self.requests += 1
+        self.errors += failed
+        self.latencies.append(seconds)
+
+    def as_dict(self, queue_depth=0):
+        """The metrics as a JSON-ready dict, with latencies in milliseconds"""
+        latencies = numpy.array(self.latencies) * 1000
+        p50, p99 = numpy.percentile(latencies, [50, 99]).tolist() if len(latencies) else (None, None)
+        return {
+            "queue_depth": queue_depth,
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else None,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "latency_ms": {"p50": p50, "p99": p99},
+        }
+
+
+def _number(low, high, integer=False):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)):
+            return False
+        return low <= value <= high
+    return check
+
+
+# the options an HTTP client may send with a design, and their bounds
+SAMPLING_OPTIONS = {
+    "strategy": lambda value: value in ("sample", "greedy", "beam", "best"),
+    "temperature": lambda value: _number(0, 10)(value) and value > 0,
+    "top_k": _number(1, 64, integer=True),
+    "top_p": lambda value: _number(0, 1)(value) and value > 0,
+    "seed": _number(0, 2 ** 63 - 1, integer=True),
+}
+
+
+def sampling_options(options):
+    """Check the `options` of an HTTP request against `SAMPLING_OPTIONS`, and
+    turn them into keyword arguments for the model (a `seed` becomes `rng`)
+
+    Raises
+    ------
+    ValueError
+        If `options` isn't a JSON object, or has an option that isn't
+        allowed or is out of bounds
+    """
+    if not isinstance(options, dict):
+        raise ValueError('"options" must be a JSON object')
+    for name, value in options.items():
+        if name not in SAMPLING_OPTIONS:
+            raise ValueError(f'unknown option "{name}", expected one of {", ".join(SAMPLING_OPTIONS)}')
+        if not SAMPLING_OPTIONS[name](value):
+            raise ValueError(f'option "{name}" is out of bounds: {value!r}')
+    options = dict(options)
+    if "seed" in options:
+        options["rng"] = options.pop("seed")
+    return options
+
+
+class _Request:
+    __slots__ = ("protein", "options", "future", "start")
+
+    def __init__(self, protein, options, future):
+        self.protein = protein
+        self.options = options
+        self.future = future
+        self.start = time.perf_counter()
+
+
+def _group_key(options):
+    """Get a key that's the same for requests with the same options, falling 
+    back to their repr for options that aren't JSON, such as a generator"""
+    try:
+        return json.dumps(options, sort_keys=True)
+    except (TypeError, ValueError):
+        return repr(sorted(options.items()))
+
+
+class DesignServer:
+    """Designs coding sequences for concurrent requests, in micro-batches
+
+    The model is loaded once, from the model registry. A batch is started
+    as soon as `max_batch_size` requests are waiting, or `max_wait_ms`
+    after the first of them arrived. Requests with different `options` are
+    grouped into separate batches. `params` are passed on to the model
+    class, and `stats` (see `espresso.stats`), if given, collects the time
+    spent in the model.
+
+    A server belongs to the event loop it's first used in.
+    """
+
+    def __init__(self, model="fungi-v1", max_batch_size=32, max_wait_ms=5., stats=None, **params):
+        if model not in model_registry:
+            raise ValueError(f'Model "{model}" not found')
+        if max_batch_size < 1:
+            raise ValueError(f"Maximum batch size must be at least 1, not {max_batch_size}")
+        self.model = get_model(model, **params)
+        self.slug = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats
+        self.metrics = ServerMetrics()
+        self._queue = None
+        self._batcher = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="espresso-inference")
+
+    @property
+    def queue_depth(self):
+        """The number of requests waiting for a batch"""
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def metrics_dict(self):
+        return self.metrics.as_dict(self.queue_depth)
+
+    async def design(self, protein, **options):
+        """Design a coding sequence for `protein`, with the other waiting
+        requests, passing `options` on to the model
+
+        Raises whatever error designing the protein raised
+        """
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._run_batches())
+        request = _Request(protein, options, asyncio.get_running_loop().create_future())
+        await self._queue.put(request)
+        return await request.future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = batch[0].start + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0 and self._queue.empty():
+                break
+            try:
+                batch.append(self._queue.get_nowait() if timeout <= 0 else
+                             await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+
+            # requests with the same options can share a forward pass
+            groups = {}
+            for request in batch:
+                groups.setdefault(_group_key(request.options), []).append(request)
+
+            # a failure fails only the requests of its own group, and batching goes on 
+            for requests in groups.values():
+                try:
+                    self.metrics.record_batch(len(requests))
+                    results = await loop.run_in_executor(self._executor, self._design_batch, requests)
+                except Exception as error:
+                    results = [(None, error)] * len(requests)
+                now = time.perf_counter()
+                for request, (sequence, error) in zip(requests, results):
+                    self.metrics.record_request(now - request.start, failed=error is not None)
+                    if request.future.done():
+                        continue
+                    if error is None:
+                        request.future.set_result(sequence)
+                    else:
+                        request.future.set_exception(error)
+
+    def _design_batch(self, requests):
+        """Design a group of requests with the same options, on the inference
+        thread, returning a (sequence, error) pair for each"""
+        proteins = [request.protein for request in requests]
+        options = requests[0].options
+        if hasattr(self.model, "generate_sequences"):
+            try:
+                sequences = self.model.generate_sequences(proteins, batch_size=len(proteins), stats=self.stats, **options)
+                return [(sequence, None) for sequence in sequences]
+            except Exception:
+                pass  # fall back to one request at a time, to find the ones that failed
+
+        results = []
+        for protein in proteins:
+            try:
+                results.append((self.model.generate_sequence(protein, stats=self.stats, **options), None))
+            except Exception as error:
+                results.append((None, error))
+        return results
+
+    async def close(self):
+        """Stop batching, and shut down the inference thread"""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        self._executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        """Answer HTTP/1.1 requests on a connection, until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._respond(method, path, body)
+                content = json.dumps(payload).encode()
+                writer.write((f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                              f"Content-Length: {len(content)}\r\n\r\n").encode() + content)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return "200 OK", {"status": "ok", "model": self.slug}
+        if method == "GET" and path == "/metrics":
+            return "200 OK", self.metrics_dict()
+        if method == "POST" and path == "/design":
+            try:
+                request = json.loads(body)
+                protein, options = request["protein"], request.get("options", {})
+            except (ValueError, KeyError, TypeError):
+                return "400 Bad Request", {"error": 'expected a JSON object with a "protein"'}
+            try:
+                options = sampling_options(options)
+            except ValueError as error:
+                return "400 Bad Request", {"error": str(error)}
+            try:
+                return "200 OK", {"sequence": await self.design(protein, **options)}
+            except Exception as error:
+                return "422 Unprocessable Entity", {"error": f"{type(error).__name__}: {error}"}
+        return "404 Not Found", {"error": f"no endpoint {method} {path}"}
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        """Start serving HTTP, returning the `asyncio.Server`"""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+def serve(model="fungi-v1", host="127.0.0.1", port=8000, max_batch_size=32, max_wait_ms=5., **params):
+    """Serve a model over HTTP until interrupted"""
+
+    async def main():
+        server = DesignServer(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, **params)
+        http = await server.serve(host, port)
+        print(f"espresso: serving {model} on http://{host}:{port}", flush=True)
+        try:
+            async with http:
+                await http.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
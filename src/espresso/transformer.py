@@ -0,0 +1,353 @@
+import os
+
+import numpy
+import torch 
+
+from espresso.translation import CODONS, CODON_RESIDUES, as_bytes, join_codons, translate
+from espresso.model import Seq2SeqTransformer, create_mask, generate_square_subsequent_mask, UNK_IDX, PAD_IDX, BOS_IDX, EOS_IDX
+from espresso.stats import NULL_STATS
+
+
+# the source (protein) and target (codon) vocabularies, in the order the 
+# models were trained with: the special symbols, then the tokens sorted 
+SPECIAL_SYMBOLS = ["<unk>", "<pad>", "<bos>", "<eos>"]
+PROTEIN_TOKENS = SPECIAL_SYMBOLS + sorted("ACDEFGHIKLMNPQRSTVWY*")
+CODON_TOKENS = SPECIAL_SYMBOLS + sorted(CODONS)
+
+
+class TransformerModel:
+    """Uses a pre-trained transformer model to design coding sequences
+
+    `model_path` is the path of the model's weights (which are then 
+    memory-mapped), or an open binary file. With `optimized`, the model is 
+    quantized to int8 and compiled for 
+    inference on CPU (see `Seq2SeqTransformer.compile_for_inference`), which 
+    designs slightly different, but equally valid, sequences. `num_threads` 
+    sets the number of threads torch uses, for the whole process. 
+    """
+    def __init__(self, model_path, optimized=False, num_threads=None):
+        self.BOS_IDX = BOS_IDX
+        self.EOS_IDX = EOS_IDX
+
+        # lookup tables between sequences and tokens, so that tokenizing and 
+        # detokenizing are array operations: residue byte -> source token, 
+        # target token -> codon index (-1 for the special symbols) and the 
+        # byte of the residue it encodes (0 for the special symbols), and 
+        # codon index -> target token 
+        self.residue_tokens = numpy.full(256, UNK_IDX, dtype=numpy.int64)
+        self.residue_tokens[as_bytes("".join(PROTEIN_TOKENS[4:]))] = numpy.arange(4, len(PROTEIN_TOKENS))
+        self.token_codons = numpy.array([-1] * 4 + [CODONS.index(codon) for codon in CODON_TOKENS[4:]])
+        self.token_residues = numpy.zeros(len(CODON_TOKENS), dtype=numpy.uint8)
+        self.token_residues[4:] = CODON_RESIDUES[self.token_codons[4:]]
+        self.codon_tokens = numpy.zeros(len(CODONS), dtype=numpy.int64)
+        self.codon_tokens[self.token_codons[4:]] = numpy.arange(4, len(CODON_TOKENS))
+
+        # Create a new empty instance of the model 
+        # 
+        # In our training, detailed in `espresso/learn`, we chose 
+        # the following model params:
+        #
+        # encoder layers == decoder layers, 3
+        # model dim, 64 
+        self.model = Seq2SeqTransformer(3, 3, 64, 8, len(PROTEIN_TOKENS), len(CODON_TOKENS), 256) 
+
+        # load the specified trained model. From a file, the weights are 
+        # memory-mapped and used in place, rather than copied, so every 
+        # process that loads the same file shares one copy of them 
+        mmap = isinstance(model_path, (str, os.PathLike))
+        state_dict = torch.load(model_path, map_location=torch.device('cpu'), mmap=mmap, weights_only=True)
+        self.model.load_state_dict(state_dict, assign=mmap)
+
+        # set in eval mode 
+        self.model.eval() 
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        if optimized:
+            self.model.compile_for_inference()
+
+        # for constrained decoding, a mask of the target tokens that encode each 
+        # residue, by residue byte (-1 for bytes that aren't residues) 
+        residues = PROTEIN_TOKENS[4:]
+        self.residue_rows = numpy.full(256, -1, dtype=numpy.int64)
+        self.residue_rows[as_bytes("".join(residues))] = numpy.arange(len(residues))
+        self.residue_mask = torch.zeros(len(residues), len(CODON_TOKENS), dtype=torch.bool)
+        for token in range(4, len(CODON_TOKENS)):
+            self.residue_mask[self.residue_rows[self.token_residues[token]], token] = True
+
+        # the longest protein the positional encoding has room for, with <bos> 
+        # and <eos> (and one more decoding step); longer proteins are designed 
+        # in windows (see `generate_windowed`) 
+        self.max_length = self.model.positional_encoding.pos_embedding.shape[0] - 3
+
+    def generate_sequence(self, protein_sequence, verbose=False, constrained=True, strategy="sample", 
+                          return_log_likelihood=False, stats=None, rng=None, **options):
+        """Generate a CDS for provided protein sequence using a generative model
+
+        With `constrained` (the default), the model may only choose codons 
+        that encode the residue at each position, followed by <eos>, so a 
+        single pass always produces a valid CDS. Otherwise, codons are 
+        sampled freely and the sequence is resampled until it translates 
+        back to the provided protein sequence.
+
+        `strategy` is "sample" (the default), "greedy" or "beam"; "greedy" and 
+        "beam" are deterministic, and give the most likely designs. `options` 
+        are passed on to `Seq2SeqTransformer.sample`, for example 
+        `temperature`, `top_k`, `top_p` or `beam_width`, or to design a long 
+        protein in windows, `window` and `context` (see `generate_windowed`). 
+        With `return_log_likelihood`, returns a (sequence, log-likelihood) pair, 
+        for ranking designs against each other. `stats` collects timings and 
+        counters (see `generate_sequences`). Pass a seed or a 
+        `torch.Generator` as `rng` for reproducible sampling. 
+        
+        Raises
+        ------
+        RuntimeError
+            If `constrained` is false and, after 20 samples, none of the 
+            generated sequences translate to the provided protein sequence
+        """
+        sequence, log_likelihood = self.generate_sequences([protein_sequence], batch_size=1, constrained=constrained, 
+                                                           strategy=strategy, return_log_likelihood=True, stats=stats, 
+                                                           rng=rng, **options)[0]
+
+        if verbose:
+            print("espresso: input sequence length including <bos> and <eos>:", len(protein_sequence) + 2)
+            print("espresso: joined sequence", sequence) 
+            print("espresso: translation of joined sequence", translate(sequence)) 
+            print("espresso: log-likelihood", log_likelihood) 
+
+        return (sequence, log_likelihood) if return_log_likelihood else sequence 
+
+    def _pad(self, protein_sequences, value, rows):
+        """Lay the residue bytes of the proteins out in the columns of a 
+        (rows, N) array, filled with `value`, returning it and the lengths"""
+        proteins = [as_bytes(protein_sequence) for protein_sequence in protein_sequences]
+        lengths = numpy.array([len(protein) for protein in proteins], dtype=numpy.int64)
+        padded = numpy.full((len(proteins), max(rows, lengths.max(initial=0))), value, dtype=numpy.uint8)
+        padded[numpy.arange(padded.shape[1]) < lengths[:, None]] = numpy.concatenate(proteins or [numpy.zeros(0, numpy.uint8)])
+        return padded.T, lengths
+
+    def tokenize_proteins(self, protein_sequences):
+        """Convert proteins into a (S, N) tensor of source tokens, padded with <pad>"""
+        residues, lengths = self._pad(protein_sequences, 0, 0)
+        src = numpy.full((residues.shape[0] + 2, residues.shape[1]), PAD_IDX, dtype=numpy.int64)
+        inside = numpy.arange(residues.shape[0])[:, None] < lengths
+        src[1:-1][inside] = self.residue_tokens[residues[inside]]
+        src[0] = BOS_IDX
+        src[lengths + 1, numpy.arange(len(lengths))] = EOS_IDX
+        return torch.from_numpy(src)
+
+    def detokenize_codons(self, tgt_tokens):
+        """Convert a 1D tensor of target tokens into a nucleotide sequence, 
+        stopping at the first special token after <bos>"""
+        codons = self.token_codons[tgt_tokens[1:].cpu().numpy()]
+        special = numpy.flatnonzero(codons < 0)
+        return join_codons(codons[:special[0] if len(special) else len(codons)])
+
+    def check_designs(self, tgt_tokens, protein_sequences):
+        """Get the nucleotide sequences of a (T, N) tensor of target tokens 
+        that encode their protein, and None for the others, comparing the 
+        residues the tokens encode to the proteins' all at once"""
+        tokens = tgt_tokens[1:].cpu().numpy()
+        expected, lengths = self._pad(protein_sequences, 0, tokens.shape[0] + 1)
+
+        # each design must encode its protein, then end (with a special token, 
+        # or at the end of the tokens) 
+        encoded = numpy.zeros_like(expected)
+        encoded[:tokens.shape[0]] = self.token_residues[tokens]
+        compared = numpy.arange(expected.shape[0])[:, None] <= lengths
+        valid = ((encoded == expected) | ~compared).all(axis=0)
+
+        return [join_codons(self.token_codons[tokens[:length, column]]) if ok else None 
+                for column, (length, ok) in enumerate(zip(lengths.tolist(), valid.tolist()))]
+
+    def constrain_tokens(self, protein_sequences, num_steps):
+        """Build a (num_steps, N, V) mask of the target tokens allowed at each 
+        decoding step: the synonymous codons for each residue, then <eos>"""
+        residues, lengths = self._pad(protein_sequences, 0, num_steps)
+        rows = self.residue_rows[residues[:num_steps]]
+        inside = numpy.arange(num_steps)[:, None] < lengths
+        missing = numpy.argwhere(inside & (rows < 0))
+        if len(missing):
+            step, column = missing[0]
+            raise KeyError(protein_sequences[column][step])
+        allowed = self.residue_mask[torch.from_numpy(numpy.where(inside, rows, 0))]
+        allowed[torch.from_numpy(~inside)] = False
+        allowed[..., EOS_IDX] |= torch.from_numpy(~inside)
+        return allowed 
+
+    @torch.inference_mode()
+    def score_codons(self, protein_sequence, codons, batch_size=32, constrained=True):
+        """Get the log-likelihood of each row of an (N, L) array of codon 
+        indices, as coding sequences for the protein
+
+        The log-likelihoods are those `generate_sequences` returns for the 
+        sequences it designs (including <eos>, and with `constrained`, over 
+        the allowed tokens only), but rather than decoding one codon at a 
+        time, the protein is encoded once and each batch of `batch_size` 
+        rows is decoded in a single teacher-forced pass. 
+        """
+        codons = numpy.asarray(codons)
+        src = self.tokenize_proteins([protein_sequence])
+        src_mask, _, _, _ = create_mask(src, src[:1])
+        memory = self.model.encode(src, src_mask)
+        tgt_mask = generate_square_subsequent_mask(codons.shape[1] + 1)
+        allowed_tokens = self.constrain_tokens([protein_sequence], codons.shape[1] + 1) if constrained else None
+
+        log_likelihoods = numpy.zeros(len(codons))
+        for start in range(0, len(codons), batch_size):
+            batch = codons[start:start + batch_size]
+            tgt = numpy.empty((batch.shape[1] + 2, len(batch)), dtype=numpy.int64)
+            tgt[0], tgt[1:-1], tgt[-1] = BOS_IDX, self.codon_tokens[batch.T], EOS_IDX
+            tgt = torch.from_numpy(tgt)
+            logits = self.model.generator(self.model.decode(tgt[:-1], memory.expand(-1, len(batch), -1), tgt_mask))
+            if allowed_tokens is not None:
+                logits = logits.masked_fill(~allowed_tokens, float("-inf"))
+            log_probs = torch.log_softmax(logits, dim=-1).gather(2, tgt[1:, :, None])
+            log_likelihoods[start:start + len(batch)] = log_probs.sum(dim=(0, 2)).numpy()
+        return log_likelihoods 
+
+    def generate_windowed(self, protein_sequence, window=1000, context=200, strategy="sample", stats=None, rng=None, 
+                          **options):
+        """Generate a CDS for a long protein `window` residues at a time, with 
+        memory that doesn't grow with the length of the protein
+
+        Each window is decoded against its residues plus up to `context` 
+        residues on either side, and the decoder is first fed the codons 
+        already designed for the `context` residues before it (as the only 
+        tokens allowed at those steps), so that it carries on from the 
+        previous window. The codons designed for each window are then 
+        joined. No more than `window + 2 * context` positions are ever 
+        encoded or decoded at once, so peak memory is flat in the length of 
+        the protein, and time is linear. Decoding is always constrained (see 
+        `generate_sequence`). 
+
+        Returns a (sequence, log-likelihood) pair, where the log-likelihood 
+        is the sum over the windows of that of their own codons, and the 
+        final <eos>. See `generate_sequence` for the decoding `strategy`, 
+        `options` and `rng`, and `generate_sequences` for `stats`, which 
+        also counts the windows. 
+        """
+        if window < 1 or context < 0:
+            raise ValueError(f"Windows must have at least 1 residue and no negative context, not {window} and {context}")
+        if window + 2 * context > self.max_length:
+            raise ValueError(f"Windows of {window} residues with {context} residues of context on either side are "
+                             f"longer than the model's maximum of {self.max_length}")
+        stats = stats or NULL_STATS
+        if rng is not None and not isinstance(rng, torch.Generator):
+            rng = torch.Generator().manual_seed(rng)
+
+        length = len(protein_sequence)
+        codons = numpy.zeros(length, dtype=numpy.int64)
+        log_likelihood = 0.
+        for start in range(0, max(length, 1), window):
+            end = min(start + window, length)
+            first, last = max(0, start - context), min(length, end + context)
+            segment = protein_sequence[first:last]
+            stats.count("windows")
+            with stats.span("tokenize"):
+                src = self.tokenize_proteins([segment])
+                src_mask, _, src_padding_mask, _ = create_mask(src, src[:1])
+                # the codons already designed before the window are the only choices 
+                allowed_tokens = self.constrain_tokens([segment], src.shape[0])
+                allowed_tokens[:start - first] = False
+                allowed_tokens[numpy.arange(start - first), 0, self.codon_tokens[codons[first:start]]] = True
+
+            # decode to the end of the window, and after the last, to <eos> 
+            max_len = end - first + (2 if end == length else 1)
+            tgt_tokens, scores = self.model.sample(src, src_mask, max_len=max_len, start_symbol=self.BOS_IDX, 
+                                                   src_padding_mask=src_padding_mask, allowed_tokens=allowed_tokens, 
+                                                   strategy=strategy, return_log_likelihood=True, stats=stats, 
+                                                   generator=rng, **options)
+            codons[start:end] = self.token_codons[tgt_tokens[1 + start - first:1 + end - first, 0].numpy()]
+            log_likelihood += scores[0].item()
+        return join_codons(codons), log_likelihood 
+
+    def generate_sequences(self, protein_sequences, batch_size=32, max_iter=20, constrained=True, strategy="sample", 
+                           return_log_likelihood=False, stats=None, rng=None, window=None, context=200, **options):
+        """Generate a CDS for each of the provided protein sequences, 
+        sampling `batch_size` proteins at a time in a single forward pass
+
+        Proteins are sorted by length before batching so that each batch 
+        carries as little padding as possible. With `constrained`, every 
+        sequence is valid after one pass (see `generate_sequence`); otherwise 
+        sequences that don't translate back to their protein are resampled, 
+        for up to `max_iter` rounds (or once, with a deterministic 
+        `strategy`). Results are returned in the same order as the input, 
+        as (sequence, log-likelihood) pairs with `return_log_likelihood`. 
+        See `generate_sequence` for the decoding `strategy`, `options` and `rng`. 
+
+        Proteins longer than `window` residues are designed one at a time, in 
+        windows with `context` residues of context (see `generate_windowed`). 
+        By default, only proteins too long for the model are, in windows of 
+        1000 residues. 
+
+        If given, `stats` (see `espresso.stats`) collects the time spent 
+        tokenizing, encoding, decoding and checking the translations, and 
+        counts the rounds and retries, decoding steps, tokens and codons. 
+
+        Raises
+        ------
+        RuntimeError
+            If, after `max_iter` rounds, any of the generated sequences doesn't 
+            translate to the provided protein sequence
+        """
+        stats = stats or NULL_STATS
+        if rng is not None and not isinstance(rng, torch.Generator):
+            rng = torch.Generator().manual_seed(rng)
+        protein_sequences = list(protein_sequences)
+        results = [None] * len(protein_sequences)
+        log_likelihoods = [None] * len(protein_sequences)
+
+        # greedy and beam search would only find the same sequences again 
+        if strategy != "sample":
+            max_iter = 1
+
+        # proteins too long to design in one piece are designed in windows 
+        limit = self.max_length if window is None else window 
+        for i, protein_sequence in enumerate(protein_sequences):
+            if len(protein_sequence) > limit:
+                results[i], log_likelihoods[i] = self.generate_windowed(protein_sequence, window=window or 1000, 
+                                                                        context=context, strategy=strategy, 
+                                                                        stats=stats, rng=rng, **options)
+
+        # bucket by length, so that batches are made of similarly sized proteins 
+        pending = sorted((i for i, result in enumerate(results) if result is None), key=lambda i: len(protein_sequences[i]))
+
+        n_iter = 0
+        while pending and n_iter < max_iter:
+            n_iter += 1
+            stats.count("rounds")
+            stats.count("retries", len(pending) if n_iter > 1 else 0)
+            failed = []
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                with stats.span("tokenize"):
+                    src = self.tokenize_proteins(protein_sequences[i] for i in batch)
+                    src_mask, _, src_padding_mask, _ = create_mask(src, src[:1])
+                    allowed_tokens = None
+                    if constrained:
+                        allowed_tokens = self.constrain_tokens([protein_sequences[i] for i in batch], src.shape[0])
+                tgt_tokens, scores = self.model.sample(src, src_mask, max_len=src.shape[0] + 1, start_symbol=self.BOS_IDX, 
+                                                       src_padding_mask=src_padding_mask, allowed_tokens=allowed_tokens, 
+                                                       strategy=strategy, return_log_likelihood=True, stats=stats, 
+                                                       generator=rng, **options)
+                with stats.span("check"):
+                    designs = self.check_designs(tgt_tokens, [protein_sequences[i] for i in batch])
+                    for column, (i, sequence) in enumerate(zip(batch, designs)):
+                        if sequence is not None:
+                            results[i] = sequence 
+                            log_likelihoods[i] = scores[column].item()
+                        else:
+                            failed.append(i) 
+            pending = failed 
+
+        if stats.enabled:
+            stats.count("codons", sum(len(protein) for protein, result in zip(protein_sequences, results) if result is not None))
+        if pending:
+            raise RuntimeError(f"espresso: The model produced nucleotide sequences that don't translate back to {len(pending)} "
+                               f"of the original protein sequences after {max_iter} iterations")
+
+        if return_log_likelihood:
+            return list(zip(results, log_likelihoods))
+        return results
@@ -0,0 +1,97 @@
+"""Table-driven translation between codons and residues
+
+Codons are indexed in the order of `itertools.product("ATCG", repeat=3)`,
+that is, 16 * first + 4 * second + third, with A, T, C, G = 0, 1, 2, 3.
+Sequences are translated through precomputed lookup arrays over numpy byte
+views, so no sequence objects are created along the way.
+"""
+from itertools import product
+
+import numpy
+
+
+BASES = "ATCG"
+CODONS = list("".join(x) for x in product(BASES, repeat=3))
+CODON_TO_INDEX = dict(zip(CODONS, range(64)))
+INDEX_TO_CODON = {v: k for k, v in CODON_TO_INDEX.items()}
+RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+RESIDUE_TO_INDEX = dict(zip(RESIDUES, range(20)))
+INDEX_TO_RESIDUE = {v: k for k, v in RESIDUE_TO_INDEX.items()}
+STOP_CODONS = ["TAA", "TAG", "TGA"]
+
+# the standard genetic code, with `*` for stop codons
+_STANDARD_CODE = dict(zip(("".join(x) for x in product("TCAG", repeat=3)),
+                          "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"))
+CODON_TO_RESIDUE = {codon: _STANDARD_CODE[codon] for codon in CODONS}
+
+# codon index -> residue byte, and codon index -> the three bytes of the codon
+CODON_RESIDUES = numpy.frombuffer("".join(CODON_TO_RESIDUE.values()).encode(), dtype=numpy.uint8)
+CODON_BYTES = numpy.frombuffer("".join(CODONS).encode(), dtype=numpy.uint8).reshape(64, 3)
+
+# base byte -> base index (either case), 255 if not a base
+BASE_BYTE_TO_INDEX = numpy.full(256, 255, dtype=numpy.uint8)
+BASE_BYTE_TO_INDEX[numpy.frombuffer(BASES.encode(), dtype=numpy.uint8)] = numpy.arange(4)
+BASE_BYTE_TO_INDEX[numpy.frombuffer(BASES.lower().encode(), dtype=numpy.uint8)] = numpy.arange(4)
+
+# residue byte -> residue index, -1 if not one of the 20 residues
+RESIDUE_BYTE_TO_INDEX = numpy.full(256, -1, dtype=numpy.int16)
+RESIDUE_BYTE_TO_INDEX[numpy.frombuffer(RESIDUES.encode(), dtype=numpy.uint8)] = numpy.arange(20)
+
+# reverse translation: residue (including `*`) -> indices of its synonymous
+# codons, and the same for the 20 residues as a (20, 64) boolean mask
+SYNONYMOUS_CODONS = {}
+for _index, _codon in enumerate(CODONS):
+    SYNONYMOUS_CODONS.setdefault(CODON_TO_RESIDUE[_codon], []).append(_index)
+SYNONYMOUS_CODONS = {residue: tuple(indices) for residue, indices in SYNONYMOUS_CODONS.items()}
+SYNONYMOUS_CODON_MASK = numpy.zeros((20, 64), dtype=bool)
+for _residue, _index in RESIDUE_TO_INDEX.items():
+    SYNONYMOUS_CODON_MASK[_index, list(SYNONYMOUS_CODONS[_residue])] = True
+del _index, _codon, _residue
+
+
+def as_bytes(sequence):
+    """View a sequence (str, bytes or uint8 array) as a uint8 array"""
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    return numpy.frombuffer(sequence, dtype=numpy.uint8)
+
+
+def codon_indices(nucleotide_sequence):
+    """Map a nucleotide sequence to an array of codon indices
+
+    Raises
+    ------
+    ValueError
+        If the length isn't a multiple of 3, or the sequence contains
+        anything other than A, T, C and G (in either case)
+    """
+    bases = BASE_BYTE_TO_INDEX[as_bytes(nucleotide_sequence)]
+    if len(bases) % 3:
+        raise ValueError(f"Sequence length must be a multiple of 3, not {len(bases)}")
+    if (bases == 255).any():
+        raise ValueError(f"Sequence contains a character that isn't a base at position {int(numpy.argmax(bases == 255))}")
+    bases = bases.reshape(-1, 3)
+    return (bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]).astype(numpy.uint8)
+
+
+def join_codons(codon_indices):
+    """Join an array of codon indices into a nucleotide sequence"""
+    return CODON_BYTES[codon_indices].tobytes().decode()
+
+
+def residue_indices(protein_sequence):
+    """Map a protein sequence to an array of residue indices in one shot"""
+    indices = RESIDUE_BYTE_TO_INDEX[as_bytes(protein_sequence)]
+    if (indices < 0).any():
+        raise KeyError(protein_sequence[int(numpy.argmin(indices))])
+    return indices
+
+
+def translate_codons(codon_indices):
+    """Translate an array of codon indices into residues, with `*` for stop"""
+    return CODON_RESIDUES[codon_indices].tobytes().decode()
+
+
+def translate(nucleotide_sequence):
+    """Translate a nucleotide sequence into residues, with `*` for stop"""
+    return translate_codons(codon_indices(nucleotide_sequence))
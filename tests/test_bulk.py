@@ -0,0 +1,44 @@
+import gzip
+
+from espresso.bulk import design_many, scrub_many
+from espresso.cli import main
+from espresso.fasta import read_fasta, write_fasta
+from espresso.translation import translate
+
+
+proteins = [("p1", "MENFHHRPFKGGFGVGRVPTSLYY"), ("bad", "MXB"), ("p2", "MACDEFGHIKLMNPQRSTVWY"), ("p3", "MKN")]
+
+
+def test_design_many_preserves_order_and_reports_errors():
+    for processes in [1, 2]:
+        results = list(design_many(proteins, "ec", processes=processes, chunk_size=1, max_pending=2))
+        assert [name for name, _, _ in results] == ["p1", "bad", "p2", "p3"]
+        for (_, protein), (_, sequence, error) in zip(proteins, results):
+            if protein == "MXB":
+                assert sequence is None and error.startswith("KeyError")
+            else:
+                assert error is None and translate(sequence) == protein
+
+
+def test_scrub_many():
+    results = list(scrub_many([("kn", "AAAAAT"), ("short", "AAAA")], ["AAAAA", "GAAC"], "sc", processes=1))
+    assert results[0] == ("kn", "AAGAAT", None)
+    assert results[1][1] is None and results[1][2].startswith("ValueError")
+
+
+def test_fasta_round_trip(tmp_path):
+    path = tmp_path / "proteins.fa.gz"
+    with gzip.open(path, "wt") as handle:
+        write_fasta(proteins, handle, width=10)
+    assert list(read_fasta(path)) == proteins
+
+
+def test_design_command(tmp_path, capsys):
+    source, target = tmp_path / "proteins.fa", tmp_path / "genes.fa"
+    with open(source, "w") as handle:
+        write_fasta(proteins, handle)
+    assert main(["design", str(source), "-o", str(target), "-m", "coli-top", "-p", "1"]) == 1
+    assert "bad: KeyError" in capsys.readouterr().err
+    records = list(read_fasta(target))
+    assert [name for name, _ in records] == ["p1", "p2", "p3"]
+    assert translate(records[2][1]) == "MKN"
@@ -0,0 +1,64 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import espresso
+from espresso import main
+from espresso.cache import ResultCache, make_key
+from espresso.lib import AvoidMotifSet
+from espresso.stats import Stats
+
+
+def test_lru_is_bounded():
+    cache = ResultCache(max_entries=2, max_bytes=8)
+    cache.put("a", "ATG")
+    cache.put("b", "AAA")
+    assert cache.get("a") == "ATG"
+    cache.put("c", "GGG")
+    assert cache.get("b") is None and cache.get("a") == "ATG" and len(cache) == 2
+    cache.put("d", "ATGATG")
+    assert len(cache) == 1 and cache.get("d") == "ATGATG"
+    assert make_key("design", "ec", [1, 2]) != make_key("design", "ec", [2, 1])
+
+
+def _fill(path, worker):
+    cache = ResultCache(path=path)
+    for i in range(50):
+        cache.put(f"{worker}-{i}", "ATG" * i)
+    return worker
+
+
+def test_disk_tier_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with ProcessPoolExecutor(4) as pool:
+        assert sorted(pool.map(_fill, [path] * 4, range(4))) == [0, 1, 2, 3]
+
+    cache = ResultCache(path=path)
+    assert len(cache) == 0
+    assert cache.get("3-10") == "ATG" * 10 and len(cache) == 1
+    cache.clear()
+    assert ResultCache(path=path).get("3-10") is None
+
+
+def test_designs_and_scrubs_are_cached(monkeypatch):
+    monkeypatch.setattr(main, "result_cache", ResultCache())
+    protein = "MENFHHRPFKGGFGVGRVPTSLYYSLSDF"
+
+    stats = Stats()
+    designs = [espresso.design_coding_sequence(protein, "coli-top", stats=stats) for _ in range(3)]
+    assert len(set(designs)) == 1 and stats.counters["cache_hits"] == 2
+
+    # only reproducible designs are cached 
+    espresso.design_coding_sequence(protein, "ec")
+    assert len(main.result_cache) == 1
+    assert espresso.design_coding_sequence(protein, "ec", seed=7) == espresso.design_coding_sequence(protein, "ec", seed=7)
+    assert len(main.result_cache) == 2
+
+    # sampled designs without a seed are new samples every time 
+    assert len({espresso.design_coding_sequence(protein, "ec", avoid=["GAATTC"], strategy="sample") for _ in range(5)}) > 1
+    assert len({espresso.design_coding_sequence(protein, "fungi-v1") for _ in range(3)}) > 1
+    assert len(main.result_cache) == 2
+
+    avoid = ["GAATTC", AvoidMotifSet(["GGATCC"], reverse_complement=True)]
+    sequence = designs[0] + "GAATTCGGATCC"
+    stats = Stats()
+    scrubbed = [espresso.scrub_sequence(sequence, avoid, "ec", seed=1, stats=stats) for _ in range(2)]
+    assert scrubbed[0] == scrubbed[1] and stats.counters["cache_hits"] == 1
@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+from itertools import product
+
+import numpy
+import pytest
+
+import espresso
+from espresso.constrained import ConstrainedDesigner
+from espresso.data import ec_codon_use
+from espresso.main import make_designer
+from espresso.lib import IndependentModel, TopCodonModel, AvoidMotifSet, translate
+from espresso.translation import CODON_TO_INDEX, RESIDUE_TO_INDEX, SYNONYMOUS_CODONS, CODONS
+
+
+model = IndependentModel(ec_codon_use)
+
+
+def motif_free_designs(protein, motifs):
+    """Every motif-free CDS for the protein, with its probability under the model"""
+    options = [[CODONS[idx] for idx in SYNONYMOUS_CODONS[residue] if model.table[RESIDUE_TO_INDEX[residue], idx] > 0]
+               for residue in protein]
+    designs = {}
+    for codons in product(*options):
+        sequence = "".join(codons)
+        if not len(motifs(sequence)):
+            designs[sequence] = numpy.prod([model.table[RESIDUE_TO_INDEX[residue], CODON_TO_INDEX[codon]]
+                                            for residue, codon in zip(protein, codons)])
+    return designs
+
+
+def test_best_design_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(50):
+        motifs = AvoidMotifSet(["".join(rng.choice("ACGT") for _ in range(rng.randint(3, 5))) for _ in range(rng.randint(1, 8))])
+        protein = "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(4))
+        designs = motif_free_designs(protein, motifs)
+        designer = ConstrainedDesigner(model, motifs)
+        if not designs:
+            with pytest.raises(ValueError):
+                designer.generate_sequence(protein)
+            continue
+        best = designer.generate_sequence(protein)
+        assert designs[best] == pytest.approx(max(designs.values()))
+
+
+def test_samples_follow_the_constrained_distribution():
+    motifs = AvoidMotifSet(["AAAAA", "GAAC"])
+    designs = motif_free_designs("KNK", motifs)
+    total = sum(designs.values())
+    designer = ConstrainedDesigner(model, motifs)
+    samples = Counter(designer.generate_sequence("KNK", strategy="sample", rng=seed) for seed in range(2000))
+    assert set(samples) <= set(designs)
+    for sequence, p in designs.items():
+        assert samples[sequence] / 2000 == pytest.approx(p / total, abs=0.03)
+
+
+def test_long_gene_with_many_motifs():
+    rng = random.Random(1)
+    protein = "M" + "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(3000))
+    # the motifs can't overlap the only codons of M and W
+    motifs = []
+    while len(motifs) < 200:
+        motif = "".join(rng.choice("ACGT") for _ in range(8))
+        if not any(codon in motif for codon in ["ATG", "CAT", "TGG", "CCA"]):
+            motifs.append(motif)
+    designer = ConstrainedDesigner(model, motifs, reverse_complement=True)
+    for strategy in ["best", "sample"]:
+        sequence = designer.generate_sequence(protein, strategy=strategy, rng=0)
+        assert translate(sequence) == protein
+        assert not len(designer.motifs(sequence))
+
+
+def test_top_codon_model_without_conflicts_is_unchanged():
+    top = TopCodonModel(ec_codon_use)
+    designer = ConstrainedDesigner(top, ["GGGGGGGG"])
+    assert designer.generate_sequence("MENFHHRPFK") == top.generate_sequence("MENFHHRPFK")
+
+
+def test_design_coding_sequence_with_avoid():
+    protein = "MENFHHRPFKEFGS" * 5
+    sequence = espresso.design_coding_sequence(protein, "ec", avoid=["GAATTC", "GGATCC"])
+    assert translate(sequence) == protein
+    assert "GAATTC" not in sequence and "GGATCC" not in sequence
+    assert espresso.design_coding_sequence(protein, "ec", avoid=["GAATTC", "GGATCC"]) == sequence
+    with pytest.raises(ValueError):
+        espresso.design_coding_sequence("MW", "ec", avoid=["ATGTGG"])
+
+
+def test_designers_are_shared():
+    designer = make_designer(["GAATTC", "GGATCC"], "ec")
+    assert make_designer(["GAATTC", "GGATCC"], "ec") is designer
+    assert make_designer(["GAATTC"], "ec") is not designer
+    motifs = AvoidMotifSet(["GAATTC"])
+    assert make_designer(motifs, "ec").motifs is motifs
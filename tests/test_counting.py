@@ -0,0 +1,48 @@
+import json
+
+import numpy
+
+from espresso.counting import count_codons, count_codons_in_file, codon_use_table
+from espresso.cli import main
+from espresso.fasta import write_fasta
+from espresso.lib import IndependentModel
+from espresso.translation import CODON_TO_INDEX
+
+
+records = [("a", "ATGAAAAAGTAA"), ("b", "ATGNNNAAA"), ("partial", "ATGA"), ("c", "atgaaa")]
+
+
+def write(path, records):
+    with open(path, "w") as handle:
+        write_fasta(records, handle)
+    return path
+
+
+def test_count_codons_in_file(tmp_path):
+    counts = count_codons_in_file(write(tmp_path / "cds.fa", records), chunk_bases=6)
+    assert counts.sum() == 8
+    assert codon_use_table(counts) == {"ATG": 3, "AAA": 3, "AAG": 1, "TAA": 1}
+
+
+def test_count_codons_merges_files(tmp_path):
+    paths = [write(tmp_path / f"{i}.fa", records) for i in range(3)]
+    counts = count_codons(paths, processes=2)
+    assert numpy.array_equal(counts, 3 * count_codons_in_file(paths[0]))
+    assert counts[CODON_TO_INDEX["ATG"]] == 9
+
+
+def test_count_codons_splits_a_single_file(tmp_path):
+    path = write(tmp_path / "cds.fa", [(f"{i}-{name}", sequence) for i in range(50) for name, sequence in records])
+    expected = count_codons([path], processes=1)
+    assert numpy.array_equal(expected, 50 * count_codons_in_file(write(tmp_path / "one.fa", records)))
+    assert numpy.array_equal(count_codons([path], processes=3, chunk_bases=30), expected)
+
+
+def test_count_command_output_trains_a_model(tmp_path):
+    target = tmp_path / "codons.json"
+    assert main(["count", str(write(tmp_path / "cds.fa", records)), "-o", str(target)]) == 0
+    with open(target) as handle:
+        table = json.load(handle)
+    assert table["ATG"] == 3
+    model = IndependentModel(table)
+    assert model.generate_sequence("MKM")[:3] == "ATG"
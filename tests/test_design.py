@@ -1,6 +1,12 @@
+import pytest
+import numpy
+import torch
+
 import espresso 
 from espresso.data import ec_codon_use, fungi_v1
-from espresso.lib import TopCodonModel, IndependentModel, TransformerModel
+from espresso.lib import TopCodonModel, IndependentModel, translate
+from espresso.model import create_mask
+from espresso.transformer import TransformerModel, CODON_TOKENS
 
 
 protein_1 = "MENFHHRPFKGGFGVGRVPTSLYYSLSDFSLSAISIFPTHYDQPYLNEAPSWYKYSLES"
@@ -37,4 +43,126 @@ def test_different_built_in_independent_tables():
 def test_transformer_encoder():
     model = TransformerModel(fungi_v1)
     seq = model.generate_sequence(protein_1)
-    assert seq[:3] == "ATG"
\ No newline at end of file
+    assert seq[:3] == "ATG"
+
+def test_transformer_tokens_round_trip():
+    model = TransformerModel(fungi_v1)
+    src = model.tokenize_proteins(["MKN", "MW"])
+    assert src.tolist() == [[2, 2], [15, 15], [13, 23], [16, 3], [3, 1]]
+
+    cds = ["ATGAAAAAC", "ATGTGG"]
+    tokens = torch.tensor([[2] + [CODON_TOKENS.index(seq[i:i + 3]) for i in range(0, len(seq), 3)] + [3] * (4 - len(seq) // 3) 
+                           for seq in cds]).T
+    assert [model.detokenize_codons(tokens[:, column]) for column in range(2)] == cds
+    assert model.check_designs(tokens, ["MKN", "MW"]) == cds
+    assert model.check_designs(tokens, ["MKK", "MWW"]) == [None, None]
+
+
+def test_transformer_batched_generation():
+    model = TransformerModel(fungi_v1)
+    proteins = [protein_2, protein_1, protein_2[:10]]
+    seqs = model.generate_sequences(proteins, batch_size=2)
+    for protein, seq in zip(proteins, seqs):
+        assert len(seq) == 3 * len(protein)
+        assert seq[:3] == "ATG"
+
+
+def test_transformer_cached_decoding_matches_full_decoding():
+    model = TransformerModel(fungi_v1)
+    src = model.tokenize_proteins([protein_1])
+    src_mask = torch.zeros(src.shape[0], src.shape[0]).type(torch.bool)
+    tokens = []
+    for use_cache in [False, True]:
+        torch.manual_seed(0)
+        tokens.append(model.model.sample(src, src_mask, max_len=src.shape[0] + 1, start_symbol=model.BOS_IDX, use_cache=use_cache))
+    assert torch.equal(tokens[0], tokens[1])
+
+
+def test_transformer_constrained_generation_is_always_valid():
+    model = TransformerModel(fungi_v1)
+    # this fragment almost never back-translates when sampled unconstrained
+    protein = protein_1[:20]
+    for seq in model.generate_sequences([protein] * 8, batch_size=4):
+        assert translate(seq) == protein
+
+
+def test_transformer_decoding_strategies():
+    model = TransformerModel(fungi_v1)
+    protein = protein_1[:30]
+    greedy, greedy_ll = model.generate_sequence(protein, strategy="greedy", return_log_likelihood=True)
+    assert translate(greedy) == protein and greedy_ll < 0
+
+    # a beam of width 1, and sampling from the top token only, are both greedy 
+    assert model.generate_sequence(protein, strategy="beam", beam_width=1, return_log_likelihood=True) == (greedy, greedy_ll)
+    assert model.generate_sequence(protein, top_k=1) == greedy
+
+    designs = model.generate_sequences([protein, protein[:10]] * 2, strategy="beam", beam_width=4, batch_size=3, 
+                                       return_log_likelihood=True)
+    assert designs[0][0] == designs[2][0] and designs[0][1] == pytest.approx(designs[2][1], abs=1e-4)
+    for (seq, ll), expected in zip(designs, [protein, protein[:10]]):
+        assert translate(seq) == expected and ll < 0
+    for seq, ll in model.generate_sequences([protein] * 4, top_p=0.9, return_log_likelihood=True):
+        assert translate(seq) == protein and ll < 0
+
+
+def test_transformer_loads_weights_from_path_or_file():
+    model = TransformerModel(fungi_v1)
+    with open(fungi_v1, "rb") as handle:
+        from_file = TransformerModel(handle)
+
+    for name, weights in from_file.model.state_dict().items():
+        assert torch.equal(model.model.state_dict()[name], weights)
+    assert model.generate_sequence(protein_1, strategy="greedy") == from_file.generate_sequence(protein_1, strategy="greedy")
+
+
+def test_transformer_windowed_generation():
+    model = espresso.get_model("fungi-v1")
+    protein = protein_1 * 4
+
+    # a single window without context is the same as designing in one piece 
+    for strategy in ["greedy", "sample"]:
+        assert (model.generate_windowed(protein, window=len(protein), context=0, strategy=strategy, rng=0) == 
+                model.generate_sequence(protein, strategy=strategy, rng=0, return_log_likelihood=True))
+
+    for strategy in ["greedy", "sample", "beam"]:
+        sequence, log_likelihood = model.generate_windowed(protein, window=25, context=10, strategy=strategy, rng=0)
+        assert translate(sequence) == protein and log_likelihood < 0
+
+    stats = espresso.Stats()
+    designs = model.generate_sequences([protein, protein_1], window=100, stats=stats)
+    assert [translate(design) for design in designs] == [protein, protein_1]
+    assert stats.counters["windows"] == 3
+    with pytest.raises(ValueError):
+        model.generate_windowed(protein, window=model.max_length)
+
+
+def test_optimized_transformer_matches_fp32_distributions():
+    model = TransformerModel(fungi_v1)
+    optimized = TransformerModel(fungi_v1, optimized=True)
+
+    src = model.tokenize_proteins([protein_1])
+    src_mask, _, src_padding_mask, _ = create_mask(src, src[:1])
+    allowed = model.constrain_tokens([protein_1], src.shape[0])
+    tgt = model.model.sample(src, src_mask, src.shape[0] + 1, model.BOS_IDX, src_padding_mask=src_padding_mask, 
+                             allowed_tokens=allowed, strategy="greedy")
+
+    # total variation distance between the next-codon distributions at each position 
+    expected, actual = (m.model.score(src, src_mask, tgt, src_padding_mask, allowed).exp() for m in [model, optimized])
+    distance = 0.5 * (expected - actual).abs().sum(dim=-1)
+    assert distance.mean() < 0.05
+    assert (expected.argmax(dim=-1) == actual.argmax(dim=-1)).float().mean() > 0.95
+    assert translate(optimized.generate_sequence(protein_1)) == protein_1
+
+
+def test_independent_model_is_reproducible_with_seed():
+    model = IndependentModel(ec_codon_use)
+    seq = model.generate_sequence(protein_1, rng=42)
+    assert translate(seq) == protein_1
+    assert seq == model.generate_sequence(protein_1, rng=numpy.random.default_rng(42))
+
+
+def test_top_codon_model_uses_most_frequent_codon():
+    model = TopCodonModel(ec_codon_use)
+    seq = model.generate_sequence(protein_2)
+    assert translate(seq) == protein_2
+    assert seq[-6:] == model.generate_sequence("WY")
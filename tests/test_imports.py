@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+
+def run_isolated(code):
+    """Run `code` in a fresh interpreter and return its last line of output"""
+    result = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_import_does_not_load_torch_or_data():
+    code = (
+        "import sys, espresso, espresso.data; "
+        "print('torch' in sys.modules, 'espresso.main' in sys.modules, sorted(vars(espresso.data)).count('sc_codon_use'))"
+    )
+    assert run_isolated(code) == "False False 0"
+
+
+def test_independent_models_do_not_load_torch():
+    code = (
+        "import sys, espresso; "
+        "espresso.design_coding_sequence('MENFHH', 'ec'); "
+        "espresso.scrub_sequence('AAAAAT', ['AAAAA'], 'sc'); "
+        "print('torch' in sys.modules)"
+    )
+    assert run_isolated(code) == "False"
+
+
+def test_transformer_model_is_still_importable_from_lib():
+    from espresso.lib import TransformerModel
+    from espresso.transformer import TransformerModel as Model
+    assert TransformerModel is Model
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import espresso 
+from espresso.data import ec_codon_use
+from espresso.lib import IndependentModel, TopCodonModel
+from espresso.registry import ModelRegistry
+
+
+def test_registry_caches_models():
+    registry = ModelRegistry({"ec": (IndependentModel, ec_codon_use)})
+    assert registry.cached() == []
+    model = registry.get("ec")
+    assert registry.get("ec") is model
+    assert registry.get("ec", threshold=0.1) is not model
+    assert len(registry.cached()) == 2
+
+
+def test_registry_evicts_models():
+    registry = ModelRegistry({"ec": (IndependentModel, ec_codon_use), "coli-top": (TopCodonModel, ec_codon_use)})
+    registry.warm_up()
+    registry.get("ec", threshold=0.1)
+    registry.evict("ec", threshold=0.1)
+    assert sorted(registry.cached()) == [("coli-top", ()), ("ec", ())]
+    registry.evict("ec")
+    assert registry.cached() == [("coli-top", ())]
+    registry.evict()
+    assert registry.cached() == []
+
+
+def test_registry_shares_one_model_across_threads():
+    registry = ModelRegistry({"ec": (IndependentModel, ec_codon_use)})
+    with ThreadPoolExecutor(8) as pool:
+        models = list(pool.map(lambda _: registry.get("ec"), range(32)))
+    assert all(model is models[0] for model in models)
+
+
+def test_unknown_model_raises():
+    with pytest.raises(ValueError):
+        espresso.get_model("not-a-model")
+    with pytest.raises(ValueError):
+        espresso.design_coding_sequence("MMM", "not-a-model")
+
+
+def test_design_uses_shared_model():
+    espresso.design_coding_sequence("MMM", "coli-top")
+    assert espresso.get_model("coli-top") is espresso.get_model("coli-top")
+    assert ("coli-top", ()) in espresso.model_registry.cached()
+
+
+def test_registry_digests_data_on_first_use(monkeypatch):
+    calls = []
+    monkeypatch.setattr("espresso.registry.data_digest", lambda data: calls.append(data) or "digest")
+    registry = ModelRegistry({"ec": (IndependentModel, ec_codon_use)})
+    registry.get("ec")
+    assert calls == []
+    assert registry.digest("ec") == registry.digest("ec") == "digest"
+    assert len(calls) == 1
+    registry.evict("ec")
+    assert registry.digest("ec") == "digest" and len(calls) == 2
@@ -0,0 +1,85 @@
+import math
+
+import numpy
+import pytest
+
+import espresso
+from espresso.data import ec_codon_use
+from espresso.lib import IndependentModel, AvoidGCContent, AvoidMotifSet, translate
+from espresso.scoring import Candidates, codon_adaptation_index, gc_windows, motif_matches, score_candidates
+from espresso.translation import CODON_TO_INDEX, CODON_TO_RESIDUE, RESIDUE_TO_INDEX, SYNONYMOUS_CODONS, join_codons
+
+
+model = IndependentModel(ec_codon_use)
+protein = "MENFHHRPFKGGFGVGRVPTSLYYSLSDFSLSAISIFPTHYDQPYLNEAPSWYKYSLESGLVCLYLYLIYRWITRSF"
+
+
+def test_scores_match_the_sequence_constraints():
+    codons = model.sample_codons(protein, 200, rng=0)
+    motifs = AvoidMotifSet(["GAA", "CTG", "GCNGC"], reverse_complement=True)
+    gc = AvoidGCContent(low=0.4, high=0.6, window=30)
+    lowest, highest, violations = gc_windows(codons, gc)
+    matches = motif_matches(codons, motifs)
+    for row, sequence in enumerate(join_codons(row) for row in codons):
+        windows = gc.gc_content(sequence)
+        assert (lowest[row], highest[row]) == pytest.approx((windows.min(), windows.max()))
+        assert violations[row] == ((windows < 0.4) | (windows > 0.6)).sum()
+        assert matches[row] == numpy.count_nonzero(motifs.longest[motifs.scan(sequence)])
+
+
+def test_codon_adaptation_index():
+    def cai(sequence):
+        weights = []
+        for idx in range(0, len(sequence), 3):
+            codon = sequence[idx:idx + 3]
+            residue = RESIDUE_TO_INDEX[CODON_TO_RESIDUE[codon]]
+            if len(SYNONYMOUS_CODONS[CODON_TO_RESIDUE[codon]]) > 1:
+                weights.append(model.table[residue, CODON_TO_INDEX[codon]] / model.table[residue].max())
+        return math.exp(sum(map(math.log, weights)) / len(weights))
+
+    codons = model.sample_codons(protein, 20, rng=1)
+    assert codon_adaptation_index(codons, model.table) == pytest.approx([cai(join_codons(row)) for row in codons])
+    top = espresso.get_model("coli-top").sample_codons(protein, 1)
+    assert codon_adaptation_index(top, model.table) == pytest.approx([1.])
+
+
+def test_candidates_are_ranked():
+    codons = model.sample_codons(protein, 500, rng=2)
+    scores = score_candidates(codons, table=model.table, avoid=["GAATTC", "GCGC"])
+    candidates = Candidates(codons, scores)
+
+    def ranked(candidates, by):
+        keys = list(zip(candidates.scores["motif_violations"], candidates.scores["gc_violations"], -candidates.scores[by]))
+        return keys == sorted(keys)
+
+    assert ranked(candidates, "cai")
+    assert candidates.best == candidates[0] == join_codons(candidates.codons[0])
+    assert candidates.row(0)["cai"] == candidates.scores["cai"][0]
+    assert ranked(Candidates(codons, scores, rank_by="gc"), "gc")
+
+
+def test_design_candidates():
+    candidates = espresso.design_candidates(protein, "ec", n=2000, seed=0, avoid=["GAATTC"])
+    assert 0 < len(candidates) <= 2000
+    assert len(set(candidates)) == len(candidates)
+    assert all(translate(sequence) == protein for sequence in candidates)
+    assert candidates.scores["motif_violations"][0] == 0
+    assert espresso.design_candidates(protein, "ec", n=2000, seed=0, avoid=["GAATTC"]).best == candidates.best
+    assert len(espresso.design_candidates(protein, "coli-top", n=10)) == 1
+    with pytest.raises(ValueError):
+        espresso.design_candidates(protein, "ec", reference="fungi-v1")
+
+
+def test_transformer_log_likelihoods():
+    transformer = espresso.get_model("fungi-v1")
+    designs = transformer.generate_sequences([protein[:30]] * 4, return_log_likelihood=True, rng=0)
+    codons = numpy.array([[CODON_TO_INDEX[s[i:i + 3]] for i in range(0, len(s), 3)] for s, _ in designs])
+    assert transformer.score_codons(protein[:30], codons) == pytest.approx([value for _, value in designs], abs=1e-3)
+
+    candidates = espresso.design_candidates(protein[:30], "fungi-v1", n=8, seed=0, reference="sc")
+    assert set(candidates.scores) >= {"log_likelihood", "cai"}
+    keys = list(zip(candidates.scores["gc_violations"], -candidates.scores["log_likelihood"]))
+    assert keys == sorted(keys)
+    scored = espresso.design_candidates(protein[:30], "ec", n=8, seed=0, scorer="fungi-v1")
+    assert scored.scores["log_likelihood"][0] == pytest.approx(
+        transformer.score_codons(protein[:30], scored.codons[:1])[0])
@@ -1,4 +1,9 @@
-from espresso.lib import Scrubber, AvoidMotif, IndependentModel
+import random
+
+import pytest
+
+from espresso.lib import (Scrubber, ScrubError, AvoidMotif, AvoidMotifSet, AvoidGCContent, AvoidHomopolymers, 
+                          AvoidRepeats, IndependentModel)
 from espresso.data import sc_codon_use 
 
 
@@ -10,6 +15,16 @@ def test_avoid_motif():
     assert positions == [3, 4, 5, 6, 7] 
 
 
+def test_avoid_motif_flags_the_bases_of_each_match():
+    # the pattern text is longer than its matches 
+    motif = AvoidMotif("A[AG]AAA")
+    assert motif("AAAAAGAAAAAT") == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert motif("CCCAGAAA") == [3, 4, 5, 6, 7]
+    scrubber = Scrubber([motif], IndependentModel(sc_codon_use))
+    scrubbed = scrubber.scrub("AAAAAGAAAAAT", rng=0)
+    assert not motif(scrubbed)
+
+
 def avoid_two_motifs():
     motif_1 = AvoidMotif("AAAAA")
     motif_2 = AvoidMotif("GAAC")
@@ -37,3 +52,145 @@ def test_scrubber_object():
     scrubber = Scrubber(avoid=avoid, model=model)
     result = scrubber.scrub("AAAAAT")  # dipeptide KN
     assert result == "AAGAAT"
+
+
+def test_incremental_update_matches_full_check():
+    rng = random.Random(0)
+    avoid = [AvoidMotif("AAAAA"), AvoidMotif("GAATTC"), AvoidMotif("GG")]
+    scrubber = Scrubber(avoid=avoid, model=IndependentModel(sc_codon_use))
+    codons = ["".join(rng.choice("ACGT") for _ in range(3)) for _ in range(200)]
+    flagged_bases = scrubber.flag_bases("".join(codons))
+    for _ in range(20):
+        changed = sorted(rng.sample(range(len(codons)), 5))
+        for idx in changed:
+            codons[idx] = rng.choice(["AAA", "GAA", "TTC", "GGG", "ATG"])
+        sequence = "".join(codons)
+        scrubber.update_flagged_bases(sequence, flagged_bases, changed)
+        assert flagged_bases == scrubber.flag_bases(sequence)
+
+
+def test_incremental_update_matches_full_check_for_regex_motifs():
+    # the widths of the matches differ from the lengths of the patterns 
+    avoid = [AvoidMotif("G.{6}C"), AvoidMotif("[AG][AG][AG][AG][AG]"), AvoidMotif("(TA|TCTCTCA)"), AvoidMotif("CA+C")]
+    assert [motif.context for motif in avoid] == [7, 4, 6, None]
+    rng = random.Random(1)
+    scrubber = Scrubber(avoid=avoid, model=IndependentModel(sc_codon_use))
+    codons = ["".join(rng.choice("ACGT") for _ in range(3)) for _ in range(200)]
+    flagged_bases = scrubber.flag_bases("".join(codons))
+    for _ in range(20):
+        changed = sorted(rng.sample(range(len(codons)), 5))
+        for idx in changed:
+            codons[idx] = rng.choice(["AAA", "GAA", "TTC", "GGG", "ATG", "CAC", "TCT"])
+        sequence = "".join(codons)
+        scrubber.update_flagged_bases(sequence, flagged_bases, changed)
+        assert flagged_bases == scrubber.flag_bases(sequence)
+
+
+def test_scrub_long_sequence():
+    model = IndependentModel(sc_codon_use)
+    sequence = model.generate_sequence("MKKKNNGSEF" * 300, rng=0)
+    scrubber = Scrubber(avoid=[AvoidMotif("AAAAA"), AvoidMotif("GAATTC")], model=model)
+    result = scrubber.scrub(sequence)
+    assert len(result) == len(sequence)
+    assert scrubber.identify_codons_to_resample(result) == []
+
+
+def test_avoid_motif_set_matches_individual_motifs():
+    rng = random.Random(1)
+    motifs = ["".join(rng.choice("ACGT") for _ in range(rng.randint(3, 7))) for _ in range(100)]
+    motif_set = AvoidMotifSet(motifs)
+    for _ in range(10):
+        sequence = "".join(rng.choice("ACGT") for _ in range(300))
+        expected = sorted(set(x for motif in motifs for x in AvoidMotif(motif)(sequence)))
+        assert list(motif_set(sequence)) == expected
+
+
+def test_avoid_motif_set_overlaps_and_degenerate_bases():
+    motif_set = AvoidMotifSet(["AAAAA", "GGTCTCN"], reverse_complement=True)
+    starts, motifs = motif_set.find("AAAAAAGAGACCT")
+    assert list(starts) == [0, 1, 5]
+    assert list(motifs) == [0, 0, 1]
+    assert motif_set.intervals("AAAAAAGAGACCT").tolist() == [[0, 12]]
+    assert AvoidMotifSet(["GAATTC"])("GAATTCAAAAA").tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_scrubber_with_motif_set():
+    model = IndependentModel(sc_codon_use)
+    scrubber = Scrubber(avoid=[AvoidMotifSet(["AAAAA", "GAAC"])], model=model)
+    assert scrubber.scrub("AAAAAT") == "AAGAAT"
+
+
+def test_scrubber_reports_unsatisfiable_constraints():
+    # every codon for M is ATG 
+    motif = AvoidMotif("ATG")
+    scrubber = Scrubber(avoid=[motif], model=IndependentModel(sc_codon_use))
+    with pytest.raises(ScrubError) as error:
+        scrubber.scrub("AAAATGAAA")
+    assert error.value.unsatisfiable == [(1, [motif])]
+
+
+def test_scrubber_cleans_up_in_two_rounds():
+    model = IndependentModel(sc_codon_use)
+    sequence = model.generate_sequence("MKKKNNGSEFLLRRA" * 40, rng=0)
+    scrubber = Scrubber(avoid=[AvoidMotifSet(["AAAAA", "GAATTC", "GGTCTC"], reverse_complement=True)], model=model)
+    assert scrubber.identify_codons_to_resample(sequence)
+    result = scrubber.scrub(sequence, max_iterations=2, rng=0)
+    assert scrubber.identify_codons_to_resample(result) == []
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+def test_windowed_constraints_match_brute_force():
+    rng = random.Random(2)
+    gc, homopolymers, repeats = AvoidGCContent(0.35, 0.65, window=12), AvoidHomopolymers(3), AvoidRepeats(5, reverse_complement=True)
+    for _ in range(10):
+        sequence = "".join(rng.choice("ACGT") for _ in range(200))
+        expected = set()
+        for i in range(len(sequence) - 11):
+            if not 0.35 <= sum(base in "GC" for base in sequence[i:i + 12]) / 12 <= 0.65:
+                expected.update(range(i, i + 12))
+        assert list(gc(sequence)) == sorted(expected)
+
+        expected = set()
+        for i in range(len(sequence) - 3):
+            if len(set(sequence[i:i + 4])) == 1:
+                expected.update(range(i, i + 4))
+        assert list(homopolymers(sequence)) == sorted(expected)
+
+        kmers = [sequence[i:i + 5] for i in range(len(sequence) - 4)]
+        expected = set()
+        for i, kmer in enumerate(kmers):
+            others = kmers[:i] + kmers[i + 1:]
+            if kmer in others or reverse_complement(kmer) in others:
+                expected.update(range(i, i + 5))
+        assert list(repeats(sequence)) == sorted(expected)
+
+    assert list(AvoidRepeats(4)("ACGTNACGTN")) == [0, 1, 2, 3, 5, 6, 7, 8]
+    assert list(AvoidGCContent(window=50)("GCGC")) == []
+
+
+def test_incremental_update_matches_full_check_for_windowed_constraints():
+    rng = random.Random(3)
+    avoid = [AvoidGCContent(0.3, 0.7, window=20), AvoidHomopolymers(4), AvoidRepeats(8)]
+    scrubber = Scrubber(avoid=avoid, model=IndependentModel(sc_codon_use))
+    codons = ["".join(rng.choice("ACGT") for _ in range(3)) for _ in range(300)]
+    flagged_bases = scrubber.flag_bases("".join(codons))
+    for _ in range(20):
+        changed = sorted(rng.sample(range(len(codons)), 5))
+        for idx in changed:
+            codons[idx] = rng.choice(["AAA", "GGG", "GCC", "ATA", "TTT"])
+        sequence = "".join(codons)
+        scrubber.update_flagged_bases(sequence, flagged_bases, changed)
+        assert flagged_bases == scrubber.flag_bases(sequence)
+
+
+def test_scrub_gc_content_homopolymers_and_repeats():
+    model = IndependentModel(sc_codon_use)
+    sequence = model.generate_sequence("MKKKNNGSEFLLRRA" * 40, rng=0)
+    avoid = [AvoidGCContent(0.25, 0.6, window=30), AvoidHomopolymers(5), AvoidRepeats(24, reverse_complement=True)]
+    scrubber = Scrubber(avoid=avoid, model=model)
+    assert scrubber.identify_codons_to_resample(sequence)
+    result = scrubber.scrub(sequence, rng=0)
+    assert scrubber.identify_codons_to_resample(result) == []
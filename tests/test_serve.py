@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import numpy
+import pytest
+
+from espresso.serve import DesignServer, sampling_options
+from espresso.translation import translate
+
+
+proteins = ["MENFHHRPFKGGFGVGRVPTSLYY", "MACDEFGHIKLMNPQRSTVWY", "MKN", "MSENT", "MQQQQQQ", "MWWLLK"]
+
+
+def test_concurrent_requests_are_batched():
+    async def main():
+        server = DesignServer("fungi-v1", max_batch_size=4, max_wait_ms=50)
+        try:
+            sequences = await asyncio.gather(*(server.design(protein) for protein in proteins))
+            beams = await asyncio.gather(*(server.design(protein, strategy="beam") for protein in proteins[:2]))
+            return sequences, beams, server.metrics_dict()
+        finally:
+            await server.close()
+
+    sequences, beams, metrics = asyncio.run(main())
+    assert [translate(sequence) for sequence in sequences] == proteins
+    assert [translate(sequence) for sequence in beams] == proteins[:2]
+    assert metrics["requests"] == 8 and metrics["errors"] == 0
+    assert metrics["batch_sizes"] == {"2": 2, "4": 1}
+    assert metrics["queue_depth"] == 0 and metrics["latency_ms"]["p99"] > 0
+
+
+def test_failed_requests_dont_fail_the_batch():
+    async def main():
+        server = DesignServer("ec", max_batch_size=8, max_wait_ms=20)
+        try:
+            return await asyncio.gather(server.design("MKN"), server.design("MXB"), return_exceptions=True)
+        finally:
+            await server.close()
+
+    good, bad = asyncio.run(main())
+    assert translate(good) == "MKN"
+    assert isinstance(bad, KeyError)
+
+
+def test_options_that_arent_json_dont_stop_batching():
+    async def main():
+        server = DesignServer("ec", max_batch_size=8, max_wait_ms=20)
+        try:
+            first = await asyncio.wait_for(asyncio.gather(server.design("MKN", rng=numpy.random.default_rng(0)), 
+                                                          server.design("MKN", colors={"red"}), return_exceptions=True), 10)
+            return first, await asyncio.wait_for(server.design("MSENT"), 10)
+        finally:
+            await server.close()
+
+    (seeded, bad), good = asyncio.run(main())
+    assert translate(seeded) == "MKN"
+    assert isinstance(bad, TypeError)
+    assert translate(good) == "MSENT"
+
+
+def test_http_endpoints():
+    async def request(port, method, path, payload=None):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = b"" if payload is None else json.dumps(payload).encode()
+        writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        response = await reader.read()
+        writer.close()
+        head, _, content = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(content)
+
+    async def main():
+        server = DesignServer("ec")
+        http = await server.serve(port=0)
+        port = http.sockets[0].getsockname()[1]
+        try:
+            return [await request(port, "POST", "/design", {"protein": "MKN"}),
+                    await request(port, "POST", "/design", {"sequence": "MKN"}),
+                    await request(port, "POST", "/design", {"protein": "MKN", "options": {"seed": 1}}),
+                    await request(port, "POST", "/design", {"protein": "MKN", "options": {"batch_size": 2}}),
+                    await request(port, "POST", "/design", {"protein": "MKN", "options": {"top_p": 2}}),
+                    await request(port, "GET", "/metrics"),
+                    await request(port, "GET", "/nowhere")]
+        finally:
+            http.close()
+            await server.close()
+
+    design, bad_request, seeded, unknown, out_of_bounds, metrics, missing = asyncio.run(main())
+    assert design[0] == 200 and translate(design[1]["sequence"]) == "MKN"
+    assert bad_request[0] == 400
+    assert seeded[0] == 200 and translate(seeded[1]["sequence"]) == "MKN"
+    assert unknown[0] == out_of_bounds[0] == 400
+    assert "batch_size" in unknown[1]["error"] and "top_p" in out_of_bounds[1]["error"]
+    assert metrics[0] == 200 and metrics[1]["requests"] == 2
+    assert missing[0] == 404
+
+
+def test_sampling_options():
+    assert sampling_options({"strategy": "greedy", "temperature": 0.5, "top_k": 5, "top_p": 0.9, "seed": 3}) == \
+        {"strategy": "greedy", "temperature": 0.5, "top_k": 5, "top_p": 0.9, "rng": 3}
+    for options in ({"rng": 1}, {"stats": None}, {"temperature": 0}, {"top_k": 1.5}, {"seed": True}, {"strategy": "x"}, []):
+        with pytest.raises(ValueError):
+            sampling_options(options)
+
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        DesignServer("not-a-model")
@@ -0,0 +1,37 @@
+import espresso
+from espresso.lib import translate
+from espresso.stats import Stats, NULL_STATS
+
+
+def test_design_stats():
+    stats = Stats()
+    protein = "MENFHHRPFKGGFGVGRVPTSLYYSLSDF"
+    sequence = espresso.design_coding_sequence(protein, "fungi-v1", stats=stats)
+    assert translate(sequence) == protein
+
+    report = stats.as_dict()
+    assert {"load_model", "design", "tokenize", "encode", "decode", "check"} <= set(report["spans"])
+    assert report["counters"]["rounds"] == 1 and report["counters"]["retries"] == 0
+    assert report["counters"]["decode_steps"] == len(protein) + 1
+    assert report["counters"]["tokens"] == len(protein) + 1
+    assert report["counters"]["codons"] == len(protein)
+    assert report["rates"]["tokens_per_s"] > 0
+
+
+def test_scrub_stats_and_callback():
+    events = []
+    stats = Stats(callback=lambda kind, name, value: events.append((kind, name)))
+    sequence = espresso.design_coding_sequence("MKKKNNGSEF" * 10, "ec", stats=stats)
+    espresso.scrub_sequence(sequence + "GAATTC", ["GAATTC"], "ec", stats=stats)
+
+    report = stats.as_dict()
+    assert report["counters"]["codons"] == 100
+    assert report["counters"]["scrub_iterations"] >= 1
+    assert report["counters"]["codons_resampled"] >= 2
+    assert ("span", "scan") in events and ("count", "scrub_iterations") in events
+
+
+def test_null_stats_records_nothing():
+    with NULL_STATS.span("design"):
+        NULL_STATS.count("codons", 3)
+    assert not NULL_STATS.enabled and not hasattr(NULL_STATS, "spans")
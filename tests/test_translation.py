@@ -0,0 +1,46 @@
+import pytest
+
+from espresso.translation import (CODONS, SYNONYMOUS_CODONS, SYNONYMOUS_CODON_MASK, RESIDUE_TO_INDEX, 
+                                  codon_indices, join_codons, translate)
+
+
+def test_translation_matches_biotite():
+    sequence = pytest.importorskip("biotite.sequence")
+    for codon in CODONS:
+        assert translate(codon) == str(sequence.NucleotideSequence(codon).translate(complete=True))
+
+
+def test_translate_sequence():
+    assert translate("ATGGCTTGGtaa") == "MAW*"
+    assert join_codons(codon_indices("ATGGCTTGG")) == "ATGGCTTGG"
+    with pytest.raises(ValueError):
+        translate("ATGG")
+    with pytest.raises(ValueError):
+        translate("ATGNNN")
+
+
+def test_reverse_translation_tables():
+    assert [CODONS[idx] for idx in SYNONYMOUS_CODONS["M"]] == ["ATG"]
+    assert sorted(CODONS[idx] for idx in SYNONYMOUS_CODONS["*"]) == ["TAA", "TAG", "TGA"]
+    assert SYNONYMOUS_CODON_MASK[RESIDUE_TO_INDEX["L"]].sum() == 6
+    assert SYNONYMOUS_CODON_MASK.sum() == 61
+
+
+def test_codon_sequence_is_compact():
+    from espresso.lib import CodonSequence
+
+    sequence = CodonSequence("ATGAAAGGGTAA" * 1000)
+    assert sequence.indices.nbytes == len(sequence) == 4000
+    assert sequence.translate() == "MKG*" * 1000
+    assert bytes(sequence) == sequence.tobytes() == b"ATGAAAGGGTAA" * 1000
+
+    # slices are views, and codons are substituted in place 
+    view = sequence[1:3]
+    view[0] = "AAG"
+    assert sequence[1] == "AAG" and view == "AAGGGG"
+    sequence[4:6] = "GCTGCT"
+    assert str(sequence[:8]) == "ATGAAGGGGTAAGCTGCTGGGTAA"
+
+    copy = sequence.copy()
+    copy[0] = "ATG" if copy[0] != "ATG" else "TGG"
+    assert copy != sequence and CodonSequence(sequence) == sequence